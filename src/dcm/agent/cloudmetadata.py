@@ -13,7 +13,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
-import json
 import logging
 import os
 import socket
@@ -21,6 +20,7 @@ import urllib.error
 import urllib.parse
 import urllib.request
 
+import dcm.agent.codec as codec
 import dcm.agent.exceptions as exceptions
 import dcm.agent.utils as utils
 
@@ -408,7 +408,7 @@ class OpenStackMetaData(CloudMetaData):
 
         try:
             json_data = _get_metadata_server_url_data(self.base_url)
-            jdict = json.loads(json_data)
+            jdict = codec.loads(json_data)
             return jdict[key]
         except:
             _g_logger.exception("Failed to get the OpenStack metadata")
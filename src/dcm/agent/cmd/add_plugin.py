@@ -65,8 +65,9 @@ def get_plugin_details(full_module_name, short_module_name):
                 if cmd_name is None:
                     cmd_name = short_module_name
                 long_runner = getattr(c, 'long_runner', None)
+                durability = getattr(c, 'durability', None)
 
-                return (cmd_name, long_runner)
+                return (cmd_name, long_runner, durability)
         except TypeError:
             pass
     return None
@@ -87,7 +88,8 @@ def find_plugins(base_module_name):
                 if plugin_info is not None:
                     plugin_list.append({'module_name': full_mod_name,
                                         'command_name': plugin_info[0],
-                                        'long_runner': plugin_info[1]})
+                                        'long_runner': plugin_info[1],
+                                        'durability': plugin_info[2]})
     except Exception as ex:
         print(str(ex))
     return plugin_list
@@ -109,6 +111,8 @@ def rewrite_conf(conf_file, module_list, prefix, force):
         parser.set(section_name, "module_name", m['module_name'])
         if m['long_runner'] is not None:
             parser.set(section_name, "long_runner", str(m['long_runner']))
+        if m.get('durability') is not None:
+            parser.set(section_name, "durability", m['durability'])
 
     with open(conf_file, "w") as fptr:
         parser.write(fptr)
@@ -163,7 +167,8 @@ def main(args=sys.argv):
 
         module_list = [{'module_name': opts.module_name,
                         'command_name': plugin_name,
-                        'long_runner': plugin_info[1]}]
+                        'long_runner': plugin_info[1],
+                        'durability': plugin_info[2]}]
 
     rewrite_conf(conf.plugin_configfile, module_list,
                  opts.prefix, opts.overwrite)
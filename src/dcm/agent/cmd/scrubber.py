@@ -252,6 +252,9 @@ def clean_agent_files(opts, tar):
     if not opts.agent_running:
         clean_agent_logs(opts, tar, log_dir)
         files_to_clean.append(conf.storage_dbfile)
+        # the write ahead log and its index when the db is in WAL mode
+        files_to_clean.append(conf.storage_dbfile + "-wal")
+        files_to_clean.append(conf.storage_dbfile + "-shm")
 
     for f in files_to_clean:
         if os.path.exists(f):
@@ -18,7 +18,6 @@ from __future__ import print_function
 import argparse
 import datetime
 import clint
-import json
 import logging
 import os
 import psutil
@@ -29,6 +28,7 @@ import tarfile
 import dcm.agent
 import dcm.agent.cloudmetadata as cm
 import dcm.agent.config as config
+import dcm.agent.connection.stats as conn_stats
 import dcm.agent.dispatcher as dispatcher
 import dcm.agent.exceptions as exceptions
 import dcm.agent.handshake as handshake
@@ -36,6 +36,7 @@ import dcm.agent.logger as logger
 import dcm.agent.messaging as messaging
 import dcm.agent.messaging.persistence as persistence
 import dcm.agent.messaging.reply as reply
+import dcm.agent.messaging.states as states
 import dcm.agent.ossec as ossec
 import dcm.agent.utils as utils
 import dcm.agent.systemstats as systemstats
@@ -53,8 +54,12 @@ class DCMAgent(object):
         self.intrusion_detection = None
         self.request_listener = None
         self.g_logger = logging.getLogger(__name__)
-        self._db = persistence.SQLiteAgentDB(conf.storage_dbfile)
+        self._db = persistence.SQLiteAgentDB(
+            conf.storage_dbfile,
+            journal_mode=conf.storage_db_journal_mode,
+            synchronous=conf.storage_db_synchronous)
         self.db_cleaner = None
+        self._stats_snapshot_timer = None
         self.handshaker = handshake.HandshakeManager(self.conf, self._db)
         events.global_pubsub.subscribe(
             events.DCMAgentTopics.CLEANUP, self.clean_db_handler)
@@ -69,6 +74,28 @@ class DCMAgent(object):
     def stack_trace_handler(self, signum, frame):
         utils.build_assertion_exception(self.g_logger, "signal stack")
 
+    def _register_stats_snapshot(self):
+        self._stats_snapshot_timer = events.global_space.register_callback(
+            self.write_stats_snapshot,
+            delay=self.conf.connection_stats_snapshot_interval,
+            in_thread=True)
+
+    def write_stats_snapshot(self):
+        self._stats_snapshot_timer = None
+        if self.shutting_down:
+            return
+        stats = self.conn.get_connection_stats()
+        if stats is None:
+            return
+        try:
+            conn_stats.write_snapshot(
+                os.path.join(self.conf.storage_base_dir,
+                             conn_stats.SNAPSHOT_FILE_NAME), stats)
+        except Exception:
+            self.g_logger.exception("Failed to write the connection "
+                                    "statistics")
+        self._register_stats_snapshot()
+
     def shutdown_main_loop(self):
         self.shutting_down = True
         events.global_space.wakeup(cancel_all=True)
@@ -97,12 +124,28 @@ class DCMAgent(object):
 
     def run_agent(self):
         try:
+            events.set_event_space_type(self.conf.events_space_type)
+            events.global_space.configure_thread_pool(
+                max_threads=self.conf.workers_callback_threads,
+                max_queue=self.conf.workers_callback_queue_depth)
+
+            # a full VACUUM is only safe before anything else uses the DB
+            self._db.convert_auto_vacuum()
             self.db_cleaner = persistence.DBCleaner(
-                self._db, self.conf.storage_db_timeout, 100000, 3600)
+                self._db, self.conf.storage_db_timeout,
+                self.conf.storage_db_max_rows,
+                self.conf.storage_db_sweep_interval,
+                max_file_size=self.conf.storage_db_max_size)
             self.db_cleaner.start()
+            if self.conf.storage_group_commit_interval > 0:
+                self._db.start_group_commit(
+                    self.conf.storage_group_commit_interval)
 
             # def get a connection object
-            self.conn = config.get_connection_object(self.conf)
+            self.conn = config.get_connection_object(self.conf, db=self._db)
+            conn_stats.set_active_connection(self.conn)
+            if self.conf.connection_stats_snapshot_interval > 0:
+                self._register_stats_snapshot()
             self.disp = dispatcher.Dispatcher(self.conf)
 
             # this is done in two steps because we only want to fork before the
@@ -156,13 +199,20 @@ class DCMAgent(object):
         if self.disp:
             self.g_logger.debug("Stopping the dispatcher")
             self.disp.stop()
+        if self._stats_snapshot_timer is not None:
+            events.global_space.cancel_callback(self._stats_snapshot_timer)
+        conn_stats.set_active_connection(None)
         if self.conn:
             self.g_logger.debug("Closing the connection")
             self.conn.close()
-
         self.g_logger.debug("Waiting for all threads and callbacks in the "
                             "event system.")
         events.global_space.reset()
+
+        # nothing is left that can write so the last group commit batch is
+        # committed by close()
+        self.g_logger.debug("Closing the agent database")
+        self._db.close()
         self.g_logger.debug("Service closed")
 
 
@@ -307,74 +357,117 @@ def start_main_service(cli_args):
     return 0
 
 
-def get_status(cli_args):
-    config_files = config.get_config_files(conffile=cli_args.conffile)
-    conf = config.AgentConfig(config_files)
+def _format_seconds(value):
+    if value is None:
+        return "-"
+    if value < 1.0:
+        return "%.1fms" % (value * 1000.0)
+    return "%.2fs" % value
 
-    db_obj = messaging.persistence.SQLiteAgentDB(conf.storage_dbfile)
 
-    complete = db_obj.get_all_complete()
-    replied = db_obj.get_all_reply()
-    rejected = db_obj.get_all_rejected()
-    acked = db_obj.get_all_ack()
-    reply_nacked = db_obj.get_all_reply_nacked()
-    status = "UNKNOWN"
-    color_func = clint.textui.colored.yellow
+def _print_connection_stats(conf, label_col_width):
+    snapshot = conn_stats.read_snapshot(
+        os.path.join(conf.storage_base_dir, conn_stats.SNAPSHOT_FILE_NAME))
+    if snapshot is None:
+        return
+    written_at, stats = snapshot
+    written_str = datetime.datetime.fromtimestamp(written_at).strftime(
+        "%Y-%m-%d %H:%M:%S")
+    rows = [("Connection state: ", str(stats.get("state"))),
+            ("Connection as of: ", written_str),
+            ("Round trip time: ", _format_seconds(stats.get("last_rtt"))),
+            ("Smoothed round trip time: ",
+             _format_seconds(stats.get("smoothed_rtt"))),
+            ("Last handshake time: ",
+             _format_seconds(stats.get("last_handshake_time"))),
+            ("Reconnects: ", str(stats.get("reconnects"))),
+            ("Frames sent/received: ", "%s/%s" % (stats.get("frames_out"),
+                                                  stats.get("frames_in"))),
+            ("Bytes sent/received: ", "%s/%s" % (stats.get("bytes_out"),
+                                                 stats.get("bytes_in"))),
+            ("Send queue depth: ",
+             str(stats.get("send_queue", {}).get("length")))]
+    with clint.textui.indent(4):
+        for k, v in rows:
+            clint.textui.puts(
+                clint.textui.columns([k, label_col_width],
+                                     [v, 70 - label_col_width]))
+
+
+# the status shown for a state of the initialize request
+_g_initialize_status = [
+    (states.ReplyStates.REPLY_ACKED, "INITIALIZED",
+     clint.textui.colored.green),
+    (states.ReplyStates.ACKED, "INITIALIZING", clint.textui.colored.green),
+    (states.ReplyStates.REPLY, "INITIALIZING", clint.textui.colored.green),
+    (states.ReplyStates.REPLY_NACKED, "UNKNOWN INITIALIZATION STATE",
+     clint.textui.colored.red),
+    (states.ReplyStates.NACKED, "INITIALIZATION REJECTED",
+     clint.textui.colored.red),
+]
 
-    def _check_command(cmd):
-        try:
-            payload_doc = request_doc['payload']
-            command = payload_doc['command']
-            if command == cmd:
-                return True
-        except:
-            pass
-        return False
-
-    for r in complete:
-        request_doc = json.loads(r.request_doc)
-        if _check_command("initialize"):
-            status = "INITIALIZED"
-            color_func = clint.textui.colored.green
-    for r in acked:
-        request_doc = json.loads(r.request_doc)
-        if _check_command("initialize"):
-            status = "INITIALIZING"
-            color_func = clint.textui.colored.green
-    for r in replied:
-        request_doc = json.loads(r.request_doc)
-        if _check_command("initialize"):
-            status = "INITIALIZING"
-            color_func = clint.textui.colored.green
-    for r in reply_nacked:
-        request_doc = json.loads(r.request_doc)
-        if _check_command("initialize"):
-            status = "UNKNOWN INITIALIZATION STATE"
-            color_func = clint.textui.colored.red
-
-    for r in rejected:
-        request_doc = json.loads(r.request_doc)
-        if _check_command("initialize"):
-            status = "INITIALIZATION REJECTED"
-            color_func = clint.textui.colored.red
 
+def _print_db_status(db_obj, label_col_width):
+    status = "UNKNOWN"
+    color_func = clint.textui.colored.yellow
+    init_states = db_obj.get_command_states("initialize")
+    # when initialize was sent more than once the later entries win
+    for state, state_status, state_color in _g_initialize_status:
+        if state in init_states:
+            status = state_status
+            color_func = state_color
     clint.textui.puts(color_func(status))
-    complete = db_obj.get_all_complete()
-    replied = db_obj.get_all_reply()
-    rejected = db_obj.get_all_rejected()
-    acked = db_obj.get_all_ack()
-    reply_nacked = db_obj.get_all_reply_nacked()
 
-    label_col_width = 30
-    vals = [(complete, "Commands processed: "),
-            (rejected, "Commands rejected: "),
-            (acked, "Commands being processed: "),
-            (replied, "Commands being replying to: "),
-            (reply_nacked, "Replies rejected: ")]
+    counts = db_obj.count_by_state()
+    vals = [(states.ReplyStates.REPLY_ACKED, "Commands processed: "),
+            (states.ReplyStates.NACKED, "Commands rejected: "),
+            (states.ReplyStates.ACKED, "Commands being processed: "),
+            (states.ReplyStates.REPLY, "Commands being replying to: "),
+            (states.ReplyStates.REPLY_NACKED, "Replies rejected: ")]
     with clint.textui.indent(4):
-        for v, k in vals:
+        for state, k in vals:
             clint.textui.puts(
-                clint.textui.columns([k, label_col_width], [str(len(v)), 5]))
+                clint.textui.columns([k, label_col_width],
+                                     [str(counts.get(state, 0)), 5]))
+    try:
+        size_info = db_obj.get_size_info()
+        with clint.textui.indent(4):
+            clint.textui.puts(clint.textui.columns(
+                ["Database requests: ", label_col_width],
+                [str(sum(counts.values())), 12]))
+            clint.textui.puts(clint.textui.columns(
+                ["Database file size: ", label_col_width],
+                [str(size_info["file_size"]), 12]))
+    except Exception as ex:
+        clint.textui.puts(clint.textui.colored.red(
+            "The database size could not be read: %s" % str(ex)))
+
+
+def get_status(cli_args):
+    config_files = config.get_config_files(conffile=cli_args.conffile)
+    conf = config.AgentConfig(config_files)
+
+    # the agent may be running so the schema is left for it to upgrade
+    db_obj = messaging.persistence.SQLiteAgentDB(
+        conf.storage_dbfile,
+        journal_mode=conf.storage_db_journal_mode,
+        synchronous=conf.storage_db_synchronous,
+        migrate=False)
+    label_col_width = 30
+    try:
+        if db_obj.needs_migration():
+            clint.textui.puts(clint.textui.colored.yellow(
+                "UNKNOWN: the database has not been upgraded by the agent "
+                "yet"))
+        else:
+            _print_db_status(db_obj, label_col_width)
+    finally:
+        db_obj.close()
+    try:
+        _print_connection_stats(conf, label_col_width)
+    except Exception as ex:
+        clint.textui.puts(clint.textui.colored.red(
+            "The connection statistics could not be read: %s" % str(ex)))
 
     try:
         pid_file = os.path.join(conf.storage_base_dir, "dcm-agent.pid")
@@ -0,0 +1,87 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+The JSON encoder and decoder used for everything the agent puts on the wire
+or in its database.
+
+orjson is used when it is installed, then ujson, and otherwise the standard
+library json module.  Encoding always returns a str so the result can be
+written to a text websocket frame or a database column.  Decoding accepts
+str or bytes so data read off of the socket does not have to be decoded to
+a str first.
+"""
+import json
+import logging
+
+
+_g_logger = logging.getLogger(__name__)
+
+
+def _std_dumps(obj):
+    return json.dumps(obj)
+
+
+def _std_loads(data):
+    return json.loads(data)
+
+
+try:
+    import orjson
+
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def _fast_dumps(obj):
+        return orjson.dumps(obj, option=_ORJSON_OPTIONS).decode()
+
+    _fast_loads = orjson.loads
+    BACKEND = "orjson"
+except ImportError:
+    try:
+        import ujson
+
+        def _fast_dumps(obj):
+            return ujson.dumps(obj, ensure_ascii=False)
+
+        _fast_loads = ujson.loads
+        BACKEND = "ujson"
+    except ImportError:
+        _fast_dumps = _std_dumps
+        _fast_loads = _std_loads
+        BACKEND = "json"
+
+
+def dumps(obj):
+    """
+    :param obj: The object to encode.
+    :return: The JSON document as a str.
+    """
+    try:
+        return _fast_dumps(obj)
+    except (TypeError, OverflowError):
+        if _fast_dumps is _std_dumps:
+            raise
+        # the fast encoders refuse a few things that json accepts, such as
+        # integers larger than 64 bits
+        return _std_dumps(obj)
+
+
+def loads(data):
+    """
+    :param data: A JSON document as str, bytes or bytearray.
+    :return: The decoded object.
+    :raise ValueError: If data is not valid JSON.
+    """
+    return _fast_loads(data)
@@ -23,6 +23,8 @@ import yaml
 import dcm
 import dcm.agent.cloudmetadata as cloudmetadata
 from dcm.agent.cloudmetadata import CLOUD_TYPES
+import dcm.agent.connection.async_websocket as async_websocket
+import dcm.agent.connection.outbox as outbox
 import dcm.agent.connection.websocket as websocket
 import dcm.agent.exceptions as exceptions
 import dcm.agent.job_runner as job_runner
@@ -49,7 +51,7 @@ def get_python_script_dir():
     return os.path.join(_ROOT, 'scripts')
 
 
-def get_connection_object(conf):
+def get_connection_object(conf, db=None):
     con_type = conf.connection_type
     if not con_type:
         raise exceptions.AgentOptionValueNotSetException("connection_type")
@@ -75,16 +77,52 @@ def get_connection_object(conf):
         if not conf.connection_agentmanager_url:
             raise exceptions.AgentOptionValueNotSetException(
                 "[connection]agentmanager_url")
+        conn_outbox = None
+        if db is not None and conf.connection_resumable_session:
+            conn_outbox = outbox.Outbox(
+                db, max_documents=conf.connection_outbox_max_documents,
+                overflow=conf.connection_send_queue_overflow)
         con = websocket.WebSocketConnection(
             conf.connection_agentmanager_url,
             backoff_amount=conf.connection_backoff,
             max_backoff=conf.connection_max_backoff,
             heartbeat=conf.connection_heartbeat_frequency,
             allow_unknown_certs=conf.connection_allow_unknown_certs,
-            ca_certs=conf.connection_ca_cert)
+            ca_certs=conf.connection_ca_cert,
+            batch_max_bytes=conf.connection_batch_max_bytes,
+            send_queue_max_bytes=conf.connection_send_queue_max_bytes,
+            send_queue_overflow=conf.connection_send_queue_overflow,
+            compression_level=conf.connection_compression_level,
+            compression_threshold=conf.connection_compression_threshold,
+            backoff_strategy=conf.connection_backoff_strategy,
+            outbox=conn_outbox,
+            ping_interval=conf.connection_ping_interval,
+            probe_interval=conf.connection_probe_interval,
+            tls_session_resumption=conf.connection_tls_session_resumption)
+    elif con_type == "ws_async":
+        if not conf.connection_agentmanager_url:
+            raise exceptions.AgentOptionValueNotSetException(
+                "[connection]agentmanager_url")
+        con = async_websocket.AsyncWebSocketConnection(
+            conf.connection_agentmanager_url,
+            backoff_amount=conf.connection_backoff,
+            max_backoff=conf.connection_max_backoff,
+            heartbeat=conf.connection_heartbeat_frequency,
+            allow_unknown_certs=conf.connection_allow_unknown_certs,
+            ca_certs=conf.connection_ca_cert,
+            batch_max_bytes=conf.connection_batch_max_bytes,
+            send_queue_max_bytes=conf.connection_send_queue_max_bytes,
+            send_queue_overflow=conf.connection_send_queue_overflow,
+            compression_level=conf.connection_compression_level,
+            compression_threshold=conf.connection_compression_threshold,
+            backoff_strategy=conf.connection_backoff_strategy,
+            ping_interval=conf.connection_ping_interval,
+            probe_interval=conf.connection_probe_interval,
+            connect_timeout=conf.connection_connect_timeout)
     else:
         raise exceptions.AgentOptionValueException(
-            "[connection]type", con_type, "ws,success_tester,dummy")
+            "[connection]type", con_type,
+            "ws,ws_async,success_tester,dummy")
     return con
 
 
@@ -323,23 +361,117 @@ def build_options_list():
                            "processing long running plugins (anything that "
                            "returns a job description)"),
 
+        ConfigOpt("workers", "callback_threads", int, default=8, minv=1,
+                  help_msg="The maximum number of threads used to run "
+                           "blocking event callbacks (for example forming "
+                           "a new connection)."),
+        ConfigOpt("workers", "callback_queue_depth", int, default=256,
+                  minv=0,
+                  help_msg="The number of blocking event callbacks that can "
+                           "wait for a free thread.  Callbacks beyond this "
+                           "are rejected."),
+
+        ConfigOpt("events", "space_type", str, default="threaded",
+                  options=["threaded", "asyncio"],
+                  help_msg="The implementation of the agent's main event "
+                           "loop.  threaded uses a condition variable, "
+                           "asyncio runs the loop on an asyncio event loop."),
+
         ConfigOpt("connection", "type", str, default="ws", options=None,
                   help_msg="The type of connection object to use.  Supported "
-                           "types are ws and fallback"),
+                           "types are ws and fallback.  ws_async runs the "
+                           "websocket on the asyncio event loop and needs "
+                           "[events]space_type=asyncio."),
         FilenameOpt("connection", "source_file", default=None),
         FilenameOpt("connection", "dest_file", default=None),
         ConfigOpt("connection", "agentmanager_url", str, default=None,
                   help_msg="The url of the agent manager with which this "
-                           "agent will communicate."),
+                           "agent will communicate.  Several comma "
+                           "separated urls may be given, the agent "
+                           "connects to the fastest one that is up and "
+                           "fails over to the others."),
+        ConfigOpt("connection", "probe_interval", int, default=300, minv=0,
+                  help_msg="The number of seconds between measurements of "
+                           "the connect latency to each agent manager url "
+                           "when more than one is configured."),
+        ConfigOpt("connection", "connect_timeout", int, default=30, minv=0,
+                  help_msg="The number of seconds the asyncio websocket "
+                           "connection waits for the TCP connect, the TLS "
+                           "handshake and the websocket upgrade to finish.  "
+                           "0 waits forever."),
         ConfigOpt("connection", "backoff", int, default=1000,
                   help_msg="The number of milliseconds to add to the wait "
                            "time before retrying a failed connection."),
         ConfigOpt("connection", "max_backoff", int, default=300000,
                   help_msg="The maximum number of milliseconds to wait before "
                            "retrying a failed connection."),
+        ConfigOpt("connection", "backoff_strategy", str,
+                  default="decorrelated_jitter",
+                  options=["exponential", "full_jitter",
+                           "decorrelated_jitter"],
+                  help_msg="How the wait before retrying a failed connection "
+                           "grows.  exponential doubles it, the jitter "
+                           "strategies randomize it so that many agents do "
+                           "not reconnect at the same moment."),
         ConfigOpt("connection", "heartbeat_frequency", int, default=30,
                   help_msg="The maximum number of milliseconds to wait before "
                            "retrying a failed connection."),
+        ConfigOpt("connection", "batch_max_bytes", int, default=65536,
+                  minv=0,
+                  help_msg="The largest websocket frame, in bytes, that "
+                           "queued messages are packed into when the agent "
+                           "manager supports message batching.  0 disables "
+                           "batching."),
+        ConfigOpt("connection", "compression_level", int, default=6,
+                  minv=0, maxv=9,
+                  help_msg="The zlib level used to compress large websocket "
+                           "frames when the agent manager supports message "
+                           "compression.  0 disables compression."),
+        ConfigOpt("connection", "compression_threshold", int, default=1024,
+                  minv=0,
+                  help_msg="Websocket frames smaller than this many bytes "
+                           "are sent uncompressed."),
+        ConfigOpt("connection", "resumable_session", bool, default=True,
+                  help_msg="Keep the messages sent to the agent manager in "
+                           "a sequence numbered outbox in the agent "
+                           "database so that only the messages it missed are "
+                           "sent again after a reconnect.  The manager must "
+                           "support it as well."),
+        ConfigOpt("connection", "outbox_max_documents", int,
+                  default=10000, minv=0,
+                  help_msg="The most messages kept in the outbox while the "
+                           "agent manager has not acknowledged them.  The "
+                           "send_queue_overflow policy picks the ones "
+                           "dropped.  0 means no limit."),
+        ConfigOpt("connection", "send_queue_max_bytes", int,
+                  default=4194304, minv=0,
+                  help_msg="The most encoded bytes of outgoing messages that "
+                           "are held while the connection to the agent "
+                           "manager is down.  0 means no limit."),
+        ConfigOpt("connection", "send_queue_overflow", str,
+                  default="drop_oldest",
+                  options=["drop_oldest", "drop_newest"],
+                  help_msg="What to do with an outgoing message that does "
+                           "not fit in send_queue_max_bytes.  drop_oldest "
+                           "discards the messages that have waited the "
+                           "longest, drop_newest discards the new message."),
+        ConfigOpt("connection", "ping_interval", int, default=60, minv=0,
+                  help_msg="The number of seconds between the websocket "
+                           "pings used to measure the round trip time to "
+                           "the agent manager.  0 disables them."),
+        ConfigOpt("connection", "stats_snapshot_interval", int, default=60,
+                  minv=0,
+                  help_msg="The number of seconds between writes of the "
+                           "connection statistics to the file that "
+                           "dcm-agent status reports from.  0 disables "
+                           "the file."),
+        ConfigOpt("connection", "tls_session_resumption", bool,
+                  default=True,
+                  help_msg="Offer the TLS session of the previous "
+                           "connection to the agent manager when "
+                           "reconnecting so that a full TLS handshake can "
+                           "be skipped.  This only applies to the ws "
+                           "connection type."),
         ConfigOpt("connection", "allow_unknown_certs", bool, default=False,
                   help_msg="A flag to disable DCM certificate verification. "
                            "When disabled certificates will be ignored. This "
@@ -363,7 +495,33 @@ def build_options_list():
         ConfigOpt("storage", "db_timeout", int, default=60*60*4,
                   help_msg="The amount of time in seconds for a request id to "
                            "stay in the database."),
+        ConfigOpt("storage", "db_max_rows", int, default=100000,
+                  help_msg="The most finished requests that are kept in "
+                           "the database.  0 means no limit."),
+        ConfigOpt("storage", "db_max_size", int, default=64*1024*1024,
+                  help_msg="The most bytes of request data that are kept "
+                           "in the database.  The oldest finished requests "
+                           "are removed past it.  0 means no limit."),
+        ConfigOpt("storage", "db_sweep_interval", int, default=600,
+                  help_msg="The number of seconds between sweeps of old "
+                           "requests out of the database."),
         ConfigOpt("storage", "default_filesystem", str, default="ext3"),
+        ConfigOpt("storage", "db_journal_mode", str, default="WAL",
+                  options=["WAL", "DELETE", "TRUNCATE"],
+                  help_msg="The sqlite journal mode of the agent database."),
+        ConfigOpt("storage", "db_synchronous", str, default="FULL",
+                  options=["FULL", "NORMAL"],
+                  help_msg="The sqlite synchronous level of the agent "
+                           "database.  FULL makes every commit survive a "
+                           "power loss, NORMAL with the WAL journal mode "
+                           "only survives a crash of the agent but commits "
+                           "without waiting for the disk."),
+        ConfigOpt("storage", "group_commit_interval", float, default=0.005,
+                  help_msg="The number of seconds that request state changes "
+                           "are batched before they are committed to the "
+                           "database together.  Acknowledgements still wait "
+                           "for their record to be committed.  0 commits "
+                           "every change on its own."),
 
         ConfigOpt("system", "user", str, default="dcm"),
         ConfigOpt("system", "sudo", str, default="/usr/bin/sudo"),
@@ -0,0 +1,463 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+A websocket connection to the agent manager that runs on the asyncio event
+loop of the agent's event space instead of its own threads.
+
+The wire protocol is the same as connection.websocket: the same handshake,
+BATCH frames and compression.  ws4py's frame parser and builder are used
+for the websocket framing on top of asyncio streams.
+"""
+import asyncio
+import base64
+import hashlib
+import logging
+import os
+import ssl
+import time
+import urllib.parse
+
+import ws4py.streaming as ws4py_streaming
+
+import dcm.agent.codec as codec
+import dcm.agent.connection.connection_interface as conn_iface
+import dcm.agent.connection.endpoints as endpoints
+import dcm.agent.connection.stats as conn_stats
+import dcm.agent.connection.tls as tls
+import dcm.agent.connection.websocket as websocket
+import dcm.agent.exceptions as exceptions
+import dcm.agent.handshake as handshake
+import dcm.agent.utils as agent_utils
+
+from dcm.agent.events.globals import global_space as dcm_events
+
+
+_g_logger = logging.getLogger(__name__)
+_g_wire_logger = agent_utils.get_wire_logger()
+
+_WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+_READ_SIZE = 65536
+
+
+def _accept_key(key):
+    digest = hashlib.sha1((key + _WS_GUID).encode()).digest()
+    return base64.b64encode(digest).decode()
+
+
+class _WsStream(object):
+    """
+    One open websocket on a pair of asyncio streams.
+    """
+
+    def __init__(self, reader, writer, stats):
+        self._reader = reader
+        self._writer = writer
+        self._stats = stats
+        self._stream = ws4py_streaming.Stream(always_mask=True,
+                                              expect_masking=False)
+        self._read_size = 2
+
+    @classmethod
+    async def open(cls, url, stats, ssl_context=None, protocols=None):
+        parsed = urllib.parse.urlparse(url)
+        secure = parsed.scheme in ("wss", "https")
+        port = parsed.port or (443 if secure else 80)
+        path = parsed.path or "/"
+        if parsed.query:
+            path = path + "?" + parsed.query
+        if not secure:
+            ssl_context = None
+        elif ssl_context is None:
+            ssl_context = ssl.create_default_context()
+
+        reader, writer = await asyncio.open_connection(
+            parsed.hostname, port, ssl=ssl_context)
+        try:
+            key = base64.b64encode(os.urandom(16)).decode()
+            request = ["GET %s HTTP/1.1" % path,
+                       "Host: %s:%d" % (parsed.hostname, port),
+                       "Upgrade: websocket",
+                       "Connection: Upgrade",
+                       "Sec-WebSocket-Key: %s" % key,
+                       "Sec-WebSocket-Version: 13"]
+            if protocols:
+                request.append("Sec-WebSocket-Protocol: %s"
+                               % ",".join(protocols))
+            writer.write(("\r\n".join(request) + "\r\n\r\n").encode())
+            await writer.drain()
+
+            response = await reader.readuntil(b"\r\n\r\n")
+            lines = response.decode("latin-1").split("\r\n")
+            status = lines[0].split(" ", 2)
+            if len(status) < 2 or status[1] != "101":
+                raise exceptions.AgentConnectionException(
+                    1, "The websocket upgrade was refused: %s" % lines[0])
+            headers = {}
+            for line in lines[1:]:
+                if ":" in line:
+                    name, value = line.split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+            if headers.get("sec-websocket-accept") != _accept_key(key):
+                raise exceptions.AgentConnectionException(
+                    1, "The websocket upgrade had a bad accept key")
+        except BaseException:
+            writer.close()
+            raise
+        return cls(reader, writer, stats)
+
+    def send(self, payload, binary=False):
+        if binary:
+            msg = self._stream.binary_message(payload)
+        else:
+            msg = self._stream.text_message(payload)
+        _g_wire_logger.debug("OUTGOING\n--------\n%s\n--------" % str(payload))
+        self._writer.write(msg.single(mask=True))
+        self._stats.frame_sent(len(payload))
+
+    def ping(self):
+        self._writer.write(self._stream.ping(self._stats.next_ping()))
+
+    async def drain(self):
+        await self._writer.drain()
+
+    async def receive(self):
+        """
+        :return: The next text or binary message.  Control frames are
+        handled here.
+        :raise ConnectionError: When the websocket is closed.
+        """
+        s = self._stream
+        while True:
+            data = await self._reader.read(self._read_size)
+            if not data:
+                raise ConnectionError("The websocket connection was closed")
+            self._read_size = s.parser.send(data) or 2
+            if s.closing is not None:
+                raise ConnectionError(
+                    "The websocket was closed %d %s"
+                    % (s.closing.code, s.closing.reason))
+            if s.errors:
+                error = s.errors[0]
+                raise ConnectionError(
+                    "Websocket protocol error %d %s"
+                    % (error.code, error.reason))
+            for ping in s.pings:
+                self._writer.write(s.pong(ping.data))
+            for pong in s.pongs:
+                self._stats.pong_received(pong.data)
+            s.pings = []
+            s.pongs = []
+            if s.has_message:
+                m = s.message
+                s.message = None
+                self._stats.frame_received(len(m.data))
+                _g_wire_logger.debug(
+                    "INCOMING\n--------\n%s\n--------" % str(m.data))
+                return m
+
+    def close(self):
+        try:
+            self._writer.write(self._stream.close().single(mask=True))
+        except Exception as ex:
+            _g_logger.debug("Could not send the websocket close %s"
+                            % str(ex))
+        self._writer.close()
+
+
+class AsyncWebSocketConnection(conn_iface.ConnectionInterface):
+    """
+    A ConnectionInterface implemented as a task on the asyncio loop of the
+    agent's event space.  It needs the asyncio event space and does not
+    start any threads of its own.
+
+    send() may be called from any thread, the documents are queued and the
+    connection task is woken up on the loop.  Documents from the manager
+    are handed to the receive callback through the event space just like
+    the threaded connection does.
+    """
+
+    def __init__(self, server_url,
+                 backoff_amount=5000, max_backoff=300000,
+                 heartbeat=None, allow_unknown_certs=False, ca_certs=None,
+                 batch_max_bytes=0, send_queue_max_bytes=0,
+                 send_queue_overflow=websocket.SendQueueOverflow.DROP_OLDEST,
+                 compression_level=0, compression_threshold=1024,
+                 backoff_strategy=websocket.BackoffStrategy.EXPONENTIAL,
+                 ping_interval=0, probe_interval=300, connect_timeout=30,
+                 loop=None):
+        self._endpoints = endpoints.EndpointSelector(
+            endpoints.parse_urls(server_url),
+            max_cool_off=float(max_backoff) / 1000.0,
+            probe_interval=probe_interval)
+        self._server_url = self._endpoints.select()
+        self._loop = loop
+        self._send_queue = websocket.RepeatQueue(
+            max_bytes=send_queue_max_bytes, overflow=send_queue_overflow)
+        self._backoff = websocket.Backoff(float(max_backoff) / 1000.0,
+                                          float(backoff_amount) / 1000.0,
+                                          strategy=backoff_strategy)
+        self._heartbeat_freq = heartbeat
+        self._ping_interval = ping_interval
+        self._stats = conn_stats.ConnectionStats()
+        self._stats.state_changed(websocket.WsConnStates.WAITING)
+        if allow_unknown_certs:
+            cert_reqs = ssl.CERT_NONE
+        else:
+            cert_reqs = ssl.CERT_REQUIRED
+        # the certificates are checked the same way the threaded
+        # connection checks them
+        self._tls_connector = tls.TLSConnector(cert_reqs=cert_reqs,
+                                               ca_certs=ca_certs)
+        self._connect_timeout = connect_timeout
+        self._batch_max_bytes = batch_max_bytes
+        self._compression_level = compression_level
+        self._compression_threshold = compression_threshold
+        self._receive_callback = None
+        self._handshake_manager = None
+        self._task = None
+        self._wakeup = None
+        self._closing = False
+        self._ws = None
+        self._open = False
+
+    def _call_on_loop(self, func, *args):
+        self._loop.call_soon_threadsafe(func, *args)
+
+    def connect(self, receive_callback, handshake_manager):
+        if self._loop is None:
+            try:
+                self._loop = dcm_events.get_loop()
+            except AttributeError:
+                raise exceptions.AgentOptionValueException(
+                    "[events]space_type", "threaded", "asyncio")
+        self._receive_callback = receive_callback
+        self._handshake_manager = handshake_manager
+        self._call_on_loop(self._start)
+
+    def _start(self):
+        self._wakeup = asyncio.Event()
+        self._task = self._loop.create_task(self._run())
+
+    def send(self, doc):
+        _g_logger.debug("Adding a message to the send queue")
+        if self._send_queue.put(doc) and self._loop is not None:
+            self._call_on_loop(self._wake)
+
+    def _wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def request_complete(self, request_id):
+        self._send_queue.request_complete(request_id)
+
+    def get_send_queue_stats(self):
+        return self._send_queue.get_stats()
+
+    def get_connection_stats(self):
+        stats = self._stats.get_stats()
+        stats["url"] = self._server_url
+        stats["endpoints"] = self._endpoints.get_stats()
+        stats["send_queue"] = self._send_queue.get_stats()
+        return stats
+
+    def set_backoff(self, backoff_seconds):
+        self._backoff.force_backoff_time(backoff_seconds)
+
+    def is_open(self):
+        return self._open
+
+    def close(self):
+        _g_logger.debug("Websocket connection closed.")
+        if self._loop is None:
+            return
+        self._call_on_loop(self._close)
+
+    def _close(self):
+        self._closing = True
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        try:
+            while not self._closing:
+                delay = self._backoff.seconds_until_ready()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if self._endpoints.probe_due():
+                    await self._loop.run_in_executor(
+                        None, self._endpoints.probe)
+                try:
+                    await self._connect()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as ex:
+                    _g_logger.warning("Could not connect to %s: %s"
+                                      % (self._server_url, str(ex)))
+                    if self._endpoints.failed(self._server_url):
+                        _g_logger.info("Failing over to another endpoint")
+                    else:
+                        self._backoff.error()
+                    continue
+                try:
+                    await self._session()
+                    self._backoff.connection_lost()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as ex:
+                    _g_logger.warning("The connection to %s failed: %s"
+                                      % (self._server_url, str(ex)))
+                    self._backoff.error()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._open = False
+            self._stats.state_changed(websocket.WsConnStates.DONE)
+            if self._ws is not None:
+                self._ws.close()
+                self._ws = None
+
+    async def _connect(self):
+        self._server_url = self._endpoints.select()
+        self._stats.state_changed(websocket.WsConnStates.CONNECTING)
+        start = time.monotonic()
+        try:
+            ssl_context = None
+            if urllib.parse.urlparse(self._server_url).scheme in (
+                    "wss", "https"):
+                ssl_context = self._tls_connector.get_context()
+            # a manager that accepts the connection but never finishes the
+            # TLS handshake or the upgrade must not hold the task forever
+            self._ws = await asyncio.wait_for(
+                _WsStream.open(self._server_url, self._stats,
+                               ssl_context=ssl_context, protocols=['dcm']),
+                self._connect_timeout or None)
+        except BaseException:
+            self._stats.state_changed(websocket.WsConnStates.WAITING)
+            raise
+        self._endpoints.succeeded(self._server_url,
+                                  time.monotonic() - start)
+
+    async def _session(self):
+        try:
+            self._stats.state_changed(websocket.WsConnStates.HANDSHAKING)
+            hs = await self._handshake()
+            batch_limit = websocket.negotiate_batch_limit(
+                self._batch_max_bytes, hs)
+            compress_level = 0
+            if websocket.negotiate_compression(self._compression_level, hs):
+                compress_level = self._compression_level
+            self._backoff.activity()
+            self._open = True
+            self._stats.state_changed(websocket.WsConnStates.OPEN)
+
+            reader = self._loop.create_task(self._read_loop())
+            try:
+                await self._write_loop(reader, batch_limit, compress_level)
+            except (ConnectionError, OSError) as ex:
+                _g_logger.info("The connection to %s was lost: %s"
+                               % (self._server_url, str(ex)))
+            finally:
+                reader.cancel()
+        finally:
+            self._open = False
+            self._stats.state_changed(websocket.WsConnStates.WAITING)
+            self._ws.close()
+            self._ws = None
+
+    async def _handshake(self):
+        hs_doc = self._handshake_manager.get_send_document()
+        _g_logger.debug("Sending handshake")
+        self._stats.handshake_started()
+        self._ws.send(codec.dumps(hs_doc))
+        await self._ws.drain()
+
+        m = await self._ws.receive()
+        docs = websocket.decode_frame(m.data, m.is_binary)
+        hs = self._handshake_manager.incoming_document(docs[0])
+        self._stats.handshake_finished(
+            hs.reply_type ==
+            handshake.HandshakeIncomingReply.REPLY_CODE_SUCCESS)
+        if hs.reply_type != \
+                handshake.HandshakeIncomingReply.REPLY_CODE_SUCCESS:
+            _g_logger.warning("The handshake was rejected.")
+            if hs.reply_type == \
+                    handshake.HandshakeIncomingReply.REPLY_CODE_FORCE_BACKOFF:
+                self._backoff.force_backoff_time(hs.force_backoff)
+            raise exceptions.AgentHandshakeException(hs)
+        for doc in docs[1:]:
+            self._deliver(doc)
+        return hs
+
+    def _deliver(self, doc):
+        dcm_events.register_callback(self._receive_callback, args=[doc])
+
+    async def _read_loop(self):
+        while True:
+            m = await self._ws.receive()
+            for doc in websocket.decode_frame(m.data, m.is_binary):
+                self._deliver(doc)
+            self._backoff.activity()
+
+    def _wait_timeout(self, next_ping):
+        timeout = self._heartbeat_freq
+        if next_ping is not None:
+            until_ping = max(0.0, next_ping - time.monotonic())
+            if timeout is None or until_ping < timeout:
+                timeout = until_ping
+        return timeout
+
+    async def _write_loop(self, reader, batch_limit, compress_level):
+        next_ping = None
+        if self._ping_interval:
+            next_ping = time.monotonic() + self._ping_interval
+        while True:
+            if next_ping is not None and time.monotonic() >= next_ping:
+                next_ping = time.monotonic() + self._ping_interval
+                self._ws.ping()
+            docs = self._send_queue.get_all_encoded()
+            sent = 0
+            try:
+                for payload, binary, count in websocket.encode_messages(
+                        [msg for _, msg in docs], batch_limit,
+                        compress_level, self._compression_threshold):
+                    self._ws.send(payload, binary=binary)
+                    await self._ws.drain()
+                    sent += count
+            except BaseException:
+                # the documents that did not make it out go out on the
+                # next connection
+                for doc, msg in docs[sent:]:
+                    self._send_queue.put(doc, encoded=msg)
+                raise
+
+            if reader.done():
+                # raises the reason the connection went away
+                reader.result()
+                raise ConnectionError("The websocket reader stopped")
+            self._wakeup.clear()
+            if not self._send_queue.empty():
+                continue
+            waiter = self._loop.create_task(self._wakeup.wait())
+            try:
+                done, _ = await asyncio.wait(
+                    [waiter, reader], timeout=self._wait_timeout(next_ping),
+                    return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                waiter.cancel()
+            if not done and (next_ping is None or
+                             time.monotonic() < next_ping):
+                # a heartbeat, the round trip ping is sent at the top
+                self._ws.ping()
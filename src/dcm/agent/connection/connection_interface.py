@@ -29,6 +29,20 @@ class ConnectionInterface(object):
     def connect(self, receive_callback, handshake_manager):
         pass
 
+    def request_complete(self, request_id):
+        """
+        Called once a request has finished so that the connection can forget
+        any bookkeeping it keeps for it.
+        """
+        pass
+
+    def get_connection_stats(self):
+        """
+        :return: A dict of the performance counters kept by the connection
+        or None if it does not keep any.
+        """
+        return None
+
     @agent_util.not_implemented_decorator
     def close(self):
         """
@@ -0,0 +1,276 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Choosing which agent manager endpoint to connect to when several are
+configured.
+"""
+import errno
+import logging
+import selectors
+import socket
+import threading
+import time
+import urllib.parse
+
+
+_g_logger = logging.getLogger(__name__)
+
+# the weight given to a new latency sample
+LATENCY_SMOOTHING = 0.3
+
+
+def parse_urls(server_url):
+    """
+    :param server_url: A single URL, a comma separated string of URLs or a
+    list of URLs.
+    :return: The list of URLs with duplicates and blanks removed.
+    """
+    if isinstance(server_url, str):
+        server_url = server_url.split(",")
+    urls = []
+    for url in server_url:
+        url = url.strip()
+        if url and url not in urls:
+            urls.append(url)
+    return urls
+
+
+def _address(url):
+    parsed = urllib.parse.urlparse(url)
+    port = parsed.port
+    if port is None:
+        port = 443 if parsed.scheme in ("wss", "https") else 80
+    return parsed.hostname, port
+
+
+def probe_connect_latency(urls, timeout=2.0):
+    """
+    Open a TCP connection to every URL at the same time and time how long
+    each takes.  No data is sent.
+    :return: A dict of url to the connect time in seconds, or None if the
+    endpoint could not be reached within the timeout.
+    """
+    results = dict((url, None) for url in urls)
+    sel = selectors.DefaultSelector()
+    try:
+        for url in urls:
+            try:
+                host, port = _address(url)
+                family, kind, proto, _, addr = socket.getaddrinfo(
+                    host, port, 0, socket.SOCK_STREAM)[0]
+                sock = socket.socket(family, kind, proto)
+            except (OSError, ValueError) as ex:
+                _g_logger.info("Could not probe %s: %s" % (url, str(ex)))
+                continue
+            sock.setblocking(False)
+            start = time.monotonic()
+            rc = sock.connect_ex(addr)
+            if rc not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                sock.close()
+                continue
+            sel.register(sock, selectors.EVENT_WRITE, (url, start))
+
+        end = time.monotonic() + timeout
+        while sel.get_map():
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                break
+            for key, _ in sel.select(remaining):
+                url, start = key.data
+                sock = key.fileobj
+                if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0:
+                    results[url] = time.monotonic() - start
+                sel.unregister(sock)
+                sock.close()
+    finally:
+        for key in list(sel.get_map().values()):
+            key.fileobj.close()
+        sel.close()
+    return results
+
+
+class _Endpoint(object):
+
+    def __init__(self, url):
+        self.url = url
+        self.latency = None
+        self.connect_time = None
+        self.failures = 0
+        self.down_until = 0.0
+
+
+class EndpointSelector(object):
+    """
+    Tracks the health and connect latency of each configured agent manager
+    endpoint and picks the one to connect to next.
+
+    The fastest endpoint that is not down is preferred.  An endpoint that
+    fails is considered down for a cool off period that doubles with every
+    failure in a row, up to max_cool_off seconds, and is forgiven as soon as
+    a connection to it succeeds.  Endpoints are ranked by the TCP connect
+    latency that probe() measures.  The time a real connection takes also
+    includes the TLS handshake and the websocket upgrade, so it is kept
+    apart as connect_time and only reported.  All of the methods are
+    thread safe.
+    """
+
+    def __init__(self, urls, cool_off=5.0, max_cool_off=300.0,
+                 probe_interval=300.0, probe_timeout=2.0, probe=None,
+                 clock=None):
+        if not urls:
+            raise ValueError("At least one endpoint is required")
+        if probe is None:
+            probe = probe_connect_latency
+        if clock is None:
+            clock = time.monotonic
+        self._endpoints = [_Endpoint(url) for url in urls]
+        self._cool_off = cool_off
+        self._max_cool_off = max_cool_off
+        self._probe_interval = probe_interval
+        self._probe_timeout = probe_timeout
+        self._probe = probe
+        self._clock = clock
+        self._last_probe = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._endpoints)
+
+    def _find(self, url):
+        for ep in self._endpoints:
+            if ep.url == url:
+                return ep
+        return None
+
+    def _smooth(self, average, sample):
+        if average is None:
+            return sample
+        return average + LATENCY_SMOOTHING * (sample - average)
+
+    def _mark_down(self, ep, now):
+        ep.failures += 1
+        cool_off = min(self._max_cool_off,
+                       self._cool_off * (2 ** (ep.failures - 1)))
+        ep.down_until = now + cool_off
+
+    def _is_up(self, ep, now):
+        return ep.down_until <= now
+
+    def probe_due(self):
+        """
+        :return: A bool indicating if there is more than one endpoint and
+        they have not been probed in the last probe_interval seconds.
+        """
+        self._lock.acquire()
+        try:
+            if len(self._endpoints) < 2:
+                return False
+            return self._last_probe is None or \
+                self._clock() - self._last_probe >= self._probe_interval
+        finally:
+            self._lock.release()
+
+    def probe(self):
+        """
+        Measure the connect latency of every endpoint.  This blocks for up
+        to probe_timeout seconds and must not be called with locks held.
+        """
+        results = self._probe([ep.url for ep in self._endpoints],
+                              self._probe_timeout)
+        self._lock.acquire()
+        try:
+            now = self._clock()
+            self._last_probe = now
+            for ep in self._endpoints:
+                latency = results.get(ep.url)
+                if latency is None:
+                    _g_logger.info("The endpoint %s did not answer the "
+                                   "probe" % ep.url)
+                    self._mark_down(ep, now)
+                else:
+                    ep.latency = self._smooth(ep.latency, latency)
+                    ep.failures = 0
+                    ep.down_until = 0.0
+        finally:
+            self._lock.release()
+
+    def select(self):
+        """
+        :return: The URL to connect to next.  That is the fastest endpoint
+        that is up.  If all of them are down it is the one that comes back
+        up first.  Endpoints with no latency measurement yet rank after the
+        measured ones, in configured order.
+        """
+        self._lock.acquire()
+        try:
+            now = self._clock()
+            up = [ep for ep in self._endpoints if self._is_up(ep, now)]
+            if not up:
+                return min(self._endpoints,
+                           key=lambda ep: ep.down_until).url
+            measured = [ep for ep in up if ep.latency is not None]
+            if measured:
+                return min(measured, key=lambda ep: ep.latency).url
+            return up[0].url
+        finally:
+            self._lock.release()
+
+    def succeeded(self, url, connect_time=None):
+        """
+        :param url: The endpoint that a connection was made to.
+        :param connect_time: The number of seconds the whole connection
+        took, including the TLS handshake and the websocket upgrade.
+        """
+        self._lock.acquire()
+        try:
+            ep = self._find(url)
+            if ep is None:
+                return
+            ep.failures = 0
+            ep.down_until = 0.0
+            if connect_time is not None:
+                ep.connect_time = self._smooth(ep.connect_time, connect_time)
+        finally:
+            self._lock.release()
+
+    def failed(self, url):
+        """
+        :param url: The endpoint that a connection could not be made to.
+        :return: A bool indicating if another endpoint is up and can be
+        tried right away.
+        """
+        self._lock.acquire()
+        try:
+            now = self._clock()
+            ep = self._find(url)
+            if ep is not None:
+                self._mark_down(ep, now)
+            return any(self._is_up(other, now) for other in self._endpoints)
+        finally:
+            self._lock.release()
+
+    def get_stats(self):
+        self._lock.acquire()
+        try:
+            now = self._clock()
+            return [{"url": ep.url,
+                     "latency": ep.latency,
+                     "connect_time": ep.connect_time,
+                     "failures": ep.failures,
+                     "up": self._is_up(ep, now)}
+                    for ep in self._endpoints]
+        finally:
+            self._lock.release()
@@ -0,0 +1,173 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import collections
+import logging
+import threading
+
+import dcm.agent.connection.websocket as websocket
+import dcm.agent.exceptions as exceptions
+
+
+_g_logger = logging.getLogger(__name__)
+
+
+class Outbox(object):
+    """
+    A persistent, sequence numbered log of the documents sent to the agent
+    manager.
+
+    Every document added is given the next sequence number in its
+    'sequence' key and is stored in the agent database until the manager
+    acknowledges that sequence.  When a session is resumed after a
+    reconnect the manager says which sequence it last received and only the
+    documents after it need to be sent again.
+
+    Stamping a document and storing it are separate steps so that callers
+    holding a lock of their own can leave the database write until they
+    release it.  The writes join the group commit batch of the database.
+    When max_documents is set no more than that many unacknowledged
+    documents are kept, the overflow policy is the one of the send queue.
+    """
+
+    def __init__(self, db, max_documents=0,
+                 overflow=websocket.SendQueueOverflow.DROP_OLDEST):
+        if overflow not in websocket.SendQueueOverflow.ALL:
+            raise exceptions.AgentOptionValueException(
+                "[connection]send_queue_overflow", overflow,
+                ",".join(websocket.SendQueueOverflow.ALL))
+        self._db = db
+        self._max_documents = max_documents
+        self._overflow = overflow
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock()
+        self._unsaved = collections.deque()
+        self._dropped = 0
+        self._last_ack, self._last_sequence = db.outbox_get_sequences()
+        self._last_sequence = max(self._last_ack, self._last_sequence)
+        # every sequence up to here is acknowledged or was dropped
+        self._floor = self._last_ack
+
+    def stamp(self, doc):
+        """
+        Stamp the document with its sequence number and hold it for save().
+        The document is changed in place so that a later retransmission of
+        the same document can be recognized.  This does not touch the
+        database.
+        :return: The sequence number or None if the outbox is full and
+        the overflow policy drops new documents.
+        """
+        self._lock.acquire()
+        try:
+            if self._max_documents and \
+                    self._overflow == \
+                    websocket.SendQueueOverflow.DROP_NEWEST and \
+                    self._pending_count() >= self._max_documents:
+                self._dropped += 1
+                _g_logger.warn("The outbox is full, the new message will "
+                               "not be replayed after a reconnect")
+                return None
+            self._last_sequence += 1
+            sequence = self._last_sequence
+            doc['sequence'] = sequence
+            self._unsaved.append((sequence, doc))
+            return sequence
+        finally:
+            self._lock.release()
+
+    def save(self):
+        """
+        Write the stamped documents to the database and drop the oldest
+        ones when there are more than max_documents.
+        """
+        self._save_lock.acquire()
+        try:
+            trim_to = None
+            self._lock.acquire()
+            try:
+                unsaved = list(self._unsaved)
+                self._unsaved.clear()
+                over = self._pending_count() - self._max_documents
+                if self._max_documents and over > 0:
+                    self._floor += over
+                    self._dropped += over
+                    trim_to = self._floor
+                    _g_logger.warn("The outbox is full, dropped the %d "
+                                   "oldest messages" % over)
+            finally:
+                self._lock.release()
+            for sequence, doc in unsaved:
+                # acknowledged or dropped before it was saved
+                if sequence > self._floor:
+                    self._db.outbox_add(sequence, doc)
+            if trim_to is not None:
+                self._db.outbox_trim(trim_to)
+        finally:
+            self._save_lock.release()
+
+    def add(self, doc):
+        """
+        Stamp the document with its sequence number and store it.
+        :return: The sequence number or None if it was dropped.
+        """
+        sequence = self.stamp(doc)
+        self.save()
+        return sequence
+
+    def ack(self, sequence):
+        """
+        The manager has everything up to and including sequence.
+        """
+        self._save_lock.acquire()
+        try:
+            self._lock.acquire()
+            try:
+                if sequence > self._last_sequence:
+                    # the manager has seen more than this database
+                    # remembers, new documents must be numbered after it
+                    self._last_sequence = sequence
+                if sequence <= self._last_ack:
+                    return
+                self._last_ack = sequence
+                self._floor = max(self._floor, sequence)
+            finally:
+                self._lock.release()
+            self._db.outbox_ack(sequence)
+        finally:
+            self._save_lock.release()
+
+    def ack_all(self):
+        self.ack(self._last_sequence)
+
+    def get_unacked(self):
+        """
+        :return: The documents that the manager has not acknowledged, in
+        sequence order.
+        """
+        self.save()
+        return [doc for _, doc in self._db.outbox_get_after(self._floor)]
+
+    def last_acked(self):
+        return self._last_ack
+
+    def _pending_count(self):
+        # This should only be called locked
+        return self._last_sequence - self._floor
+
+    def pending_count(self):
+        return self._pending_count()
+
+    def dropped_count(self):
+        return self._dropped
@@ -0,0 +1,273 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import collections
+import os
+import threading
+import time
+
+import dcm.agent.codec as codec
+import dcm.agent.events.loop_stats as loop_stats
+
+
+# round trip times are on the order of milliseconds to seconds
+RTT_BUCKET_BOUNDS = (0.001, 0.0025, 0.005,
+                     0.01, 0.025, 0.05,
+                     0.1, 0.25, 0.5,
+                     1.0, 2.5, 5.0,
+                     10.0, 30.0)
+
+# the weight given to a new sample in the smoothed round trip time, the
+# same value TCP uses (RFC 6298)
+RTT_SMOOTHING = 0.125
+
+# the file in the storage base directory that the running agent writes its
+# connection statistics to for dcm-agent status
+SNAPSHOT_FILE_NAME = "connection_stats.json"
+
+# pings that are never answered are forgotten once this many are newer
+MAX_OUTSTANDING_PINGS = 8
+
+
+class ConnectionStats(object):
+    """
+    Performance counters for one connection to the agent manager.
+
+    The connection reports frames as they are written and read, state
+    changes, handshakes and ping/pong round trips.  Everything is kept in
+    fixed size counters and histograms so the memory used does not grow
+    with the life of the connection.  All of the methods are thread safe.
+    """
+
+    def __init__(self, clock=None):
+        if clock is None:
+            clock = time.monotonic
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._frames_out = 0
+        self._bytes_out = 0
+        self._frames_in = 0
+        self._bytes_in = 0
+        self._connects = 0
+        self._tls_handshakes = 0
+        self._tls_resumed = 0
+        self._state = None
+        self._state_start = self._clock()
+        self._state_times = {}
+        self._handshake_start = None
+        self._handshake_times = loop_stats.Histogram(RTT_BUCKET_BOUNDS)
+        self._last_handshake = None
+        self._ping_count = 0
+        self._pings = collections.OrderedDict()
+        self._rtt = loop_stats.Histogram(RTT_BUCKET_BOUNDS)
+        self._last_rtt = None
+        self._smoothed_rtt = None
+
+    def frame_sent(self, size):
+        self._lock.acquire()
+        try:
+            self._frames_out += 1
+            self._bytes_out += size
+        finally:
+            self._lock.release()
+
+    def frame_received(self, size):
+        self._lock.acquire()
+        try:
+            self._frames_in += 1
+            self._bytes_in += size
+        finally:
+            self._lock.release()
+
+    def state_changed(self, new_state):
+        """
+        :param new_state: The state the connection just moved to.  The time
+        spent in the previous state is added to its total.
+        """
+        self._lock.acquire()
+        try:
+            now = self._clock()
+            if self._state is not None:
+                self._state_times[self._state] = \
+                    self._state_times.get(self._state, 0.0) + \
+                    now - self._state_start
+            self._state = new_state
+            self._state_start = now
+        finally:
+            self._lock.release()
+
+    def handshake_started(self):
+        self._lock.acquire()
+        try:
+            self._handshake_start = self._clock()
+        finally:
+            self._lock.release()
+
+    def handshake_finished(self, success):
+        """
+        :param success: A bool indicating if the manager accepted the
+        handshake.  Every successful handshake after the first one is
+        counted as a reconnect.
+        """
+        self._lock.acquire()
+        try:
+            if self._handshake_start is not None:
+                self._last_handshake = self._clock() - self._handshake_start
+                self._handshake_times.record(self._last_handshake)
+                self._handshake_start = None
+            if success:
+                self._connects += 1
+        finally:
+            self._lock.release()
+
+    def tls_handshake(self, resumed):
+        """
+        :param resumed: A bool indicating if the TLS session was resumed
+        rather than negotiated in full.
+        """
+        self._lock.acquire()
+        try:
+            self._tls_handshakes += 1
+            if resumed:
+                self._tls_resumed += 1
+        finally:
+            self._lock.release()
+
+    def next_ping(self):
+        """
+        :return: The payload for a new ping.  The time it was sent is
+        remembered until the matching pong arrives.
+        """
+        self._lock.acquire()
+        try:
+            self._ping_count += 1
+            payload = "rtt-%d" % self._ping_count
+            self._pings[payload] = self._clock()
+            while len(self._pings) > MAX_OUTSTANDING_PINGS:
+                self._pings.popitem(last=False)
+            return payload
+        finally:
+            self._lock.release()
+
+    def pong_received(self, payload):
+        """
+        :param payload: The data of the pong.  Pongs that do not answer one
+        of our pings, like ws4py's unsolicited heartbeat pongs, are ignored.
+        :return: The round trip time in seconds or None.
+        """
+        if isinstance(payload, bytes):
+            payload = payload.decode("utf-8", "replace")
+        self._lock.acquire()
+        try:
+            sent = self._pings.pop(payload, None)
+            if sent is None:
+                return None
+            rtt = self._clock() - sent
+            self._rtt.record(rtt)
+            self._last_rtt = rtt
+            if self._smoothed_rtt is None:
+                self._smoothed_rtt = rtt
+            else:
+                self._smoothed_rtt += RTT_SMOOTHING * (rtt -
+                                                       self._smoothed_rtt)
+            return rtt
+        finally:
+            self._lock.release()
+
+    def get_stats(self):
+        self._lock.acquire()
+        try:
+            now = self._clock()
+            state_times = dict(self._state_times)
+            if self._state is not None:
+                state_times[self._state] = \
+                    state_times.get(self._state, 0.0) + \
+                    now - self._state_start
+            return {
+                "frames_out": self._frames_out,
+                "bytes_out": self._bytes_out,
+                "frames_in": self._frames_in,
+                "bytes_in": self._bytes_in,
+                "state": self._state,
+                "time_in_state": now - self._state_start,
+                "state_times": state_times,
+                "connects": self._connects,
+                "reconnects": max(0, self._connects - 1),
+                "tls_handshakes": self._tls_handshakes,
+                "tls_resumed": self._tls_resumed,
+                "last_handshake_time": self._last_handshake,
+                "handshake_time": self._handshake_times.get_stats(),
+                "last_rtt": self._last_rtt,
+                "smoothed_rtt": self._smoothed_rtt,
+                "rtt": self._rtt.get_stats()
+            }
+        finally:
+            self._lock.release()
+
+
+_g_lock = threading.Lock()
+_g_active_connection = None
+
+
+def set_active_connection(conn):
+    """
+    :param conn: The connection to the agent manager whose counters are
+    reported by get_active_connection_stats(), or None.
+    """
+    global _g_active_connection
+    _g_lock.acquire()
+    try:
+        _g_active_connection = conn
+    finally:
+        _g_lock.release()
+
+
+def get_active_connection_stats():
+    """
+    :return: The statistics of the active connection or None if there is no
+    connection or it does not keep statistics.
+    """
+    _g_lock.acquire()
+    try:
+        conn = _g_active_connection
+    finally:
+        _g_lock.release()
+    if conn is None:
+        return None
+    return conn.get_connection_stats()
+
+
+def write_snapshot(path, stats):
+    """
+    Atomically replace the file at path with the statistics and the time
+    they were written.
+    """
+    doc = {"written_at": time.time(), "stats": stats}
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as fptr:
+        fptr.write(codec.dumps(doc))
+    os.rename(tmp_path, path)
+
+
+def read_snapshot(path):
+    """
+    :return: The (written_at, stats) stored by write_snapshot() or None if
+    there is no snapshot.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as fptr:
+        doc = codec.loads(fptr.read())
+    return doc["written_at"], doc["stats"]
@@ -0,0 +1,106 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import collections
+import logging
+import ssl
+import threading
+
+
+_g_logger = logging.getLogger(__name__)
+
+
+class TLSConnector(object):
+    """
+    Wraps client sockets in TLS from a single SSLContext and offers the
+    session of the previous connection to the same host and port, so that a
+    reconnect can resume it instead of doing a full handshake.
+
+    Sessions are only kept in memory.  The ssl module has no way to export
+    an SSLSession so they cannot outlive the process.  The certificate
+    checks are the same ones ws4py's ssl.wrap_socket options made: the peer
+    certificate is verified against ca_certs when cert_reqs asks for it, and
+    the host name is not checked.
+    """
+
+    def __init__(self, cert_reqs=ssl.CERT_REQUIRED, ca_certs=None,
+                 resume_sessions=True, max_sessions=16):
+        self._cert_reqs = cert_reqs
+        self._ca_certs = ca_certs
+        self._context = None
+        self._resume_sessions = resume_sessions
+        self._max_sessions = max_sessions
+        self._sessions = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_context(self):
+        """
+        :return: The SSLContext every connection is wrapped with.  It is
+        built on first use so that a bad ca_certs file fails a connection
+        attempt rather than the construction of the connection object.
+        """
+        self._lock.acquire()
+        try:
+            if self._context is None:
+                context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+                context.check_hostname = False
+                context.verify_mode = self._cert_reqs
+                if self._ca_certs:
+                    context.load_verify_locations(cafile=self._ca_certs)
+                self._context = context
+            return self._context
+        finally:
+            self._lock.release()
+
+    def _get_session(self, key):
+        self._lock.acquire()
+        try:
+            return self._sessions.get(key)
+        finally:
+            self._lock.release()
+
+    def wrap_socket(self, sock, host, port):
+        """
+        :param sock: An unconnected socket.  The TLS handshake happens when
+        it is connected.
+        :return: The wrapped socket.
+        """
+        session = None
+        if self._resume_sessions:
+            session = self._get_session((host, port))
+        return self.get_context().wrap_socket(
+            sock, server_hostname=host, session=session)
+
+    def save_session(self, ssl_sock, host, port):
+        """
+        Remember the session of an established connection for the next one
+        to the same host and port.
+        :return: A bool indicating if the connection resumed a session.
+        """
+        reused = ssl_sock.session_reused
+        if not self._resume_sessions:
+            return reused
+        session = ssl_sock.session
+        if session is None:
+            return reused
+        self._lock.acquire()
+        try:
+            self._sessions[(host, port)] = session
+            self._sessions.move_to_end((host, port))
+            while len(self._sessions) > self._max_sessions:
+                self._sessions.popitem(last=False)
+        finally:
+            self._lock.release()
+        return reused
@@ -13,20 +13,29 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
-import datetime
+import collections
 import errno
-import json
+import functools
 import logging
 import queue
+import random
 import socket
 import ssl
 import threading
+import time
+import zlib
 
 import ws4py.client.threadedclient as ws4py_client
+import ws4py.messaging as ws4py_messaging
 
+import dcm.agent.codec as codec
+import dcm.agent.connection.endpoints as endpoints
+import dcm.agent.connection.stats as conn_stats
+import dcm.agent.connection.tls as tls
 import dcm.agent.exceptions as exceptions
 import dcm.agent.handshake as handshake
 import dcm.agent.logger as dcm_logger
+import dcm.agent.messaging.types as message_types
 import dcm.agent.events.state_machine as state_machine
 import dcm.agent.utils as agent_utils
 
@@ -36,6 +45,116 @@ _g_logger = logging.getLogger(__name__)
 _g_wire_logger = agent_utils.get_wire_logger()
 
 
+# Queued documents are sent inside this envelope when the manager accepted
+# message batching in the handshake.  The documents are already encoded so
+# they are joined as strings rather than encoded a second time.
+_BATCH_PREFIX = ('{"type": "%s", "messages": ['
+                 % message_types.MessageTypes.BATCH)
+_BATCH_SUFFIX = ']}'
+_BATCH_OVERHEAD = len(_BATCH_PREFIX) + len(_BATCH_SUFFIX)
+
+
+def negotiate_batch_limit(batch_max_bytes, hs):
+    """
+    :return: The largest BATCH frame to send on a connection whose handshake
+    reply was hs, 0 if messages are not batched.
+    """
+    accepted = hs.message_batching
+    if not batch_max_bytes or not accepted:
+        return 0
+    if accepted is True:
+        return batch_max_bytes
+    try:
+        return min(batch_max_bytes, int(accepted))
+    except (TypeError, ValueError):
+        _g_logger.warn("Ignoring the invalid message batching value %s"
+                       % str(accepted))
+        return 0
+
+
+def negotiate_compression(compression_level, hs):
+    """
+    :return: A bool indicating if large frames are compressed on a
+    connection whose handshake reply was hs.
+    """
+    accepted = hs.message_compression
+    if not compression_level or not accepted:
+        return False
+    if accepted is True or accepted == handshake.COMPRESSION_ZLIB:
+        return True
+    _g_logger.warn("Ignoring the unknown message compression %s"
+                   % str(accepted))
+    return False
+
+
+def decode_frame(data, is_binary):
+    """
+    :return: The list of documents carried by an incoming frame.  Binary
+    frames from the manager are always zlib compressed.
+    """
+    if is_binary:
+        data = zlib.decompress(data)
+    json_doc = codec.loads(data)
+    if isinstance(json_doc, dict) and \
+            json_doc.get('type') == message_types.MessageTypes.BATCH:
+        return json_doc.get('messages', [])
+    return [json_doc]
+
+
+def _to_frame(msg, compress_level, compress_threshold):
+    if compress_level and len(msg) >= compress_threshold:
+        return zlib.compress(msg.encode(), compress_level), True
+    return msg, False
+
+
+def encode_documents(docs):
+    """
+    :return: A list of (document, encoded message) tuples as taken by
+    encode_messages() and _FrameWriter.
+    """
+    return [(doc, codec.dumps(doc)) for doc in docs]
+
+
+def encode_messages(msgs, batch_limit=0, compress_level=0,
+                    compress_threshold=0):
+    """
+    Pack already encoded documents into websocket frames.  When
+    batch_limit is set they are packed into as few BATCH frames of at most
+    that size as possible, and when compress_level is set frames of at
+    least compress_threshold characters are compressed.
+    :return: A generator of (payload, binary, count) tuples where count is
+    the number of documents in the frame.
+    """
+    if not batch_limit:
+        for msg in msgs:
+            payload, binary = _to_frame(msg, compress_level,
+                                        compress_threshold)
+            yield payload, binary, 1
+        return
+
+    pending = []
+    pending_size = _BATCH_OVERHEAD
+    for msg in msgs:
+        if pending and pending_size + len(msg) + 1 > batch_limit:
+            yield _to_batch_frame(pending, compress_level,
+                                  compress_threshold)
+            pending = []
+            pending_size = _BATCH_OVERHEAD
+        pending.append(msg)
+        pending_size += len(msg) + 1
+    if pending:
+        yield _to_batch_frame(pending, compress_level, compress_threshold)
+
+
+def _to_batch_frame(msgs, compress_level, compress_threshold):
+    if len(msgs) == 1:
+        msg = msgs[0]
+    else:
+        msg = _BATCH_PREFIX + ",".join(msgs) + _BATCH_SUFFIX
+    payload, binary = _to_frame(msg, compress_level, compress_threshold)
+    return payload, binary, len(msgs)
+
+
 class WsConnEvents:
     POLL = "POLL"
     CONNECTING_FINISHED = "CONNECTING_FINISHED"
@@ -55,114 +174,304 @@ class WsConnStates:
     DONE = "DONE"
 
 
+class BackoffStrategy:
+    """
+    How Backoff picks the wait after a failed connection.
+
+    EXPONENTIAL doubles the wait every time.  FULL_JITTER doubles a ceiling
+    and waits a random time between 0 and it.  DECORRELATED_JITTER waits a
+    random time between the initial backoff and three times the last wait.
+    The jitter strategies keep a fleet of agents that lost their manager at
+    the same moment from coming back in lockstep waves.
+    """
+    EXPONENTIAL = "exponential"
+    FULL_JITTER = "full_jitter"
+    DECORRELATED_JITTER = "decorrelated_jitter"
+
+    ALL = [EXPONENTIAL, FULL_JITTER, DECORRELATED_JITTER]
+
+
 class Backoff(object):
 
     def __init__(self, max_backoff_seconds,
-                 initial_backoff_second=0.5):
+                 initial_backoff_second=0.5,
+                 strategy=BackoffStrategy.EXPONENTIAL,
+                 clock=None, rng=None):
+        """
+        :param clock: A function returning the current time in seconds.
+        time.monotonic is used by default.
+        :param rng: A random.Random used by the jitter strategies.
+        """
+        if strategy not in BackoffStrategy.ALL:
+            raise exceptions.AgentOptionValueException(
+                "[connection]backoff_strategy", strategy,
+                ",".join(BackoffStrategy.ALL))
+        self._strategy = strategy
+        self._clock = clock or time.monotonic
+        self._rng = rng or random.Random()
         self._backoff_seconds = initial_backoff_second
         self._max_backoff = max_backoff_seconds
         if self._backoff_seconds > self._max_backoff:
             self._backoff_seconds = self._max_backoff
-        self._ready_time = datetime.datetime.now()
+        self._ready_time = self._clock()
         self._last_activity = self._ready_time
-        self._initial_backoff_second = initial_backoff_second
+        self._initial_backoff_second = self._backoff_seconds
 
     def activity(self):
         self._backoff_seconds = self._initial_backoff_second
-        self._ready_time = datetime.datetime.now()
+        self._ready_time = self._clock()
         self._last_activity = self._ready_time
 
-    def _set_ready_time(self, backoff):
-        if backoff > self._max_backoff:
-            backoff = self._max_backoff
-        self._backoff_seconds = backoff
-        new_ready_time = datetime.datetime.now() +\
-            datetime.timedelta(seconds=self._backoff_seconds)
+    def _next_wait(self):
+        # _backoff_seconds is the last wait for the exponential and
+        # decorrelated strategies and the ceiling for full jitter
+        if self._strategy == BackoffStrategy.DECORRELATED_JITTER:
+            self._backoff_seconds = min(
+                self._max_backoff,
+                self._rng.uniform(self._initial_backoff_second,
+                                  self._backoff_seconds * 3.0))
+            return self._backoff_seconds
+        self._backoff_seconds = min(self._max_backoff,
+                                    self._backoff_seconds * 2.0)
+        if self._strategy == BackoffStrategy.FULL_JITTER:
+            return self._rng.uniform(0.0, self._backoff_seconds)
+        return self._backoff_seconds
+
+    def error(self):
+        new_ready_time = self._clock() + self._next_wait()
         if new_ready_time > self._ready_time:
             self._ready_time = new_ready_time
 
-    def error(self):
-        self._set_ready_time(self._backoff_seconds*2.0)
+    def connection_lost(self):
+        """
+        An open connection went away.  The exponential strategy reconnects
+        right away, the jitter strategies treat it as the first failure so
+        that the reconnects of a fleet are spread out.
+        """
+        if self._strategy != BackoffStrategy.EXPONENTIAL:
+            self.error()
 
     def ready(self):
-        return self._ready_time < datetime.datetime.now()
+        return self._ready_time < self._clock()
 
     def force_backoff_time(self, backoff_seconds):
-        self._ready_time = datetime.datetime.now() +\
-            datetime.timedelta(seconds=backoff_seconds)
+        self._ready_time = self._clock() + backoff_seconds
 
     def seconds_until_ready(self):
-        d = self._ready_time - datetime.datetime.now()
-        return max(0.0, d.total_seconds())
+        return max(0.0, self._ready_time - self._clock())
 
 
-class RepeatQueue(object):
+class SendQueueOverflow:
+    """
+    What RepeatQueue does when a new document does not fit in its byte
+    budget.  DROP_OLDEST throws away the documents that have been waiting
+    the longest until the new one fits, DROP_NEWEST refuses the new one.
+    """
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEWEST = "drop_newest"
+
+    ALL = [DROP_OLDEST, DROP_NEWEST]
+
 
-    def __init__(self, max_req_id=500):
-        self._q = queue.Queue()
-        self._lock = threading.RLock()
-        self._message_id_set = set()
-        self._request_id_count = {}
+class RepeatQueue(object):
+    """
+    The outgoing document queue of a connection.
+
+    A document carrying a message_id that is already waiting in the queue is
+    a retransmission and is skipped.  No more than max_req_id documents are
+    accepted for any one request_id until request_complete() is called for
+    it.  Both kinds of bookkeeping are kept in LRU ordered dicts bounded by
+    max_message_ids and max_tracked_requests so they cannot grow without
+    limit on a long lived agent.  When max_bytes is set the encoded size of
+    the queued documents is kept under it according to the overflow policy.
+
+    Every document is encoded once when it is queued and the encoding is
+    kept with it so that the writer does not have to encode it again.
+    """
+
+    def __init__(self, max_req_id=500, max_bytes=0,
+                 overflow=SendQueueOverflow.DROP_OLDEST,
+                 max_message_ids=4096, max_tracked_requests=4096):
+        if overflow not in SendQueueOverflow.ALL:
+            raise exceptions.AgentOptionValueException(
+                "[connection]send_queue_overflow", overflow,
+                ",".join(SendQueueOverflow.ALL))
+        self._q = collections.deque()
+        self._cond = threading.Condition()
+        self._message_ids = collections.OrderedDict()
+        self._request_id_count = collections.OrderedDict()
         self._max_req_id = max_req_id + 1
+        self._max_bytes = max_bytes
+        self._overflow = overflow
+        self._max_message_ids = max_message_ids
+        self._max_tracked_requests = max_tracked_requests
+        self._bytes = 0
+        self._dropped = 0
+
+    def __len__(self):
+        return len(self._q)
 
-    def put(self, item, block=True, timeout=None):
-        self._lock.acquire()
+    def empty(self):
+        return not self._q
+
+    def _get_id(self, item, key):
         try:
+            return item.get(key)
+        except AttributeError:
+            return None
+
+    def _count_request(self, request_id):
+        # This should only be called locked.  Returns the new count.
+        count = self._request_id_count.pop(request_id, 0) + 1
+        self._request_id_count[request_id] = count
+        if len(self._request_id_count) > self._max_tracked_requests:
+            self._request_id_count.popitem(last=False)
+        return count
+
+    def _remember_message_id(self, message_id):
+        # This should only be called locked
+        self._message_ids[message_id] = True
+        if len(self._message_ids) > self._max_message_ids:
+            self._message_ids.popitem(last=False)
+
+    def _pop(self):
+        # This should only be called locked
+        item, msg = self._q.popleft()
+        self._bytes -= len(msg)
+        message_id = self._get_id(item, 'message_id')
+        if message_id is not None:
+            self._message_ids.pop(message_id, None)
+        return item, msg
+
+    def put(self, item, block=True, timeout=None, encoded=None):
+        """
+        Add a document to the end of the queue.  This never blocks, block
+        and timeout are accepted for compatibility with queue.Queue.
+        :param encoded: The encoding of item if the caller already has it.
+        :return: A bool indicating if the document was queued.
+        """
+        if encoded is None:
             try:
-                if 'message_id' in item:
-                    message_id = item['message_id']
-                    if message_id in self._message_id_set:
-                        _g_logger.info("Skipping sending a retransmission "
-                                       "of message id %s" % message_id)
-                        return
-                    else:
-                        _g_logger.debug("Adding the message with id %s " %
-                                        message_id)
-                    self._message_id_set.add(message_id)
-                if 'request_id' in item:
-                    request_id = item['request_id']
-                    if request_id not in self._request_id_count:
-                        self._request_id_count[request_id] = 0
-                    self._request_id_count[request_id] += 1
-                    if self._request_id_count[request_id] >= self._max_req_id:
-                        msg = "TOO MANY MESSAGES FOR %s!" % request_id
-                        _g_logger.error(msg)
-                        agent_utils.build_assertion_exception(_g_logger, msg)
-                        if self._request_id_count[request_id] ==\
-                                self._max_req_id:
-                            dcm_logger.log_to_dcm_console_overloaded(msg=msg)
-                        return
+                encoded = codec.dumps(item)
             except Exception as ex:
-                _g_logger.warn("Exception checking if message is a retrans "
-                               "%s" % str(ex))
-            return self._q.put(item, block=block, timeout=timeout)
+                _g_logger.error("Could not encode the outgoing message %s"
+                                % str(ex))
+                return False
+        size = len(encoded)
+        message_id = self._get_id(item, 'message_id')
+        request_id = self._get_id(item, 'request_id')
+        overloaded_msg = None
+
+        self._cond.acquire()
+        try:
+            if message_id is not None and message_id in self._message_ids:
+                _g_logger.info("Skipping sending a retransmission "
+                               "of message id %s" % message_id)
+                return False
+            if request_id is not None:
+                count = self._count_request(request_id)
+                if count >= self._max_req_id:
+                    msg = "TOO MANY MESSAGES FOR %s!" % request_id
+                    _g_logger.error(msg)
+                    agent_utils.build_assertion_exception(_g_logger, msg)
+                    if count == self._max_req_id:
+                        overloaded_msg = msg
+                    return False
+
+            if self._max_bytes:
+                if (self._overflow == SendQueueOverflow.DROP_NEWEST and
+                        self._bytes + size > self._max_bytes) or \
+                        size > self._max_bytes:
+                    self._dropped += 1
+                    _g_logger.warn("The send queue is full, dropping a %d "
+                                   "byte message" % size)
+                    return False
+                while self._bytes + size > self._max_bytes:
+                    self._pop()
+                    self._dropped += 1
+                    _g_logger.warn("The send queue is full, dropped the "
+                                   "oldest message")
+
+            if message_id is not None:
+                _g_logger.debug("Adding the message with id %s " % message_id)
+                self._remember_message_id(message_id)
+            self._q.append((item, encoded))
+            self._bytes += size
+            self._cond.notify()
+            return True
         finally:
-            self._lock.release()
+            self._cond.release()
+            if overloaded_msg is not None:
+                dcm_logger.log_to_dcm_console_overloaded(msg=overloaded_msg)
 
     def get(self, block=True, timeout=None):
-        self._lock.acquire()
+        """
+        Remove and return the document at the front of the queue.  Waiting
+        for a document releases the lock so that writers are not held up.
+        :raise queue.Empty: When nothing arrived in time.
+        """
+        self._cond.acquire()
         try:
-            item = self._q.get(block=block, timeout=timeout)
-            try:
-                if 'message_id' in item:
-                    if item['message_id'] in self._message_id_set:
-                        self._message_id_set.remove(item['message_id'])
-            except Exception as ex:
-                _g_logger.info("Exception checking if message has an id "
-                               "%s" % str(ex))
-            return item
+            if block and not self._q:
+                self._cond.wait_for(lambda: self._q, timeout)
+            if not self._q:
+                raise queue.Empty()
+            return self._pop()[0]
+        finally:
+            self._cond.release()
+
+    def get_all(self):
+        """
+        :return: A list of every queued document, the queue is left empty.
+        """
+        return [item for item, _ in self.get_all_encoded()]
+
+    def get_all_encoded(self):
+        """
+        :return: A list of (document, encoded message) tuples for every
+        queued document, the queue is left empty.
+        """
+        self._cond.acquire()
+        try:
+            items = list(self._q)
+            self._q.clear()
+            self._message_ids.clear()
+            self._bytes = 0
+            return items
+        finally:
+            self._cond.release()
+
+    def request_complete(self, request_id):
+        """
+        Stop counting the documents sent for a request that has finished.
+        """
+        self._cond.acquire()
+        try:
+            self._request_id_count.pop(request_id, None)
         finally:
-            self._lock.release()
+            self._cond.release()
 
-    def task_done(self):
-        return self._q.task_done()
+    def get_stats(self):
+        self._cond.acquire()
+        try:
+            return {
+                "length": len(self._q),
+                "bytes": self._bytes,
+                "max_bytes": self._max_bytes,
+                "dropped": self._dropped,
+                "tracked_message_ids": len(self._message_ids),
+                "tracked_requests": len(self._request_id_count)
+            }
+        finally:
+            self._cond.release()
 
 
 class _WebSocketClient(ws4py_client.WebSocketClient):
 
     def __init__(self, manager, url, receive_callback, protocols=None,
                  extensions=None,
-                 heartbeat_freq=None, ssl_options=None, headers=None):
+                 heartbeat_freq=None, ssl_options=None, headers=None,
+                 stats=None, tls_connector=None, attempt=None):
         ws4py_client.WebSocketClient.__init__(
             self, url, protocols=protocols, extensions=extensions,
             heartbeat_freq=heartbeat_freq, ssl_options=ssl_options,
@@ -173,6 +482,28 @@ class _WebSocketClient(ws4py_client.WebSocketClient):
         self.manager = manager
         self._url = url
         self._dcm_closed_called = False
+        self._stats = stats
+        self._tls_connector = tls_connector
+        # the connection attempt of the manager this socket belongs to
+        self._attempt = attempt
+
+    def connect(self):
+        if self.scheme != "wss" or self._tls_connector is None:
+            return super(_WebSocketClient, self).connect()
+        self.sock = self._tls_connector.wrap_socket(
+            self.sock, self.host, self.port)
+        # the socket is already wrapped so ws4py must not wrap it again
+        self.scheme = "ws"
+        try:
+            super(_WebSocketClient, self).connect()
+        finally:
+            self.scheme = "wss"
+        # TLS 1.3 session tickets arrive after the handshake so the session
+        # is saved once the upgrade response has been read
+        resumed = self._tls_connector.save_session(
+            self.sock, self.host, self.port)
+        if self._stats is not None:
+            self._stats.tls_handshake(resumed)
 
     def opened(self):
         _g_logger.debug("Web socket %s has been opened" % self._url)
@@ -182,7 +513,8 @@ class _WebSocketClient(ws4py_client.WebSocketClient):
                        % (self._url, code, reason))
         _g_logger.debug("Sending error event to connection manager.")
         self.manager.event_error(exception=Exception(
-            "Connection unexpectedly closed: %d %s" % (code, reason)))
+            "Connection unexpectedly closed: %d %s" % (code, reason)),
+            attempt=self._attempt)
 
     def close(self, code=1000, reason=''):
         self._dcm_closed_called = True
@@ -191,34 +523,177 @@ class _WebSocketClient(ws4py_client.WebSocketClient):
 
     def received_message(self, m):
         _g_wire_logger.debug("INCOMING\n--------\n%s\n--------" % str(m.data))
-        json_doc = json.loads(m.data.decode())
-        self.manager.event_incoming_message(json_doc)
+        if self._stats is not None:
+            self._stats.frame_received(len(m.data))
+        for doc in decode_frame(m.data, m.is_binary):
+            self.manager.event_incoming_message(doc)
+
+    def ponged(self, pong):
+        if self._stats is not None:
+            self._stats.pong_received(pong.data)
 
     def send(self, payload, binary=False):
         _g_wire_logger.debug("OUTGOING\n--------\n%s\n--------" % str(payload))
         super(_WebSocketClient, self).send(payload, binary=binary)
 
 
+class _FrameWriter(threading.Thread):
+    """
+    Frames and writes the outgoing documents for one open websocket.
+
+    The connection hands (document, encoded message) tuples over with
+    write() while it holds its lock and this thread does the framing and
+    the socket writes without it, so a slow or stalled socket does not
+    block incoming messages or new sends.
+    When batching was negotiated the buffered documents are packed into as
+    few BATCH frames as the limit allows, and when compression was
+    negotiated frames of at least compress_threshold characters are
+    compressed at compress_level.  If a write fails the documents
+    that were not written and the exception are passed to failed_callback
+    and the thread exits.  Every ping_interval seconds a ping is written so
+    that stats can measure the round trip time.
+    """
+
+    def __init__(self, ws, batch_limit, failed_callback,
+                 compress_level=0, compress_threshold=0, stats=None,
+                 ping_interval=0):
+        super(_FrameWriter, self).__init__(name="ws-writer")
+        self.daemon = True
+        self._ws = ws
+        self._batch_limit = batch_limit
+        self._compress_level = compress_level
+        self._compress_threshold = compress_threshold
+        self._failed_callback = failed_callback
+        self._stats = stats
+        self._ping_interval = ping_interval
+        self._cond = threading.Condition()
+        self._buffer = collections.deque()
+        self._stopped = False
+
+    def write(self, docs):
+        """
+        :return: False if the writer has stopped and did not take the
+        documents.
+        """
+        self._cond.acquire()
+        try:
+            if self._stopped:
+                return False
+            self._buffer.extend(docs)
+            self._cond.notify()
+            return True
+        finally:
+            self._cond.release()
+
+    def stop(self):
+        """
+        Ask the thread to exit once the frame that it is writing is done.
+        This does not wait for it because the socket may be stuck.
+        :return: The documents that were buffered but not yet picked up.
+        """
+        self._cond.acquire()
+        try:
+            self._stopped = True
+            docs = self._buffer
+            self._buffer = collections.deque()
+            self._cond.notify()
+            return docs
+        finally:
+            self._cond.release()
+
+    def _send_docs(self, docs):
+        # documents are only removed from the docs deque once the frame
+        # holding them has been written
+        for payload, binary, count in encode_messages(
+                [msg for _, msg in docs], self._batch_limit,
+                self._compress_level, self._compress_threshold):
+            if binary:
+                self._ws.send(payload, binary=True)
+            else:
+                self._ws.send(payload)
+            if self._stats is not None:
+                self._stats.frame_sent(len(payload))
+            for _ in range(count):
+                docs.popleft()
+
+    def _send_ping(self):
+        self._ws.send(ws4py_messaging.PingControlMessage(
+            self._stats.next_ping()))
+
+    def run(self):
+        next_ping = None
+        if self._ping_interval and self._stats is not None:
+            next_ping = time.monotonic() + self._ping_interval
+        while True:
+            self._cond.acquire()
+            try:
+                while not self._buffer and not self._stopped:
+                    timeout = None
+                    if next_ping is not None:
+                        timeout = next_ping - time.monotonic()
+                        if timeout <= 0:
+                            break
+                    self._cond.wait(timeout)
+                if self._stopped:
+                    return
+                docs = self._buffer
+                self._buffer = collections.deque()
+            finally:
+                self._cond.release()
+
+            try:
+                if next_ping is not None and time.monotonic() >= next_ping:
+                    next_ping = time.monotonic() + self._ping_interval
+                    self._send_ping()
+                self._send_docs(docs)
+            except Exception as ex:
+                if isinstance(ex, socket.error) and ex.errno == errno.EPIPE:
+                    _g_logger.info("The ws connection broke.")
+                else:
+                    _g_logger.exception("Failed to write to the ws "
+                                        "connection.")
+                docs.extend(self.stop())
+                self._failed_callback(docs, ex)
+                return
+
+
 class WebSocketConnection(threading.Thread):
 
     def __init__(self, server_url,
                  backoff_amount=5000, max_backoff=300000,
-                 heartbeat=None, allow_unknown_certs=False, ca_certs=None):
+                 heartbeat=None, allow_unknown_certs=False, ca_certs=None,
+                 batch_max_bytes=0, send_queue_max_bytes=0,
+                 send_queue_overflow=SendQueueOverflow.DROP_OLDEST,
+                 compression_level=0, compression_threshold=1024,
+                 backoff_strategy=BackoffStrategy.EXPONENTIAL,
+                 outbox=None, ping_interval=0, probe_interval=300,
+                 tls_session_resumption=True):
         super(WebSocketConnection, self).__init__()
-        self._send_queue = RepeatQueue()
+        self._send_queue = RepeatQueue(max_bytes=send_queue_max_bytes,
+                                       overflow=send_queue_overflow)
         self._ws_manager = None
-        self._server_url = server_url
+        # server_url may list several endpoints, the selector picks the one
+        # used for each connection
+        self._endpoints = endpoints.EndpointSelector(
+            endpoints.parse_urls(server_url),
+            max_cool_off=float(max_backoff) / 1000.0,
+            probe_interval=probe_interval)
+        self._server_url = self._endpoints.select()
         self._cond = threading.Condition()
         self._done_event = threading.Event()
 
         self._connect_timer = None
 
         self._backoff = Backoff(float(max_backoff) / 1000.0,
-                                float(backoff_amount) / 1000.0)
+                                float(backoff_amount) / 1000.0,
+                                strategy=backoff_strategy)
 
+        self._stats = conn_stats.ConnectionStats()
+        self._stats.state_changed(WsConnStates.WAITING)
         self._sm = state_machine.StateMachine(
-            WsConnStates.WAITING, logger=_g_logger)
-        self._setup_states()
+            WsConnStates.WAITING, logger=_g_logger,
+            table=self._transitions, owner=self,
+            observer=self._stats.state_changed)
         self._handshake_manager = None
         self._heartbeat_freq = heartbeat
         if allow_unknown_certs:
@@ -226,7 +701,30 @@ class WebSocketConnection(threading.Thread):
         else:
             cert_reqs = ssl.CERT_REQUIRED
         self._ssl_options = {'cert_reqs': cert_reqs, 'ca_certs': ca_certs}
+        # one context for every connection so reconnects can resume the
+        # TLS session of the previous one
+        self._tls_connector = tls.TLSConnector(
+            cert_reqs=cert_reqs, ca_certs=ca_certs,
+            resume_sessions=tls_session_resumption)
         self.pre_hs_message_queue = queue.Queue()
+        self._batch_max_bytes = batch_max_bytes
+        # the negotiated batch frame size for the current connection
+        self._batch_limit = 0
+        self._compression_level = compression_level
+        self._compression_threshold = compression_threshold
+        # if compression was accepted for the current connection
+        self._compress = False
+        self._outbox = outbox
+        # if the manager resumed the session on the current connection
+        self._resumable = False
+        # if the manager resumed the last session.  Until a handshake says
+        # otherwise documents are kept in the outbox.
+        self._manager_resumes = True
+        self._writer = None
+        self._ping_interval = ping_interval
+        # counts the connection attempts so that the errors of a socket
+        # that has been replaced can be told apart
+        self._attempt = 0
 
     @agent_utils.class_method_sync
     def set_backoff(self, backoff_seconds):
@@ -238,25 +736,70 @@ class WebSocketConnection(threading.Thread):
         self._handshake_manager = handshake_manager
         self.start()
 
-    def _register_connect(self):
+    def _register_connect(self, delay=None):
         _g_logger.debug("Registering a connection to DCM")
         if self._connect_timer is not None:
             raise exceptions.AgentRuntimeException(
                 "There is already a connection registered")
-        self._connect_timer = dcm_events.register_callback(
-            self.event_connect_timeout,
-            delay=self._backoff.seconds_until_ready())
+        if delay is None:
+            delay = self._backoff.seconds_until_ready()
+        if self._endpoints.probe_due():
+            self._connect_timer = dcm_events.register_callback(
+                self._probe_endpoints, delay=delay, in_thread=True)
+        else:
+            self._connect_timer = dcm_events.register_callback(
+                self.event_connect_timeout, delay=delay)
+
+    def _probe_endpoints(self):
+        # this blocks on the network so it runs in a pool thread without
+        # the connection lock
+        self._endpoints.probe()
+        self.event_connect_timeout()
 
     @agent_utils.class_method_sync
     def event_connect_timeout(self):
         self._connect_timer = None
         self._sm.event_occurred(WsConnEvents.CONNECT_TIMEOUT)
 
-    @agent_utils.class_method_sync
     def send(self, doc):
-        _g_logger.debug("Adding a message to the send queue")
-        self._send_queue.put(doc)
-        self._cond.notify_all()
+        stamped = False
+        self.lock()
+        try:
+            if self._outbox is not None and isinstance(doc, dict):
+                if 'sequence' not in doc:
+                    if self._manager_resumes:
+                        stamped = self._outbox.stamp(doc) is not None
+                elif self._resumable:
+                    # a retransmission timer fired.  The document is in the
+                    # outbox and is replayed if the connection drops so it
+                    # does not need to go out again.
+                    _g_logger.debug("Skipping the retransmission of "
+                                    "sequence %d" % doc['sequence'])
+                    return
+            _g_logger.debug("Adding a message to the send queue")
+            self._send_queue.put(doc)
+            self._cond.notify_all()
+        finally:
+            self.unlock()
+        if stamped:
+            # the database write is left until the connection is unlocked
+            self._outbox.save()
+
+    def request_complete(self, request_id):
+        self._send_queue.request_complete(request_id)
+
+    def get_send_queue_stats(self):
+        return self._send_queue.get_stats()
+
+    def get_connection_stats(self):
+        stats = self._stats.get_stats()
+        stats["url"] = self._server_url
+        stats["endpoints"] = self._endpoints.get_stats()
+        stats["send_queue"] = self._send_queue.get_stats()
+        if self._outbox is not None:
+            stats["outbox_pending"] = self._outbox.pending_count()
+            stats["outbox_dropped"] = self._outbox.dropped_count()
+        return stats
 
     @agent_utils.class_method_sync
     def close(self):
@@ -288,7 +831,13 @@ class WebSocketConnection(threading.Thread):
                                 incoming_data=incoming_data)
 
     @agent_utils.class_method_sync
-    def event_error(self, exception=None):
+    def event_error(self, exception=None, attempt=None):
+        if attempt is not None and attempt != self._attempt:
+            # the socket that failed has already been replaced, this error
+            # says nothing about the current one or its endpoint
+            _g_logger.info("Ignoring an error from an earlier connection "
+                           "attempt %s" % str(exception))
+            return
         self._sm.event_occurred(WsConnEvents.ERROR)
         _g_logger.error(
             "State machine received an exception %s" % str(exception))
@@ -297,10 +846,16 @@ class WebSocketConnection(threading.Thread):
     def event_successful_handshake(self, hs):
         self._sm.event_occurred(WsConnEvents.SUCCESSFUL_HANDSHAKE)
 
-    def _throw_error(self, exception, notify=True):
+    def _throw_error(self, exception, notify=True, attempt=None):
         _g_logger.warning("throwing error %s" % str(exception))
-        dcm_events.register_callback(self.event_error,
-                                     kwargs={"exception": exception})
+        if attempt is None:
+            attempt = self._attempt
+        # a burst of errors from one connection attempt only needs to move
+        # the state machine once.  Errors of different attempts are never
+        # merged so a late one can be recognized as stale.
+        dcm_events.register_coalesced(
+            (self.event_error, attempt), self.event_error,
+            kwargs={"exception": exception, "attempt": attempt})
         if notify:
             self._cond.notify()
 
@@ -313,16 +868,19 @@ class WebSocketConnection(threading.Thread):
     def unlock(self):
         self._cond.release()
 
-    def _forming_connection_thread(self):
+    def _forming_connection_thread(self, attempt):
         try:
+            url = self._server_url
+            start = time.monotonic()
             self._ws.connect()
+            self._endpoints.succeeded(url, time.monotonic() - start)
             self.lock()
             try:
                 self._sm.event_occurred(WsConnEvents.CONNECTING_FINISHED)
             finally:
                 self.unlock()
         except BaseException as ex:
-            self.event_error(exception=ex)
+            self.event_error(exception=ex, attempt=attempt)
 
     #########
     # state transitions
@@ -334,14 +892,89 @@ class WebSocketConnection(threading.Thread):
         """
         pass
 
+    def _negotiate_batch_limit(self, hs):
+        return negotiate_batch_limit(self._batch_max_bytes, hs)
+
+    def _negotiate_compression(self, hs):
+        return negotiate_compression(self._compression_level, hs)
+
+    def _resume_session(self, hs):
+        """
+        Drop what the manager already has from the outbox and queue the rest
+        to be sent again.
+        :return: A bool indicating if the session was resumed.
+        """
+        if self._outbox is None:
+            return False
+        try:
+            last_sequence = int(hs.last_sequence)
+        except (TypeError, ValueError):
+            if hs.last_sequence is not None:
+                _g_logger.warn("Ignoring the invalid last sequence %s"
+                               % str(hs.last_sequence))
+            # the manager cannot resume sessions so the outbox will never
+            # be replayed
+            self._outbox.ack_all()
+            return False
+
+        self._outbox.ack(last_sequence)
+        replay = self._outbox.get_unacked()
+        # queued documents with a sequence are either acknowledged or part
+        # of the replay
+        queued = [(doc, msg) for doc, msg in
+                  self._send_queue.get_all_encoded()
+                  if not isinstance(doc, dict) or 'sequence' not in doc]
+        for doc in replay:
+            self._send_queue.put(doc)
+        for doc, msg in queued:
+            self._send_queue.put(doc, encoded=msg)
+        _g_logger.info("Resumed the session after sequence %d, replaying %d "
+                       "messages" % (last_sequence, len(replay)))
+        return True
+
+    def _writer_failed(self, docs, exception, attempt=None):
+        # called from the writer thread without the connection lock.  The
+        # documents that were not written go out again on the next
+        # connection.
+        for doc, msg in docs:
+            self._send_queue.put(doc, encoded=msg)
+        self._throw_error(exception, notify=False, attempt=attempt)
+
+    def _start_writer(self):
+        self._stop_writer()
+        compress_level = 0
+        if self._compress:
+            compress_level = self._compression_level
+        self._writer = _FrameWriter(
+            self._ws, self._batch_limit,
+            functools.partial(self._writer_failed, attempt=self._attempt),
+            compress_level=compress_level,
+            compress_threshold=self._compression_threshold,
+            stats=self._stats, ping_interval=self._ping_interval)
+        self._writer.start()
+
+    def _stop_writer(self):
+        if self._writer is None:
+            return
+        for doc, msg in self._writer.stop():
+            self._send_queue.put(doc, encoded=msg)
+        self._writer = None
+
     def _sm_connect(self):
+        self._batch_limit = 0
+        self._compress = False
+        self._resumable = False
+        self._server_url = self._endpoints.select()
+        self._attempt += 1
         try:
             self._ws = _WebSocketClient(
                 self, self._server_url, self._receive_callback,
                 protocols=['dcm'], heartbeat_freq=self._heartbeat_freq,
-                ssl_options=self._ssl_options)
+                ssl_options=self._ssl_options, stats=self._stats,
+                tls_connector=self._tls_connector, attempt=self._attempt)
             dcm_events.register_callback(
-                self._forming_connection_thread, in_thread=True)
+                self._forming_connection_thread, args=[self._attempt],
+                in_thread=True)
         except Exception as ex:
             _g_logger.exception("Failed to connect to %s" % self._server_url)
             self._throw_error(ex, notify=False)
@@ -350,8 +983,14 @@ class WebSocketConnection(threading.Thread):
     def _sm_start_handshake(self):
         try:
             hs_doc = self._handshake_manager.get_send_document()
+            if self._outbox is not None:
+                hs_doc.setdefault('features', {})['resumable_session'] = True
+                hs_doc['last_sequence'] = self._outbox.last_acked()
             _g_logger.debug("Sending handshake")
-            self._ws.send(json.dumps(hs_doc))
+            payload = codec.dumps(hs_doc)
+            self._stats.handshake_started()
+            self._ws.send(payload)
+            self._stats.frame_sent(len(payload))
         except Exception as ex:
             _g_logger.exception("Failed to send handshake")
             self._throw_error(ex, notify=False)
@@ -370,8 +1009,15 @@ class WebSocketConnection(threading.Thread):
             self._ws.close()
         except Exception as ex:
             _g_logger.warn("Error closing the connection " + str(ex))
-        self._backoff.error()
         self._cond.notify_all()
+        if self._endpoints.failed(self._server_url):
+            # another endpoint is up so there is no reason to wait out the
+            # backoff on this one
+            _g_logger.info("Could not connect to %s, failing over to "
+                           "another endpoint" % self._server_url)
+            self._register_connect(delay=0)
+            return
+        self._backoff.error()
         self._register_connect()
 
     def _sm_received_hs(self, incoming_data=None):
@@ -383,6 +1029,9 @@ class WebSocketConnection(threading.Thread):
             hs = self._handshake_manager.incoming_document(incoming_data)
             _g_logger.debug("We received a handshake with reply code %d"
                             % hs.reply_type)
+            self._stats.handshake_finished(
+                hs.reply_type ==
+                handshake.HandshakeIncomingReply.REPLY_CODE_SUCCESS)
             if hs.reply_type != handshake.HandshakeIncomingReply.REPLY_CODE_SUCCESS:
                 _g_logger.warn("The handshake was rejected.")
                 if hs.reply_type == handshake.HandshakeIncomingReply.REPLY_CODE_FORCE_BACKOFF:
@@ -393,6 +1042,16 @@ class WebSocketConnection(threading.Thread):
                 ex = exceptions.AgentHandshakeException(hs)
                 self._throw_error(ex)
             else:
+                self._batch_limit = self._negotiate_batch_limit(hs)
+                if self._batch_limit:
+                    _g_logger.info("Batching messages into frames of up to "
+                                   "%d bytes" % self._batch_limit)
+                self._compress = self._negotiate_compression(hs)
+                if self._compress:
+                    _g_logger.info("Compressing frames of at least %d "
+                                   "bytes" % self._compression_threshold)
+                self._resumable = self._resume_session(hs)
+                self._manager_resumes = self._resumable
                 dcm_events.register_callback(self.event_successful_handshake,
                                              kwargs={"hs": hs})
             self._cond.notify()
@@ -420,9 +1079,18 @@ class WebSocketConnection(threading.Thread):
             dcm_events.register_callback(
                 self._receive_callback, args=[incoming_data])
         self._backoff.activity()
+        self._start_writer()
+        # anything queued while connecting can go out now
+        self._sm_open_poll()
 
     def _sm_open_incoming_message(self, incoming_data=None):
         _g_logger.debug("New message received")
+        if self._outbox is not None and isinstance(incoming_data, dict) and \
+                incoming_data.get('type') == \
+                message_types.MessageTypes.SEQ_ACK:
+            self._outbox.ack(int(incoming_data['sequence']))
+            self._backoff.activity()
+            return
         dcm_events.register_callback(
             self._receive_callback, args=[incoming_data])
         self._backoff.activity()
@@ -448,6 +1116,7 @@ class WebSocketConnection(threading.Thread):
         """
         _g_logger.debug("close called when open")
 
+        self._stop_writer()
         self._done_event.set()
         self._cond.notify_all()
         self._ws.close()
@@ -470,39 +1139,22 @@ class WebSocketConnection(threading.Thread):
 
     def _sm_open_poll(self):
         """
-        A poll event occurred in the open state.  Check the send queue
+        A poll event occurred in the open state.  Hand everything in the send
+        queue to the writer thread, it does the sending outside of this lock.
         """
-
-        # TODO XXXX find a way to send the data not in a lock
-        # check the send queue
-        done = False
-        while not done:
-            try:
-                doc = self._send_queue.get(False)
-                self._send_queue.task_done()
-
-                msg = json.dumps(doc)
-                self._ws.send(msg)
-            except socket.error as er:
-                if er.errno == errno.EPIPE:
-                    _g_logger.info(
-                        "The ws connection broke for %s" % self._server_url)
-                else:
-                    _g_logger.info(
-                        "A WS socket error occurred %s" % self._server_url)
-                self._throw_error(er)
-                done = True
-            except queue.Empty:
-                done = True
-            except Exception as ex:
-                _g_logger.exception(str(ex))
-                self._throw_error(ex)
-                done = True
+        docs = self._send_queue.get_all_encoded()
+        if docs and (self._writer is None or not self._writer.write(docs)):
+            # the writer failed and has already thrown an error, keep the
+            # documents for the next connection
+            for doc, msg in docs:
+                self._send_queue.put(doc, encoded=msg)
 
     def _sm_open_error(self):
         """
         An error occurred while the connection was open
         """
+        self._stop_writer()
+        self._backoff.connection_lost()
         self._cond.notify()
         self._register_connect()
 
@@ -556,135 +1208,137 @@ class WebSocketConnection(threading.Thread):
             _g_logger.exception(
                 "Got an error while closing in handshake state")
 
-    def _setup_states(self):
-        self._sm.add_transition(WsConnStates.WAITING,
+    # The protocol graph is built once for the class.  Handlers are named
+    # by method and looked up on each instance when an event occurs.
+    _transitions = state_machine.TransitionTable()
+    _transitions.add_transition(WsConnStates.WAITING,
                                 WsConnEvents.POLL,
                                 WsConnStates.WAITING,
-                                self._sm_connect_poll)
-        self._sm.add_transition(WsConnStates.WAITING,
+                                "_sm_connect_poll")
+    _transitions.add_transition(WsConnStates.WAITING,
                                 WsConnEvents.ERROR,
                                 WsConnStates.WAITING,
-                                self._sm_waiting_error)
-        self._sm.add_transition(WsConnStates.WAITING,
+                                "_sm_waiting_error")
+    _transitions.add_transition(WsConnStates.WAITING,
                                 WsConnEvents.CONNECT_TIMEOUT,
                                 WsConnStates.CONNECTING,
-                                self._sm_connect)
-        self._sm.add_transition(WsConnStates.WAITING,
+                                "_sm_connect")
+    _transitions.add_transition(WsConnStates.WAITING,
                                 WsConnEvents.CLOSE,
                                 WsConnStates.DONE,
-                                self._sm_not_open_close)
-        self._sm.add_transition(WsConnStates.WAITING,
+                                "_sm_not_open_close")
+    _transitions.add_transition(WsConnStates.WAITING,
                                 WsConnEvents.CONNECTING_FINISHED,
                                 WsConnStates.WAITING,
-                                self._sm_connection_finished_right_after_error)
+                                "_sm_connection_finished_right_after_error")
 
-        self._sm.add_transition(WsConnStates.CONNECTING,
+    _transitions.add_transition(WsConnStates.CONNECTING,
                                 WsConnEvents.CLOSE,
                                 WsConnStates.DONE,
-                                self._sm_close_while_connecting)
-        self._sm.add_transition(WsConnStates.CONNECTING,
+                                "_sm_close_while_connecting")
+    _transitions.add_transition(WsConnStates.CONNECTING,
                                 WsConnEvents.ERROR,
                                 WsConnStates.WAITING,
-                                self._sm_error_while_connecting)
-        self._sm.add_transition(WsConnStates.CONNECTING,
+                                "_sm_error_while_connecting")
+    _transitions.add_transition(WsConnStates.CONNECTING,
                                 WsConnEvents.CONNECTING_FINISHED,
                                 WsConnStates.HANDSHAKING,
-                                self._sm_start_handshake)
-        self._sm.add_transition(WsConnStates.CONNECTING,
+                                "_sm_start_handshake")
+    _transitions.add_transition(WsConnStates.CONNECTING,
                                 WsConnEvents.CONNECT_TIMEOUT,
                                 WsConnStates.CONNECTING,
                                 None)
-        self._sm.add_transition(WsConnStates.CONNECTING,
+    _transitions.add_transition(WsConnStates.CONNECTING,
                                 WsConnEvents.POLL,
                                 WsConnStates.CONNECTING,
                                 None)
 
-        self._sm.add_transition(WsConnStates.HANDSHAKING,
+    _transitions.add_transition(WsConnStates.HANDSHAKING,
                                 WsConnEvents.INCOMING_MESSAGE,
                                 WsConnStates.HANDSHAKE_RECEIVED,
-                                self._sm_received_hs)
-        self._sm.add_transition(WsConnStates.HANDSHAKING,
+                                "_sm_received_hs")
+    _transitions.add_transition(WsConnStates.HANDSHAKING,
                                 WsConnEvents.ERROR,
                                 WsConnStates.WAITING,
-                                self._sm_hs_failed)
-        self._sm.add_transition(WsConnStates.HANDSHAKING,
+                                "_sm_hs_failed")
+    _transitions.add_transition(WsConnStates.HANDSHAKING,
                                 WsConnEvents.POLL,
                                 WsConnStates.HANDSHAKING,
-                                self._sm_handshake_poll)
-        self._sm.add_transition(WsConnStates.HANDSHAKING,
+                                "_sm_handshake_poll")
+    _transitions.add_transition(WsConnStates.HANDSHAKING,
                                 WsConnEvents.CONNECT_TIMEOUT,
                                 WsConnStates.HANDSHAKING,
-                                self._sm_handshake_connect)
-        self._sm.add_transition(WsConnStates.HANDSHAKING,
+                                "_sm_handshake_connect")
+    _transitions.add_transition(WsConnStates.HANDSHAKING,
                                 WsConnEvents.CLOSE,
                                 WsConnStates.DONE,
-                                self._sm_hs_close)
+                                "_sm_hs_close")
 
-        self._sm.add_transition(WsConnStates.HANDSHAKE_RECEIVED,
+    _transitions.add_transition(WsConnStates.HANDSHAKE_RECEIVED,
                                 WsConnEvents.INCOMING_MESSAGE,
                                 WsConnStates.HANDSHAKE_RECEIVED,
-                                self._sm_pre_handshake_message)
-        self._sm.add_transition(WsConnStates.HANDSHAKE_RECEIVED,
+                                "_sm_pre_handshake_message")
+    _transitions.add_transition(WsConnStates.HANDSHAKE_RECEIVED,
                                 WsConnEvents.SUCCESSFUL_HANDSHAKE,
                                 WsConnStates.OPEN,
-                                self._sm_successful_handshake)
-        self._sm.add_transition(WsConnStates.HANDSHAKE_RECEIVED,
+                                "_sm_successful_handshake")
+    _transitions.add_transition(WsConnStates.HANDSHAKE_RECEIVED,
                                 WsConnEvents.ERROR,
                                 WsConnStates.WAITING,
-                                self._sm_hs_failed)
-        self._sm.add_transition(WsConnStates.HANDSHAKE_RECEIVED,
+                                "_sm_hs_failed")
+    _transitions.add_transition(WsConnStates.HANDSHAKE_RECEIVED,
                                 WsConnEvents.POLL,
                                 WsConnStates.HANDSHAKE_RECEIVED,
-                                self._sm_handshake_poll)
-        self._sm.add_transition(WsConnStates.HANDSHAKE_RECEIVED,
+                                "_sm_handshake_poll")
+    _transitions.add_transition(WsConnStates.HANDSHAKE_RECEIVED,
                                 WsConnEvents.CONNECT_TIMEOUT,
                                 WsConnStates.HANDSHAKE_RECEIVED,
-                                self._sm_handshake_connect)
-        self._sm.add_transition(WsConnStates.HANDSHAKE_RECEIVED,
+                                "_sm_handshake_connect")
+    _transitions.add_transition(WsConnStates.HANDSHAKE_RECEIVED,
                                 WsConnEvents.CLOSE,
                                 WsConnStates.DONE,
-                                self._sm_hs_close)
+                                "_sm_hs_close")
 
-        self._sm.add_transition(WsConnStates.OPEN,
+    _transitions.add_transition(WsConnStates.OPEN,
                                 WsConnEvents.CLOSE,
                                 WsConnStates.DONE,
-                                self._sm_close_open)
-        self._sm.add_transition(WsConnStates.OPEN,
+                                "_sm_close_open")
+    _transitions.add_transition(WsConnStates.OPEN,
                                 WsConnEvents.POLL,
                                 WsConnStates.OPEN,
-                                self._sm_open_poll)
-        self._sm.add_transition(WsConnStates.OPEN,
+                                "_sm_open_poll")
+    _transitions.add_transition(WsConnStates.OPEN,
                                 WsConnEvents.INCOMING_MESSAGE,
                                 WsConnStates.OPEN,
-                                self._sm_open_incoming_message)
-        self._sm.add_transition(WsConnStates.OPEN,
+                                "_sm_open_incoming_message")
+    _transitions.add_transition(WsConnStates.OPEN,
                                 WsConnEvents.ERROR,
                                 WsConnStates.WAITING,
-                                self._sm_open_error)
+                                "_sm_open_error")
 
-        self._sm.add_transition(WsConnStates.DONE,
+    _transitions.add_transition(WsConnStates.DONE,
                                 WsConnEvents.POLL,
                                 WsConnStates.DONE,
                                 None)
-        self._sm.add_transition(WsConnStates.DONE,
+    _transitions.add_transition(WsConnStates.DONE,
                                 WsConnEvents.CONNECT_TIMEOUT,
                                 WsConnStates.DONE,
                                 None)
-        self._sm.add_transition(WsConnStates.DONE,
+    _transitions.add_transition(WsConnStates.DONE,
                                 WsConnEvents.ERROR,
                                 WsConnStates.DONE,
                                 None)
-        self._sm.add_transition(WsConnStates.DONE,
+    _transitions.add_transition(WsConnStates.DONE,
                                 WsConnEvents.INCOMING_MESSAGE,
                                 WsConnStates.DONE,
                                 None)
-        # This can happen if close is called by the agent after the handshake
-        # has been determine to be successful but before the the event comes in
-        self._sm.add_transition(WsConnStates.DONE,
+    # This can happen if close is called by the agent after the handshake
+    # has been determine to be successful but before the the event comes in
+    _transitions.add_transition(WsConnStates.DONE,
                                 WsConnEvents.SUCCESSFUL_HANDSHAKE,
                                 WsConnStates.DONE,
                                 None)
-        self._sm.add_transition(WsConnStates.DONE,
+    _transitions.add_transition(WsConnStates.DONE,
                                 WsConnEvents.CONNECTING_FINISHED,
                                 WsConnStates.DONE,
-                                self._sm_connection_finished_right_after_done)
+                                "_sm_connection_finished_right_after_done")
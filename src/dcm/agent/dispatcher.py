@@ -20,6 +20,8 @@ import urllib.error
 import urllib.parse
 import urllib.request
 
+import dcm.agent.events.callback as events
+import dcm.agent.messaging.persistence as persistence
 import dcm.agent.plugins.api.base as plugin_base
 import dcm.agent.plugins.loader as plugin_loader
 import dcm.agent.logger as dcm_logger
@@ -125,7 +127,8 @@ class Worker(threading.Thread):
 
                         work_reply = WorkReply(workload.request_id, reply_doc)
                         dcm_events.register_callback(
-                            self._reply_callback, args=[work_reply])
+                            self._reply_callback, args=[work_reply],
+                            priority=events.Priority.HIGH)
 
                         _g_logger.info("Reply message sent for command " +
                                        workload.payload["command"])
@@ -195,8 +198,11 @@ class Dispatcher(object):
         if "longer_runner" in payload:
             long_runner = bool(payload["longer_runner"])
 
-        # we ack first.  This will write it to the persistent store before
+        # we ack first.  Unless the command is declared as relaxed or
+        # ephemeral this will write it to the persistent store before
         # sending the message so the agent will have it for restarts
+        reply_obj.set_durability(
+            items_map.get("durability", persistence.Durability.STRICT))
         reply_obj.ack(None, None, None)
         if long_runner:
             try:
@@ -217,7 +223,8 @@ class Dispatcher(object):
             reply_doc = reply_obj.get_reply_doc()
             wr = WorkReply(request_id, reply_doc)
             dcm_events.register_callback(
-                self.work_complete_callback, args=[wr])
+                self.work_complete_callback, args=[wr],
+                priority=events.Priority.HIGH)
         elif immediate:
             items_map["long_runner"] = self._long_runner
             reply_doc = _run_plugin(self._conf,
@@ -227,7 +234,8 @@ class Dispatcher(object):
                                     payload["arguments"])
             wr = WorkReply(request_id, reply_doc)
             dcm_events.register_callback(
-                self.work_complete_callback, args=[wr])
+                self.work_complete_callback, args=[wr],
+                priority=events.Priority.HIGH)
         else:
             workload = WorkLoad(request_id, payload, items_map)
             self.worker_q.put(workload)
@@ -0,0 +1,297 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import asyncio
+import logging
+import threading
+import time
+
+import dcm.agent.events.callback as callback
+import dcm.agent.events.loop_stats as loop_stats
+import dcm.agent.events.thread_pool as thread_pool
+
+
+_g_logger = logging.getLogger(__name__)
+
+
+class AsyncEventSpace(object):
+    """
+    An event space with the same interface as callback.EventSpace that is
+    driven by an asyncio event loop.
+
+    Callbacks are handed to the loop with call_soon_threadsafe() so they can
+    be registered from any thread.  Delayed callbacks become loop timers via
+    call_later().  poll() runs the loop in the calling thread for the given
+    amount of time.  in_thread callbacks are run on the same kind of bounded
+    thread pool that callback.EventSpace uses.
+    """
+
+    def __init__(self, max_threads=8, max_queue=256):
+        self._loop = asyncio.new_event_loop()
+        self._lock = threading.RLock()
+        self._done = False
+        # every registered callback that has not yet been dispatched maps to
+        # its loop timer handle (None until the timer is created)
+        self._pending = {}
+        self._coalesced = {}
+        self._merged_count = 0
+        self._any_called = False
+        self._thread_pool = thread_pool.CallbackThreadPool(
+            max_threads=max_threads, max_queue=max_queue)
+        self._stats = loop_stats.EventLoopStats()
+
+    def get_loop(self):
+        """
+        :return: The asyncio event loop which drives this event space.
+        """
+        return self._loop
+
+    def configure_thread_pool(self, max_threads=None, max_queue=None):
+        self._thread_pool.set_limits(max_threads=max_threads,
+                                     max_queue=max_queue)
+
+    def get_thread_pool_stats(self):
+        return self._thread_pool.get_stats()
+
+    def get_pending_count(self):
+        self._lock.acquire()
+        try:
+            return len(self._pending)
+        finally:
+            self._lock.release()
+
+    def get_loop_stats(self, clear=False):
+        """
+        See callback.EventSpace.get_loop_stats
+        """
+        self._lock.acquire()
+        try:
+            now = time.monotonic()
+            ready = 0
+            oldest_overdue = 0.0
+            for ub in self._pending:
+                overdue = now - ub.get_time_ready()
+                if overdue >= 0.0:
+                    ready += 1
+                    oldest_overdue = max(oldest_overdue, overdue)
+            stats = self._stats.get_stats()
+            stats["pending"] = len(self._pending)
+            stats["ready"] = ready
+            stats["oldest_overdue"] = oldest_overdue
+            stats["coalesced_pending"] = len(self._coalesced)
+            stats["coalesced_merges"] = self._merged_count
+        finally:
+            self._lock.release()
+        stats["thread_pool"] = self._thread_pool.get_stats()
+        if clear:
+            self._stats.clear()
+        return stats
+
+    def register_callback(self, func, args=None, kwargs=None, delay=0,
+                          in_thread=False, priority=callback.Priority.NORMAL):
+        """
+        See callback.EventSpace.register_callback.  The asyncio loop runs
+        callbacks in the order that they become ready so the priority is
+        recorded on the callback but does not change when it runs.
+        """
+        self._lock.acquire()
+        try:
+            return self._register(func, args, kwargs, delay, in_thread,
+                                  priority)
+        finally:
+            self._lock.release()
+
+    def register_coalesced(self, key, func, args=None, kwargs=None, delay=0,
+                           in_thread=False, priority=callback.Priority.NORMAL,
+                           debounce=False):
+        """
+        See callback.EventSpace.register_coalesced
+        """
+        self._lock.acquire()
+        try:
+            ub = self._coalesced.get(key)
+            if ub is None:
+                ub = self._register(func, args, kwargs, delay, in_thread,
+                                    priority)
+                ub._coalesce_key = key
+                self._coalesced[key] = ub
+                return ub
+
+            self._merged_count += 1
+            if debounce and delay > 0:
+                # the timer is left alone, when it fires _dispatch sees the
+                # new ready time and sets a new one
+                ub._update(func, args, kwargs,
+                           time_ready=time.monotonic() + delay)
+            else:
+                ub._update(func, args, kwargs)
+            return ub
+        finally:
+            self._lock.release()
+
+    def _register(self, func, args, kwargs, delay, in_thread, priority):
+        # This should only be called locked
+        if self._done:
+            raise Exception("We cannot register callbacks because this "
+                            "space has been stopped.")
+        ub = callback.UserCallback(func, args, kwargs, delay, in_thread,
+                                   stats=self._stats, priority=priority)
+        self._pending[ub] = None
+        if delay > 0:
+            self._loop.call_soon_threadsafe(self._start_timer, ub, delay)
+        else:
+            self._loop.call_soon_threadsafe(self._dispatch, ub)
+        return ub
+
+    def _forget_coalesced(self, ub):
+        # This should only be called locked
+        key = ub._coalesce_key
+        if key is not None and self._coalesced.get(key) is ub:
+            del self._coalesced[key]
+
+    def _start_timer(self, ub, delay):
+        self._lock.acquire()
+        try:
+            if ub not in self._pending:
+                # it was canceled before the timer could be set
+                return
+            self._pending[ub] = self._loop.call_later(
+                delay, self._dispatch, ub)
+        finally:
+            self._lock.release()
+
+    def _dispatch(self, ub):
+        self._lock.acquire()
+        try:
+            if ub not in self._pending:
+                return
+            remaining = ub.get_time_ready() - time.monotonic()
+            if remaining > 0:
+                # a debounced merge moved the ready time out
+                self._pending[ub] = self._loop.call_later(
+                    remaining, self._dispatch, ub)
+                return
+            del self._pending[ub]
+            self._forget_coalesced(ub)
+        finally:
+            self._lock.release()
+
+        if ub.in_thread():
+            if not self._thread_pool.submit(ub.call):
+                self._retry_rejected(ub)
+        else:
+            self._any_called = True
+            ub.call()
+
+    def _retry_rejected(self, ub):
+        # the pool was full.  The callback waits for a free thread rather
+        # than being lost, its owner may be waiting on it.
+        _g_logger.warning("All of the callback threads are busy and the "
+                          "queue is full, %s will be retried" % str(ub))
+        self._lock.acquire()
+        try:
+            if ub._canceled:
+                return
+            self._pending[ub] = self._loop.call_later(
+                callback.REJECTED_RETRY_DELAY, self._dispatch, ub)
+        finally:
+            self._lock.release()
+
+    def _cancel_handle(self, handle):
+        if handle is not None:
+            self._loop.call_soon_threadsafe(handle.cancel)
+
+    def cancel_callback(self, ub):
+        """
+        See callback.EventSpace.cancel_callback
+        """
+        self._lock.acquire()
+        try:
+            rc = ub._cancel()
+            if rc and ub in self._pending:
+                self._cancel_handle(self._pending.pop(ub))
+                self._forget_coalesced(ub)
+            return rc
+        finally:
+            self._lock.release()
+
+    def _cancel_all(self):
+        self._lock.acquire()
+        try:
+            for ub, handle in self._pending.items():
+                ub._cancel()
+                self._cancel_handle(handle)
+            self._pending = {}
+            self._coalesced = {}
+        finally:
+            self._lock.release()
+
+    def stop(self):
+        """
+        See callback.EventSpace.stop
+        """
+        self._lock.acquire()
+        try:
+            self._done = True
+        finally:
+            self._lock.release()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def poll(self, timeblock=5.0):
+        """
+        Run the event loop in the calling thread for timeblock seconds.
+        :param timeblock: The amount of time to wait for events to be ready
+        :return: A boolean is returned to indicate if an event was called
+        or not
+        """
+        self._lock.acquire()
+        try:
+            if self._done:
+                return False
+        finally:
+            self._lock.release()
+
+        self._any_called = False
+        stop_handle = self._loop.call_later(timeblock, self._loop.stop)
+        try:
+            self._loop.run_forever()
+        finally:
+            stop_handle.cancel()
+        return self._any_called
+
+    def wakeup(self, cancel_all=False):
+        """
+        See callback.EventSpace.wakeup
+        """
+        if cancel_all:
+            self._cancel_all()
+        self._loop.call_soon_threadsafe(lambda: None)
+
+    def reset(self):
+        self._lock.acquire()
+        try:
+            self._done = True
+        finally:
+            self._lock.release()
+        self._cancel_all()
+
+        # wait for the callbacks that are already running in threads
+        self._thread_pool.drain()
+
+        self._lock.acquire()
+        try:
+            self._done = False
+        finally:
+            self._lock.release()
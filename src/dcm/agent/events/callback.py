@@ -13,15 +13,43 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
-import datetime
-import heapq
+import collections
 import logging
 import threading
+import time
+
+import dcm.agent.exceptions as exceptions
+import dcm.agent.events.loop_stats as loop_stats
+import dcm.agent.events.thread_pool as thread_pool
+import dcm.agent.events.timer_wheel as timer_wheel
 
 
 _g_logger = logging.getLogger(__name__)
 
 
+class Priority(object):
+    """
+    The lanes that ready callbacks wait in.  Protocol traffic (replies, acks
+    and their timers) is HIGH, telemetry such as log shipping and alerts is
+    LOW and everything else is NORMAL.
+    """
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
+    ALL = (HIGH, NORMAL, LOW)
+    NAMES = {HIGH: "high", NORMAL: "normal", LOW: "low"}
+
+
+# The number of callbacks each lane may run in one batch when all of the
+# lanes are busy.  The low lane always gets its share so it cannot starve.
+DEFAULT_LANE_WEIGHTS = {Priority.HIGH: 8, Priority.NORMAL: 4, Priority.LOW: 1}
+
+# The number of seconds an in_thread callback waits before it is offered to
+# the thread pool again when the pool was full.
+REJECTED_RETRY_DELAY = 0.05
+
+
 class UserCallback(object):
     """
     This object is a handle to an event which was registered in an EventSpace.
@@ -29,28 +57,32 @@ class UserCallback(object):
     examine the results of a event that has completed.
     """
 
-    def __init__(self, func, args, kwargs, delay, in_thread):
+    def __init__(self, func, args, kwargs, delay, in_thread, stats=None,
+                 priority=Priority.NORMAL):
         self._func = func
+        self._stats = stats
+        self._priority = priority
+        self._coalesce_key = None
         self._canceled = False
         self._called = False
         self._calling = False
         self._args = args
         self._in_thread = in_thread
-        self._run_thread = None
+        self._done_event = threading.Event()
         if args is None:
             self._args = []
         self._kwargs = kwargs
         if kwargs is None:
             self._kwargs = {}
-        self._time_ready = datetime.datetime.now() +\
-            datetime.timedelta(seconds=delay)
+        self._time_ready = time.monotonic() + delay
         self._lock = threading.RLock()
         self._rc = None
         self._exception = None
 
     def get_time_ready(self):
         """
-        :return: The time at which this callback will be ready to be called.
+        :return: The time at which this callback will be ready to be called
+        on the time.monotonic() clock.
         """
         self._lock.acquire()
         try:
@@ -58,6 +90,28 @@ class UserCallback(object):
         finally:
             self._lock.release()
 
+    def get_priority(self):
+        return self._priority
+
+    def _update(self, func, args, kwargs, time_ready=None):
+        """
+        Replace what will be called.  This is only safe while the callback
+        is still waiting in its event space.
+        """
+        self._lock.acquire()
+        try:
+            self._func = func
+            self._args = args
+            if args is None:
+                self._args = []
+            self._kwargs = kwargs
+            if kwargs is None:
+                self._kwargs = {}
+            if time_ready is not None:
+                self._time_ready = time_ready
+        finally:
+            self._lock.release()
+
     def __repr__(self):
         return str(self._func)
 
@@ -69,11 +123,13 @@ class UserCallback(object):
         self._lock.acquire()
         try:
             if self._canceled:
+                self._done_event.set()
                 return
             self._calling = True
         finally:
             self._lock.release()
 
+        start_time = time.monotonic()
         try:
             self._rc = self._func(*self._args, **self._kwargs)
             self._called = True  # This should be safe unlocked
@@ -87,7 +143,13 @@ class UserCallback(object):
             _g_logger.debug("UserCallback function %s returned successfully."
                             % self._func.__name__)
         finally:
+            if self._stats is not None:
+                self._stats.record(
+                    getattr(self._func, "__name__", str(self._func)),
+                    start_time - self._time_ready,
+                    time.monotonic() - start_time)
             self._called = True  # This should be safe unlocked
+            self._done_event.set()
 
     def _cancel(self):
         """
@@ -98,22 +160,23 @@ class UserCallback(object):
         """
         self._lock.acquire()
         try:
-            self._time_ready = datetime.datetime.now()
             self._canceled = True
+            if not self._calling:
+                self._done_event.set()
             return not self._calling
         finally:
             self._lock.release()
 
     def is_ready(self, tm=None):
         """
-        :param tm: The time to check the ready time against.  If None the
-        current time will be used.
+        :param tm: The time.monotonic() time to check the ready time against.
+        If None the current time will be used.
         :return:  A bool indicating if this callback object is ready to be
         called.  If the associated delay has expired the callback is ready
         to be called and True is returned.
         """
         if tm is None:
-            tm = datetime.datetime.now()
+            tm = time.monotonic()
         self._lock.acquire()
         try:
             return self._time_ready <= tm
@@ -164,12 +227,11 @@ class UserCallback(object):
 
     def join(self):
         """
-        When a callback is run in its own thread the user may want to join
-        that thread.  This method allows for this.
+        When a callback is run in its own thread the user may want to wait
+        for it to finish.  This method allows for this.
         """
-        if self._run_thread:
-            self._run_thread.join()
-            self._run_thread = None
+        if self._in_thread:
+            self._done_event.wait()
 
 
 class EventSpace(object):
@@ -187,18 +249,102 @@ class EventSpace(object):
     managing them.
     """
 
-    def __init__(self):
+    def __init__(self, max_threads=8, max_queue=256, lane_weights=None):
         """
+        :param max_threads: The maximum number of threads used to run
+        in_thread callbacks.
+        :param max_queue: The number of in_thread callbacks that can wait for
+        a free thread before new ones are rejected.
+        :param lane_weights: A dictionary of Priority to the number of
+        callbacks from that lane that are run in each batch when every lane
+        has work.
         :return:
         """
-        self._q = []
+        # callbacks that are ready to run are kept in insertion order in the
+        # lane for their priority.  Those with a delay sit in a timer wheel
+        # until they expire.  Both allow a canceled callback to be removed
+        # in constant time.
+        self._lanes = [collections.OrderedDict() for _ in Priority.ALL]
+        if lane_weights is None:
+            lane_weights = DEFAULT_LANE_WEIGHTS
+        self._lane_weights = [max(1, lane_weights[p]) for p in Priority.ALL]
+        self._batch_size = sum(self._lane_weights)
+        # coalescing keys of callbacks that are still waiting to run
+        self._coalesced = {}
+        self._merged_count = 0
+        self._wheel = timer_wheel.TimerWheel(time.monotonic())
         self._cond = threading.Condition()
         self._done = False
-        self._running_threads = []
-        self._done_threads = []
+        self._thread_pool = thread_pool.CallbackThreadPool(
+            max_threads=max_threads, max_queue=max_queue)
+        self._stats = loop_stats.EventLoopStats()
+
+    def configure_thread_pool(self, max_threads=None, max_queue=None):
+        """
+        Change the limits of the pool that runs in_thread callbacks.
+        """
+        self._thread_pool.set_limits(max_threads=max_threads,
+                                     max_queue=max_queue)
+
+    def get_thread_pool_stats(self):
+        """
+        :return: A dictionary describing the pool that runs in_thread
+        callbacks.  It includes the number of active threads, the queue
+        length and the number of rejected callbacks.
+        """
+        return self._thread_pool.get_stats()
+
+    def get_pending_count(self):
+        """
+        :return: The number of callbacks that are waiting to be run.
+        """
+        self._cond.acquire()
+        try:
+            return self._ready_count() + len(self._wheel)
+        finally:
+            self._cond.release()
+
+    def _ready_count(self):
+        # This should only be called locked
+        return sum(len(lane) for lane in self._lanes)
+
+    def get_loop_stats(self, clear=False):
+        """
+        :param clear: Start new histograms after taking this snapshot.
+        :return: A dictionary with histograms of how long callbacks waited
+        after they were ready and how long they ran, the number of pending
+        callbacks and the age of the oldest callback that is overdue.
+        """
+        self._cond.acquire()
+        try:
+            # anything that expired while poll() was busy running a slow
+            # callback is still in the wheel, move it over so it is counted
+            now = time.monotonic()
+            self._expire_timers(now)
+            oldest_overdue = 0.0
+            lanes = {}
+            for priority in Priority.ALL:
+                lane = self._lanes[priority]
+                lanes[Priority.NAMES[priority]] = len(lane)
+                for ub in lane:
+                    oldest_overdue = max(oldest_overdue,
+                                         now - ub.get_time_ready())
+            stats = self._stats.get_stats()
+            stats["pending"] = self._ready_count() + len(self._wheel)
+            stats["ready"] = self._ready_count()
+            stats["lanes"] = lanes
+            stats["oldest_overdue"] = oldest_overdue
+            stats["coalesced_pending"] = len(self._coalesced)
+            stats["coalesced_merges"] = self._merged_count
+        finally:
+            self._cond.release()
+        stats["thread_pool"] = self._thread_pool.get_stats()
+        if clear:
+            self._stats.clear()
+        return stats
 
     def register_callback(self, func, args=None, kwargs=None, delay=0,
-                          in_thread=False):
+                          in_thread=False, priority=Priority.NORMAL):
         """
         :param func: The callable object (typically a function or a method)
          which will be called later by the event system.
@@ -210,21 +356,77 @@ class EventSpace(object):
         :param delay: The number or seconds to wait before calling func.  More
          time may expire but at least the given number of seconds will pass.
         :param in_thread: Run the callback in its own thread.
+        :param priority: The Priority lane the callback waits in once it is
+        ready.  Ready HIGH callbacks run ahead of NORMAL and LOW ones.
         :return: A UserCallback object which is a handle to this callback
         registration.  It can be used to inspect and manage that event.
         """
+        if priority not in Priority.NAMES:
+            raise exceptions.AgentRuntimeException(
+                "%s is not a valid callback priority." % str(priority))
         self._cond.acquire()
         try:
-            if self._done:
-                raise Exception("We cannot register callbacks because this "
-                                "space has been stopped.")
-            ub = UserCallback(func, args, kwargs, delay, in_thread)
-            heapq.heappush(self._q, ub)
-            self._cond.notify()
+            return self._register(func, args, kwargs, delay, in_thread,
+                                  priority)
+        finally:
+            self._cond.release()
+
+    def register_coalesced(self, key, func, args=None, kwargs=None, delay=0,
+                           in_thread=False, priority=Priority.NORMAL,
+                           debounce=False):
+        """
+        Register a callback that is merged with any other callback that was
+        registered with the same key and has not yet started.  Only one
+        callback per key is ever pending, a burst of registrations results
+        in a single call made with the arguments of the latest one.
+        :param key: Any hashable object that names the logical callback.
+        :param debounce: If True every merge pushes the time the callback
+        is ready out to delay seconds from now.  Otherwise the time set by
+        the first registration stands.
+        See register_callback for the rest of the parameters.
+        :return: The UserCallback handle for the pending callback.  A merged
+        registration returns the same handle as the one it was merged into.
+        """
+        if priority not in Priority.NAMES:
+            raise exceptions.AgentRuntimeException(
+                "%s is not a valid callback priority." % str(priority))
+        self._cond.acquire()
+        try:
+            ub = self._coalesced.get(key)
+            if ub is None:
+                ub = self._register(func, args, kwargs, delay, in_thread,
+                                    priority)
+                ub._coalesce_key = key
+                self._coalesced[key] = ub
+                return ub
+
+            self._merged_count += 1
+            if debounce and ub in self._wheel:
+                self._wheel.remove(ub)
+                ub._update(func, args, kwargs,
+                           time_ready=time.monotonic() + delay)
+                self._wheel.add(ub, ub.get_time_ready())
+                self._cond.notify()
+            else:
+                ub._update(func, args, kwargs)
             return ub
         finally:
             self._cond.release()
 
+    def _register(self, func, args, kwargs, delay, in_thread, priority):
+        # This should only be called locked
+        if self._done:
+            raise Exception("We cannot register callbacks because this "
+                            "space has been stopped.")
+        ub = UserCallback(func, args, kwargs, delay, in_thread,
+                          stats=self._stats, priority=priority)
+        if delay > 0:
+            self._wheel.add(ub, ub.get_time_ready())
+        else:
+            self._lanes[priority][ub] = None
+        self._cond.notify()
+        return ub
+
     def stop(self):
         """
         Stop this event space.  Once this is called no future events can be
@@ -239,90 +441,126 @@ class EventSpace(object):
         finally:
             self._cond.release()
 
+    def _remove(self, ub):
+        # This should only be called locked
+        if self._lanes[ub.get_priority()].pop(ub, False) is False:
+            self._wheel.remove(ub)
+        self._forget_coalesced(ub)
+
+    def _forget_coalesced(self, ub):
+        # This should only be called locked.  Once a coalesced callback is
+        # running or gone new registrations with its key start a new one.
+        key = ub._coalesce_key
+        if key is not None and self._coalesced.get(key) is ub:
+            del self._coalesced[key]
+
+    def _expire_timers(self, now):
+        # This should only be called locked
+        for ub in self._wheel.advance(now):
+            self._lanes[ub.get_priority()][ub] = None
+
+    def _cancel_all(self):
+        # This should only be called locked
+        for lane in self._lanes:
+            for ub in lane:
+                ub._cancel()
+        self._lanes = [collections.OrderedDict() for _ in Priority.ALL]
+        for ub in self._wheel.clear():
+            ub._cancel()
+        self._coalesced = {}
+
     def cancel_callback(self, ub):
         """
         This will attempt to safely cancel a callback.  In some cases the
         callback will be too far into the registration process to successfully
         cancel, or it may have already been run.  If the cancel is successful
-        True will be returned, otherwise False.
+        True will be returned, otherwise False.  A canceled callback is
+        removed from the event space immediately.
         :param ub:  The handle to the registered func to cancel.
         :return: A boolean indicating if the event was successfully canceled.
         """
         self._cond.acquire()
         try:
             rc = ub._cancel()
+            if rc:
+                self._remove(ub)
             self._cond.notify()
             return rc
         finally:
             self._cond.release()
 
-    def _run_threaded(self, ub):
-        this_thread = threading.currentThread()
-        try:
-            ub.call()
-        finally:
-            self._cond.acquire()
-            try:
-                self._running_threads.remove(this_thread)
-                self._done_threads.append(this_thread)
-                self._cond.notifyAll()
-            finally:
-                self._cond.release()
+    def _take_batch(self):
+        # This should only be called locked.  Each lane gets its weighted
+        # share of the batch first, highest priority first, so new HIGH
+        # callbacks never wait behind a long run of LOW ones and LOW ones
+        # still make progress when the higher lanes are busy.  Whatever
+        # room is left is then filled in priority order.
+        batch = []
+        for priority in Priority.ALL:
+            lane = self._lanes[priority]
+            for _ in range(min(self._lane_weights[priority], len(lane))):
+                batch.append(lane.popitem(last=False)[0])
+        for lane in self._lanes:
+            while lane and len(batch) < self._batch_size:
+                batch.append(lane.popitem(last=False)[0])
+        if self._coalesced:
+            for ub in batch:
+                self._forget_coalesced(ub)
+        return batch
 
     def _build_ready_list(self, now, end_time):
-        # get everything that is ready right now while under lock.  It nothing
-        # is ready a time to sleep is returned
+        # get a batch of what is ready right now while under lock.  If
+        # nothing is ready a time to sleep is returned.  Once the poll time
+        # is up everything that is ready is taken (still in priority order)
+        # so that a poll always runs what was ready when it ends.
+        self._expire_timers(now)
+
+        batch = self._take_batch()
+        if end_time <= now:
+            more = self._take_batch()
+            while more:
+                batch.extend(more)
+                more = self._take_batch()
+
         ready_list = []
-        done = False
-        first_not_ready = None
-        while not done:
-            head_ub = heapq.nsmallest(1, self._q)
-            if head_ub:
-                if head_ub[0].is_ready(tm=now):
-                    ub = heapq.heappop(self._q)
-                    if ub.in_thread():
-                        _run_thread = threading.Thread(
-                            target=self._run_threaded,
-                            args=(ub,))
-                        self._running_threads.append(_run_thread)
-                        _run_thread.start()
-                    else:
-                        ready_list.append(ub)
-                else:
-                    first_not_ready = head_ub[0]
-                    done = True
+        busy = 0
+        for ub in batch:
+            if ub.in_thread():
+                if not self._thread_pool.submit(ub.call):
+                    # the callback waits for a free thread rather than
+                    # being lost, its owner may be waiting on it
+                    self._wheel.add(ub, now + REJECTED_RETRY_DELAY)
+                    busy += 1
             else:
-                done = True
-        if ready_list:
+                ready_list.append(ub)
+        if busy:
+            _g_logger.warning("All of the callback threads are busy and the "
+                              "queue is full, %d callbacks will be retried"
+                              % busy)
+
+        if ready_list or self._ready_count():
             sleep_time = 0.0
         else:
-            if first_not_ready:
-                ready_time = min(end_time, head_ub[0].get_time_ready())
-            else:
-                ready_time = end_time
-            td = ready_time - now
-            sleep_time = max(0.0, td.total_seconds())
+            ready_time = end_time
+            next_expiry = self._wheel.next_expiry()
+            if next_expiry is not None:
+                ready_time = min(end_time, next_expiry)
+            sleep_time = max(0.0, ready_time - now)
 
         return ready_list, sleep_time
 
-    def _clear_done_threads(self):
-        # This should only be called locked
-        for t in self._done_threads[:]:
-            t.join()
-            self._done_threads.remove(t)
-
     def poll(self, timeblock=5.0):
         """
         Poll an event space to check for ready event callbacks.  If a event
         is scheduled it will be called directly from the current call stack
         (if this object was initialized with use_threads=False) or it will
-        be registered in a new thread.
+        be handed to the thread pool.
         :param timeblock: The amount of time to wait for events to be ready
         :return: A boolean is returned to indicate if an event was called
         or not
         """
-        now = datetime.datetime.now()
-        end_time = now + datetime.timedelta(seconds=timeblock)
+        now = time.monotonic()
+        end_time = now + timeblock
         done = False
         any_called = False
         while not done:
@@ -332,7 +570,6 @@ class EventSpace(object):
                 if self._done:
                     return any_called
 
-                self._clear_done_threads()
                 ready_to_unlock = False
                 while not ready_to_unlock and not done:
                     ready_list, sleep_time =\
@@ -347,7 +584,7 @@ class EventSpace(object):
                         ready_to_unlock = True
 
                     # check to see if time expired here to end all loops
-                    now = datetime.datetime.now()
+                    now = time.monotonic()
                     done = end_time < now
             finally:
                 self._cond.release()
@@ -369,8 +606,7 @@ class EventSpace(object):
         self._cond.acquire()
         try:
             if cancel_all:
-                for ub in self._q:
-                    ub._cancel()
+                self._cancel_all()
             self._cond.notifyAll()
         finally:
             self._cond.release()
@@ -384,13 +620,17 @@ class EventSpace(object):
             self._done = True
             # canceling everything in the list will mark everything that is
             # not already effectively running to never run
-            for ub in self._q:
-                ub._cancel()
-            self._q = []
-            while len(self._running_threads) > 0:
-                self._cond.wait()
-            self._clear_done_threads()
-            # now that everything is clear allow new registrations again
+            self._cancel_all()
+        finally:
+            self._cond.release()
+
+        # wait for the callbacks that are already running in threads.  This
+        # is done unlocked because they may touch the event space
+        self._thread_pool.drain()
+
+        # now that everything is clear allow new registrations again
+        self._cond.acquire()
+        try:
             self._done = False
         finally:
             self._cond.release()
@@ -13,12 +13,67 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+import dcm.agent.exceptions as exceptions
+import dcm.agent.events.async_space as async_space
 import dcm.agent.events.callback as events
 import dcm.agent.events.pubsub as pubsub
 
-global_space = events.EventSpace()
+
+class EventSpaceTypes(object):
+    THREADED = "threaded"
+    ASYNCIO = "asyncio"
+
+
+_g_space_types = {
+    EventSpaceTypes.THREADED: events.EventSpace,
+    EventSpaceTypes.ASYNCIO: async_space.AsyncEventSpace
+}
+
+
+class _GlobalEventSpace(object):
+    """
+    Most modules bind to the global event space when they are imported, long
+    before the configuration is read.  This object stays the same for the
+    life of the process and forwards everything to the event space
+    implementation that the configuration selected.
+    """
+
+    def __init__(self, space):
+        self._space = space
+
+    def __getattr__(self, name):
+        return getattr(self._space, name)
+
+    def get_space(self):
+        return self._space
+
+    def set_space(self, space):
+        self._space = space
+
+
+global_space = _GlobalEventSpace(events.EventSpace())
 global_pubsub = pubsub.PubSubEvent(global_space)
 
 
+def set_event_space_type(space_type):
+    """
+    Switch the implementation behind global_space.  This must happen before
+    any callbacks are registered.
+    :param space_type: One of the EventSpaceTypes values.
+    """
+    if space_type not in _g_space_types:
+        raise exceptions.AgentOptionValueException(
+            "[events]space_type", space_type, ",".join(_g_space_types))
+    space_cls = _g_space_types[space_type]
+    current = global_space.get_space()
+    if type(current) == space_cls:
+        return
+    if current.get_pending_count() > 0:
+        raise exceptions.AgentRuntimeException(
+            "The event space cannot be changed while callbacks are pending.")
+    current.reset()
+    global_space.set_space(space_cls())
+
+
 class DCMAgentTopics(object):
     CLEANUP = "CLEANUP"
@@ -0,0 +1,154 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import threading
+
+
+# The upper bound, in seconds, of every histogram bucket.  Anything larger
+# than the last bound lands in a final overflow bucket.
+DEFAULT_BUCKET_BOUNDS = (0.0001, 0.00025, 0.0005,
+                         0.001, 0.0025, 0.005,
+                         0.01, 0.025, 0.05,
+                         0.1, 0.25, 0.5,
+                         1.0, 2.5, 5.0,
+                         10.0, 30.0, 60.0)
+
+OTHER_FUNCTIONS_NAME = "<other>"
+
+
+class Histogram(object):
+    """
+    A histogram with a fixed set of buckets.  Recording a value is O(number
+    of buckets) and the memory used never grows.  This object is not thread
+    safe, the owner must serialize access to it.
+    """
+
+    def __init__(self, bounds=DEFAULT_BUCKET_BOUNDS):
+        self._bounds = bounds
+        self._counts = [0] * (len(bounds) + 1)
+        self._count = 0
+        self._total = 0.0
+        self._max = 0.0
+
+    def record(self, value):
+        ndx = 0
+        for bound in self._bounds:
+            if value <= bound:
+                break
+            ndx += 1
+        self._counts[ndx] += 1
+        self._count += 1
+        self._total += value
+        if value > self._max:
+            self._max = value
+
+    def _percentile(self, fraction):
+        # report the upper bound of the bucket that holds the percentile.
+        # The overflow bucket reports the largest value seen.
+        needed = fraction * self._count
+        seen = 0
+        for ndx, count in enumerate(self._counts):
+            seen += count
+            if count and seen >= needed:
+                if ndx < len(self._bounds):
+                    return min(self._bounds[ndx], self._max)
+                return self._max
+        return 0.0
+
+    def get_stats(self):
+        buckets = []
+        for ndx, count in enumerate(self._counts):
+            if ndx < len(self._bounds):
+                bound = self._bounds[ndx]
+            else:
+                bound = None
+            buckets.append([bound, count])
+        mean = 0.0
+        if self._count:
+            mean = self._total / self._count
+        return {
+            "count": self._count,
+            "mean": mean,
+            "max": self._max,
+            "p50": self._percentile(0.5),
+            "p90": self._percentile(0.9),
+            "p99": self._percentile(0.99),
+            "buckets": buckets
+        }
+
+
+class EventLoopStats(object):
+    """
+    Latency statistics for the callbacks run by an event space.
+
+    For every callback the time it waited between becoming ready and being
+    started and the time it ran are recorded.  The run time is also
+    recorded per function name.  Only max_functions names are tracked
+    individually, the rest are lumped together so the memory used is fixed.
+    """
+
+    def __init__(self, max_functions=64, bounds=DEFAULT_BUCKET_BOUNDS):
+        self._lock = threading.Lock()
+        self._max_functions = max_functions
+        self._bounds = bounds
+        self._wait = Histogram(bounds)
+        self._run = Histogram(bounds)
+        self._functions = {}
+
+    def record(self, func_name, wait_time, run_time):
+        """
+        :param func_name: The name of the function that was called.
+        :param wait_time: The number of seconds between the time the
+        callback was ready and the time it started.
+        :param run_time: The number of seconds the callback ran.
+        """
+        self._lock.acquire()
+        try:
+            self._wait.record(max(0.0, wait_time))
+            self._run.record(run_time)
+            hist = self._functions.get(func_name)
+            if hist is None:
+                if len(self._functions) >= self._max_functions:
+                    func_name = OTHER_FUNCTIONS_NAME
+                    hist = self._functions.get(func_name)
+                if hist is None:
+                    hist = Histogram(self._bounds)
+                    self._functions[func_name] = hist
+            hist.record(run_time)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._wait = Histogram(self._bounds)
+            self._run = Histogram(self._bounds)
+            self._functions = {}
+        finally:
+            self._lock.release()
+
+    def get_stats(self):
+        self._lock.acquire()
+        try:
+            functions = {}
+            for func_name, hist in self._functions.items():
+                functions[func_name] = hist.get_stats()
+            return {
+                "wait_time": self._wait.get_stats(),
+                "run_time": self._run.get_stats(),
+                "functions": functions
+            }
+        finally:
+            self._lock.release()
@@ -13,13 +13,33 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+import collections
+import itertools
 import logging
 import threading
 
+import dcm.agent.exceptions as exceptions
+
 
 _g_logger = logging.getLogger(__name__)
 
 
+# Topics are split into levels on this separator.  In a subscription a level
+# of SINGLE_LEVEL_WILDCARD matches exactly one level of a published topic and
+# a final level of MULTI_LEVEL_WILDCARD matches zero or more levels.
+TOPIC_SEPARATOR = "."
+SINGLE_LEVEL_WILDCARD = "*"
+MULTI_LEVEL_WILDCARD = "#"
+
+# The number of published topic names whose subscriber tuples are cached.
+# The cache is simply emptied when it fills up.
+MATCH_CACHE_SIZE = 1024
+
+
+SubscriberResult = collections.namedtuple(
+    "SubscriberResult", ["subscriber", "return_value", "error"])
+
+
 def _deliver_topic(
         subs=None, topic_args=None, topic_kwargs=None, done_cb=None,
         done_kwargs=None):
@@ -43,55 +63,237 @@ def _deliver_topic(
         done_cb(topic_error, **done_kwargs)
 
 
+class _ParallelDelivery(object):
+    """
+    Delivers one published topic to every subscriber at the same time as
+    in_thread callbacks of the event space and gathers a SubscriberResult
+    for each of them.  Once the last subscriber returns done_cb is
+    registered with the event space.
+    """
+
+    def __init__(self, event_space, subs, topic_args, topic_kwargs,
+                 done_cb, done_kwargs):
+        self._event_space = event_space
+        self._subs = subs
+        self._topic_args = topic_args or []
+        self._topic_kwargs = topic_kwargs or {}
+        self._done_cb = done_cb
+        self._done_kwargs = done_kwargs or {}
+        self._lock = threading.Lock()
+        self._results = [None] * len(subs)
+        self._remaining = len(subs)
+
+    def start(self):
+        if not self._subs:
+            self._finish()
+            return
+        # the event space's thread pool is drained with the event space so
+        # deliveries never outlive it
+        for ndx in range(len(self._subs)):
+            self._event_space.register_callback(
+                self._deliver_one, args=[ndx], in_thread=True)
+
+    def _deliver_one(self, ndx):
+        s = self._subs[ndx]
+        try:
+            rc = s(*self._topic_args, **self._topic_kwargs)
+        except BaseException as ex:
+            _g_logger.exception("The subscriber %s failed." % str(s))
+            result = SubscriberResult(s, None, ex)
+        else:
+            result = SubscriberResult(s, rc, None)
+        self._record(ndx, result)
+
+    def _record(self, ndx, result):
+        self._lock.acquire()
+        try:
+            self._results[ndx] = result
+            self._remaining -= 1
+            finished = self._remaining == 0
+        finally:
+            self._lock.release()
+        if finished:
+            self._finish()
+
+    def _finish(self):
+        if self._done_cb is None:
+            return
+        topic_error = None
+        for result in self._results:
+            if result.error is not None:
+                topic_error = result.error
+                break
+        kwargs = dict(self._done_kwargs)
+        kwargs['results'] = self._results
+        self._event_space.register_callback(
+            self._done_cb, args=[topic_error], kwargs=kwargs)
+
+
+class _TopicNode(object):
+    __slots__ = ["children", "subscribers"]
+
+    def __init__(self):
+        self.children = {}
+        # a tuple of (sequence, callback) that is replaced, never changed
+        self.subscribers = ()
+
+
 class PubSubEvent(object):
+    """
+    Topics are hierarchical strings such as "agent.job.complete".
+    Subscriptions may use wildcards: "agent.*.complete" matches any single
+    level in the middle and "agent.#" matches everything under agent.
+
+    Subscriptions are kept in a trie.  The list of subscribers that match a
+    published topic is computed once and cached as a tuple until the
+    subscriptions change, so publishing does not copy subscriber lists.
+    """
 
     def __init__(self, event_space):
+        """
+        :param event_space: The event space that delivers topics.  Topics
+        published with parallel=True are delivered on its thread pool.
+        """
         self._event_space = event_space
         self._done = False
-        self._subscribers = {}
+        self._root = _TopicNode()
+        self._sequence = itertools.count()
+        self._match_cache = {}
         self._lock = threading.RLock()
 
-    def publish(self,
-                topic,
-                topic_args=None,
-                topic_kwargs=None, done_cb=None, done_kwargs=None):
+    def _match(self, topic):
+        # This should only be called locked
+        matches = []
+        levels = topic.split(TOPIC_SEPARATOR)
+        nodes = [self._root]
+        for level in levels:
+            next_nodes = []
+            for node in nodes:
+                hash_node = node.children.get(MULTI_LEVEL_WILDCARD)
+                if hash_node is not None:
+                    matches.extend(hash_node.subscribers)
+                for key in (level, SINGLE_LEVEL_WILDCARD):
+                    child = node.children.get(key)
+                    if child is not None:
+                        next_nodes.append(child)
+            nodes = next_nodes
+            if not nodes:
+                break
+        for node in nodes:
+            matches.extend(node.subscribers)
+            # a trailing # also matches zero levels
+            hash_node = node.children.get(MULTI_LEVEL_WILDCARD)
+            if hash_node is not None:
+                matches.extend(hash_node.subscribers)
+        matches.sort(key=lambda m: m[0])
+        return tuple(cb for _, cb in matches)
+
+    def get_subscribers(self, topic):
+        """
+        :param topic: A published topic name.  It may not hold wildcards.
+        :return: A tuple of every callback subscribed to a matching topic in
+        the order they subscribed.
+        """
         self._lock.acquire()
         try:
-            try:
-                subs = self._subscribers[topic][:]
-            except KeyError:
-                subs = []  # set this to empty to trip the done_cb
+            subs = self._match_cache.get(topic)
+            if subs is None:
+                subs = self._match(topic)
+                if len(self._match_cache) >= MATCH_CACHE_SIZE:
+                    self._match_cache = {}
+                self._match_cache[topic] = subs
+            return subs
+        finally:
+            self._lock.release()
 
+    def publish(self,
+                topic,
+                topic_args=None,
+                topic_kwargs=None, done_cb=None, done_kwargs=None,
+                parallel=False):
+        """
+        Deliver a topic to all of its subscribers from the event space.
+        :param topic: The topic name.
+        :param topic_args: A list of arguments passed to every subscriber.
+        :param topic_kwargs: A dictionary of keyword arguments passed to
+        every subscriber.
+        :param done_cb: Called with the first error (or None) and
+        done_kwargs once all of the subscribers have been called.
+        :param done_kwargs: Keyword arguments for done_cb.
+        :param parallel: By default subscribers are called one after another
+        on the event loop and delivery stops at the first one that fails.
+        When True every subscriber is called at the same time from the
+        thread pool of the event space, a failure does not stop the others,
+        and done_cb also receives a results keyword argument with a
+        SubscriberResult per subscriber.
+        """
+        subs = self.get_subscribers(topic)
+        if parallel:
+            delivery = _ParallelDelivery(
+                self._event_space, subs, topic_args, topic_kwargs, done_cb,
+                done_kwargs)
+            delivery.start()
+        else:
             ka = {'topic_args': topic_args,
                   'topic_kwargs': topic_kwargs,
                   'subs': subs,
                   'done_cb': done_cb,
                   'done_kwargs': done_kwargs}
             self._event_space.register_callback(_deliver_topic, kwargs=ka)
-        finally:
-            self._lock.release()
 
     def subscribe(self, topic, cb):
+        """
+        :param topic: The topic name or a pattern with wildcards.
+        :param cb: The callback to call when a matching topic is published.
+        """
+        levels = topic.split(TOPIC_SEPARATOR)
+        if MULTI_LEVEL_WILDCARD in levels[:-1]:
+            raise exceptions.AgentRuntimeException(
+                "The %s wildcard can only be the last level of the topic "
+                "%s." % (MULTI_LEVEL_WILDCARD, topic))
         self._lock.acquire()
         try:
-            try:
-                subs = self._subscribers[topic]
-            except KeyError:
-                subs = []
-                self._subscribers[topic] = subs
-            subs.append(cb)
+            node = self._root
+            for level in levels:
+                child = node.children.get(level)
+                if child is None:
+                    child = _TopicNode()
+                    node.children[level] = child
+                node = child
+            node.subscribers = node.subscribers + ((next(self._sequence),
+                                                    cb),)
+            self._match_cache = {}
         finally:
             self._lock.release()
 
     def unsubscribe(self, topic, cb):
+        """
+        :param topic: The topic or pattern that cb was subscribed with.
+        :param cb: The callback to remove.  A KeyError is raised if it was
+        not subscribed to the topic.
+        """
         self._lock.acquire()
         try:
-            try:
-                subs = self._subscribers[topic]
-            except KeyError:
-                raise
-            subs.remove(cb)
-            if not subs:
-                del self._subscribers[topic]
+            path = [self._root]
+            for level in topic.split(TOPIC_SEPARATOR):
+                path.append(path[-1].children[level])
+            node = path[-1]
+            subs = list(node.subscribers)
+            for ndx, (_, s) in enumerate(subs):
+                if s == cb:
+                    del subs[ndx]
+                    break
+            else:
+                raise KeyError(topic)
+            node.subscribers = tuple(subs)
+
+            # prune the branches that no longer lead to any subscriptions
+            levels = topic.split(TOPIC_SEPARATOR)
+            for ndx in range(len(levels), 0, -1):
+                node = path[ndx]
+                if node.subscribers or node.children:
+                    break
+                del path[ndx - 1].children[levels[ndx - 1]]
+            self._match_cache = {}
         finally:
             self._lock.release()
@@ -13,6 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+import collections
 import logging
 import os
 import sys
@@ -23,19 +24,73 @@ import dcm.agent.exceptions as exceptions
 _g_logger = logging.getLogger(__name__)
 
 
-class StateMachine(object):
+# The number of (event, old state, new state) records each state machine
+# keeps.  Older records are dropped.
+DEFAULT_HISTORY_SIZE = 64
+
+
+class TransitionTable(object):
+    """
+    A state transition graph that is built once and shared by every state
+    machine of the same kind.  Handlers are given as method names and are
+    looked up on the owner of each state machine when an event occurs, so
+    building a new state machine does not copy the graph.
+    """
 
-    def __init__(self, start_state, logger=None):
+    def __init__(self):
         self._state_map = {}
+
+    def add_transition(self, state_event, event, new_state, func_name):
+        """
+        :param state_event: The state the machine must be in.
+        :param event: The event that causes the transition.
+        :param new_state: The state the machine moves to.
+        :param func_name: The name of the method on the owner that is called
+        for this transition, or None.
+        """
+        if state_event not in self._state_map:
+            self._state_map[state_event] = {}
+        self._state_map[state_event][event] = (new_state, func_name)
+
+    def get_state_map(self):
+        return self._state_map
+
+
+class StateMachine(object):
+
+    def __init__(self, start_state, logger=None, table=None, owner=None,
+                 history_size=DEFAULT_HISTORY_SIZE, observer=None):
+        """
+        :param start_state: The state the machine begins in.
+        :param logger: The logger to use, defaults to this module's logger.
+        :param table: A shared TransitionTable.  If this is not given
+        transitions are added to this machine with add_transition().
+        :param owner: The object whose methods are named in table.
+        :param history_size: The number of the most recent transitions that
+        get_event_list() reports.
+        :param observer: A callable that is given the new state every time
+        the machine moves to a different state.
+        """
+        if table is None:
+            self._state_map = {}
+        else:
+            self._state_map = table.get_state_map()
+        self._table = table
+        self._owner = owner
         self._current_state = start_state
         self._user_callbacks_list = []
-        self._event_list = []
+        self._observer = observer
+        self._event_list = collections.deque(maxlen=history_size)
         if logger is None:
             self._logger = _g_logger
         else:
             self._logger = logger
 
     def add_transition(self, state_event, event, new_state, func):
+        if self._table is not None:
+            raise exceptions.AgentRuntimeException(
+                "Transitions cannot be added to a state machine that uses a "
+                "shared transition table.")
         if state_event not in self._state_map:
             self._state_map[state_event] = {}
         self._state_map[state_event][event] = (new_state, func)
@@ -59,19 +114,27 @@ class StateMachine(object):
         try:
             old_state = self._current_state
             new_state, func = self._state_map[self._current_state][event]
-            # a logging adapter is added so that me can configure more of the
-            # log line in a conf file
-            log_msg = ("Event %(event)s occurred.  Moving from state "
-                       "%(old_state)s to %(new_state)s") % locals()
-            self._logger.debug(log_msg)
+            # transitions happen constantly so only build the debug messages
+            # when they will actually be written
+            debug = self._logger.isEnabledFor(logging.DEBUG)
+            if debug:
+                self._logger.debug(
+                    "Event %s occurred.  Moving from state %s to %s",
+                    event, old_state, new_state)
             self._event_list.append((event, old_state, new_state))
             try:
+                if self._table is not None and func is not None:
+                    func = getattr(self._owner, func)
                 if func is not None:
-                    self._logger.debug("Calling %s | %s" % (func.__name__,
-                                                            func.__doc__))
+                    if debug:
+                        self._logger.debug("Calling %s | %s",
+                                           func.__name__, func.__doc__)
                     func(**kwargs)
                 self._current_state = new_state
-                self._logger.debug("Moved to new state %s." % new_state)
+                if self._observer is not None and new_state != old_state:
+                    self._observer(new_state)
+                if debug:
+                    self._logger.debug("Moved to new state %s.", new_state)
             except exceptions.DoNotChangeStateException as dncse:
                 self._logger.warning("An error occurred that permits us "
                                      "to continue but skip the state "
@@ -84,4 +147,8 @@ class StateMachine(object):
                 event, self._current_state)
 
     def get_event_list(self):
-        return self._event_list
+        """
+        :return: A list of the most recent (event, old state, new state)
+        records, oldest first.
+        """
+        return list(self._event_list)
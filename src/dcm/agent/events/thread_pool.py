@@ -0,0 +1,152 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import collections
+import logging
+import threading
+
+
+_g_logger = logging.getLogger(__name__)
+
+
+class CallbackThreadPool(object):
+    """
+    A bounded pool of reusable threads for running blocking callbacks.
+
+    Threads are started on demand up to max_threads and exit after they have
+    been idle for idle_timeout seconds.  When every thread is busy work is
+    queued, and once max_queue items are waiting new submissions are
+    rejected.
+    """
+
+    def __init__(self, max_threads=8, max_queue=256, idle_timeout=30.0):
+        self._max_threads = max_threads
+        self._max_queue = max_queue
+        self._idle_timeout = idle_timeout
+        self._cond = threading.Condition()
+        self._queue = collections.deque()
+        self._threads = []
+        self._idle = 0
+        self._active = 0
+        self._rejected = 0
+        self._completed = 0
+        self._draining = False
+
+    def set_limits(self, max_threads=None, max_queue=None):
+        self._cond.acquire()
+        try:
+            if max_threads is not None:
+                self._max_threads = max(1, max_threads)
+            if max_queue is not None:
+                self._max_queue = max(0, max_queue)
+        finally:
+            self._cond.release()
+
+    def submit(self, func, *args):
+        """
+        :param func: The callable to run in a pool thread.
+        :param args: The arguments passed to func.
+        :return: A bool indicating if the work was accepted.  False means
+        that all of the threads were busy and the queue was full.
+        """
+        self._cond.acquire()
+        try:
+            waiting = len(self._queue) - self._idle
+            if waiting >= 0 and len(self._threads) < self._max_threads:
+                t = threading.Thread(target=self._worker)
+                t.daemon = True
+                self._threads.append(t)
+                # a new thread counts as idle until it picks up work
+                self._idle += 1
+                t.start()
+            elif waiting >= self._max_queue:
+                self._rejected += 1
+                return False
+            self._queue.append((func, args))
+            self._cond.notify()
+            return True
+        finally:
+            self._cond.release()
+
+    def _worker(self):
+        this_thread = threading.current_thread()
+        while True:
+            self._cond.acquire()
+            try:
+                while not self._queue and not self._draining:
+                    if not self._cond.wait(self._idle_timeout) and \
+                            not self._queue:
+                        break
+                self._idle -= 1
+                if not self._queue:
+                    self._threads.remove(this_thread)
+                    self._cond.notify_all()
+                    return
+                func, args = self._queue.popleft()
+                self._active += 1
+            finally:
+                self._cond.release()
+
+            try:
+                func(*args)
+            except BaseException:
+                _g_logger.exception("A pooled callback threw an exception.")
+            finally:
+                self._cond.acquire()
+                try:
+                    self._active -= 1
+                    self._completed += 1
+                    self._idle += 1
+                    self._cond.notify_all()
+                finally:
+                    self._cond.release()
+
+    def drain(self):
+        """
+        Wait for all queued and running work to finish and stop all of the
+        threads.  This must not be called from a pool thread.  The pool can
+        still be used afterwards, new submissions will start new threads.
+        """
+        self._cond.acquire()
+        try:
+            self._draining = True
+            self._cond.notify_all()
+            threads = self._threads[:]
+        finally:
+            self._cond.release()
+
+        for t in threads:
+            t.join()
+
+        self._cond.acquire()
+        try:
+            self._draining = False
+        finally:
+            self._cond.release()
+
+    def get_stats(self):
+        self._cond.acquire()
+        try:
+            return {
+                "threads": len(self._threads),
+                "active_threads": self._active,
+                "queue_length": len(self._queue),
+                "rejected": self._rejected,
+                "completed": self._completed,
+                "max_threads": self._max_threads,
+                "max_queue": self._max_queue
+            }
+        finally:
+            self._cond.release()
@@ -0,0 +1,172 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import collections
+import math
+
+
+class TimerWheel(object):
+    """
+    A hierarchical timing wheel.
+
+    Entries are hashed into slots by the tick at which they expire.  The
+    lowest level holds everything that will expire within one rotation of
+    the wheel, each higher level covers a rotation of the level below it.
+    When a lower level wraps around the matching slot of the level above is
+    cascaded down.  Adding and removing an entry are O(1) operations no
+    matter how many entries are pending.
+
+    Times are given in seconds on the same clock as the caller uses (the
+    event space uses time.monotonic()).  This object is not thread safe, the
+    owner must serialize access to it.
+    """
+
+    def __init__(self, now, resolution=0.01, slot_bits=8, levels=4):
+        """
+        :param now: The current time.  The wheel starts ticking from here.
+        :param resolution: The number of seconds in a single tick.
+        :param slot_bits: Each level has 2^slot_bits slots.
+        :param levels: The number of levels in the wheel.  Entries further
+        out than the wheel can represent are parked in the top level and
+        re-placed every time it rotates.
+        """
+        self._resolution = resolution
+        self._bits = slot_bits
+        self._slots = 1 << slot_bits
+        self._mask = self._slots - 1
+        self._levels = [[None] * self._slots for _ in range(levels)]
+        self._locations = {}
+        self._current_tick = self._floor_tick(now)
+
+    def __len__(self):
+        return len(self._locations)
+
+    def __contains__(self, entry):
+        return entry in self._locations
+
+    def _floor_tick(self, tm):
+        return int(math.floor(tm / self._resolution))
+
+    def _ceil_tick(self, tm):
+        return int(math.ceil(tm / self._resolution))
+
+    def _place(self, entry, tick):
+        delta = tick - self._current_tick
+        level = 0
+        top = len(self._levels) - 1
+        while level < top and delta >= (1 << (self._bits * (level + 1))):
+            level += 1
+        ndx = (tick >> (self._bits * level)) & self._mask
+        slot = self._levels[level][ndx]
+        if slot is None:
+            slot = collections.OrderedDict()
+            self._levels[level][ndx] = slot
+        slot[entry] = tick
+        self._locations[entry] = slot
+
+    def add(self, entry, deadline):
+        """
+        Add an entry which will expire at the given time.  The entry will
+        never be returned by advance() before the deadline has passed.
+        :param entry: Any hashable object.  It may only be in the wheel once.
+        :param deadline: The time at which the entry expires.
+        """
+        tick = max(self._ceil_tick(deadline), self._current_tick + 1)
+        self._place(entry, tick)
+
+    def remove(self, entry):
+        """
+        :param entry: The entry to remove.
+        :return: A bool indicating if the entry was found in the wheel.
+        """
+        slot = self._locations.pop(entry, None)
+        if slot is None:
+            return False
+        del slot[entry]
+        return True
+
+    def _cascade(self, level, ndx):
+        slot = self._levels[level][ndx]
+        if not slot:
+            return
+        self._levels[level][ndx] = None
+        for entry, tick in slot.items():
+            self._place(entry, tick)
+
+    def advance(self, now):
+        """
+        Move the wheel forward to the given time.
+        :param now: The current time.
+        :return: A list of the entries that expired, in expiration order.
+        """
+        target = self._floor_tick(now)
+        expired = []
+        while self._current_tick < target:
+            if not self._locations:
+                self._current_tick = target
+                break
+            self._current_tick += 1
+            tick = self._current_tick
+
+            level = 1
+            while (level < len(self._levels) and
+                    tick & ((1 << (self._bits * level)) - 1) == 0):
+                self._cascade(level, (tick >> (self._bits * level)) &
+                              self._mask)
+                level += 1
+
+            ndx = tick & self._mask
+            slot = self._levels[0][ndx]
+            if slot:
+                self._levels[0][ndx] = None
+                for entry in slot:
+                    del self._locations[entry]
+                    expired.append(entry)
+        return expired
+
+    def next_expiry(self):
+        """
+        :return: The earliest time at which advance() may have work to do,
+        or None if the wheel is empty.  The entry may expire later than
+        this if it is still sitting in a higher level.
+        """
+        if not self._locations:
+            return None
+        best = None
+        for level, wheel in enumerate(self._levels):
+            shift = self._bits * level
+            base = self._current_tick >> shift
+            for i in range(1, self._slots + 1):
+                tick = (base + i) << shift
+                if best is not None and tick >= best:
+                    break
+                if wheel[(base + i) & self._mask]:
+                    best = tick
+                    break
+        if best is None:
+            # everything is parked beyond the range of the top level
+            best = self._current_tick + (1 << (self._bits *
+                                               len(self._levels)))
+        return best * self._resolution
+
+    def clear(self):
+        """
+        Remove everything from the wheel.
+        :return: A list of all the entries that were in the wheel.
+        """
+        entries = list(self._locations.keys())
+        self._locations = {}
+        self._levels = [[None] * self._slots for _ in self._levels]
+        return entries
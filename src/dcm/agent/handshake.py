@@ -25,6 +25,10 @@ import dcm.agent.plugins.loader as plugin_loader
 
 _g_logger = logging.getLogger(__name__)
 
+# The compression offered in the handshake features.  Once the manager
+# accepts it large frames are sent zlib compressed as binary websocket frames.
+COMPRESSION_ZLIB = "zlib"
+
 
 def get_plugin_handshake_descriptor(conf):
     items = plugin_loader.get_all_plugins(conf)
@@ -46,7 +50,9 @@ class HandshakeIncomingReply:
                  agent_id=None, cloud_id=None, customer_id=None,
                  region_id=None, zone_id=None, server_id=None,
                  server_name=None, mount_point=None, pk=None,
-                 dcm_version=None, cloud_delegate=None):
+                 dcm_version=None, cloud_delegate=None,
+                 message_batching=None, message_compression=None,
+                 last_sequence=None):
         self.reply_type = reply_type
         self.force_backoff = force_backoff
         self.agent_id = agent_id
@@ -60,6 +66,14 @@ class HandshakeIncomingReply:
         self.pk = pk
         self.dcm_version = dcm_version
         self.cloud_delegate = cloud_delegate
+        # the largest batch frame the manager accepts, True if it accepts
+        # any size the agent offered or None if it does not batch
+        self.message_batching = message_batching
+        # the compression the manager accepted or None
+        self.message_compression = message_compression
+        # the last outbox sequence the manager received or None if it does
+        # not resume sessions
+        self.last_sequence = last_sequence
 
 
 class HandshakeManager(object):
@@ -133,7 +147,10 @@ class HandshakeManager(object):
                 region_id=payload.get('regionId'),
                 zone_id=payload.get('zoneId'),
                 server_id=payload.get('serverId'),
-                server_name=payload.get('serverName'))
+                server_name=payload.get('serverName'),
+                message_batching=payload.get('messageBatching'),
+                message_compression=payload.get('messageCompression'),
+                last_sequence=payload.get('lastSequence'))
         elif incoming_doc['return_code'] ==\
                 HandshakeIncomingReply.REPLY_CODE_BAD_TOKEN:
             # This signals that we used a bad token but have the chance to
@@ -172,6 +189,13 @@ class HandshakeManager(object):
             features.update(p_feature)
 
         features['plugins'] = get_plugin_handshake_descriptor(self.conf)
+        if self.conf.connection_batch_max_bytes > 0:
+            # tell the manager the agent can pack messages into BATCH
+            # frames of up to this many bytes
+            features['message_batching'] = \
+                self.conf.connection_batch_max_bytes
+        if self.conf.connection_compression_level > 0:
+            features['message_compression'] = COMPRESSION_ZLIB
         meta_data_object = self.conf.meta_data_object
         ipv4s = meta_data_object.get_handshake_ip_address()
         ipv6s = []
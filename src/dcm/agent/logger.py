@@ -24,6 +24,7 @@ import urllib.request
 import pwd
 import grp
 
+import dcm.agent.events.callback as events
 from dcm.agent.events.globals import global_space as dcm_events
 
 
@@ -48,28 +49,51 @@ class dcmLogger(logging.Handler):
         self._conn = None
         self._conf = None
         self._unsent_msgs = []
+        # records waiting for the next flush callback.  A burst of log
+        # records results in a single pending callback.
+        self._buffered_msgs = []
 
     def emit(self, record):
         msg = self.format(record)
         if self._conn is None:
             self._unsent_msgs.append(msg)
         else:
-            dcm_events.register_callback(
-                send_log_to_dcm_callback, kwargs={"conn": self._conn,
-                                                  "token": "",
-                                                  "message": msg,
-                                                  "level": record.levelname})
+            self._buffered_msgs.append((msg, record.levelname, ""))
+            dcm_events.register_coalesced(
+                self._flush_to_dcm, self._flush_to_dcm,
+                priority=events.Priority.LOW)
+
+    def _flush_to_dcm(self):
+        self.acquire()
+        try:
+            msgs = self._buffered_msgs
+            self._buffered_msgs = []
+            conn = self._conn
+        finally:
+            self.release()
+        if conn is None:
+            return
+        for msg, level, token in msgs:
+            send_log_to_dcm_callback(
+                conn=conn, token=token, message=msg, level=level)
 
     def set_conn(self, conf, conn):
         self._conn = conn
         self._conf = conf
         if conn is None:
             return
-        for msg in self._unsent_msgs:
-            dcm_events.register_callback(
-                send_log_to_dcm_callback, kwargs={"conn": self._conn,
-                                                  "message": msg})
+        if not self._unsent_msgs:
+            return
+        self.acquire()
+        try:
+            for msg in self._unsent_msgs:
+                self._buffered_msgs.append((msg, None, None))
             self._unsent_msgs = []
+        finally:
+            self.release()
+        dcm_events.register_coalesced(
+            self._flush_to_dcm, self._flush_to_dcm,
+            priority=events.Priority.LOW)
 
 
 def set_dcm_connection(conf, conn):
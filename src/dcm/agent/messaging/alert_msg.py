@@ -18,6 +18,7 @@ import logging
 import threading
 
 import dcm.agent.utils as utils
+import dcm.agent.events.callback as events
 import dcm.agent.events.state_machine as state_machine
 
 from dcm.agent.events.globals import global_space as dcm_events
@@ -44,8 +45,8 @@ class AlertAckMsg(object):
     def __init__(self, doc, conn, timeout=5.0):
         self._timeout = timeout
         self.doc = doc
-        self._sm = state_machine.StateMachine(States.NEW)
-        self.setup_states()
+        self._sm = state_machine.StateMachine(
+            States.NEW, table=self._transitions, owner=self)
         self._timer = None
         self._lock = threading.RLock()
         self._conn = conn
@@ -83,7 +84,7 @@ class AlertAckMsg(object):
 
     def _send_timeout(self):
         self._timer = dcm_events.register_callback(
-            self.timeout, delay=self._timeout)
+            self.timeout, delay=self._timeout, priority=events.Priority.LOW)
         _g_logger.debug("Sending the alert message " + str(self.doc))
         self._conn.send(self.doc)
 
@@ -104,38 +105,40 @@ class AlertAckMsg(object):
         dcm_events.cancel_callback(self._timer)
         self._timer = None
 
-    def setup_states(self):
-        self._sm.add_transition(States.NEW,
+    # The protocol graph is built once for the class.  Handlers are named
+    # by method and looked up on each instance when an event occurs.
+    _transitions = state_machine.TransitionTable()
+    _transitions.add_transition(States.NEW,
                                 Events.SEND,
                                 States.WAITING_FOR_ACK,
-                                self._sm_send_message)
-        self._sm.add_transition(States.NEW,
+                                "_sm_send_message")
+    _transitions.add_transition(States.NEW,
                                 Events.STOP,
                                 States.COMPLETE,
                                 None)
 
-        self._sm.add_transition(States.WAITING_FOR_ACK,
+    _transitions.add_transition(States.WAITING_FOR_ACK,
                                 Events.TIMEOUT,
                                 States.WAITING_FOR_ACK,
-                                self._sm_resend_message)
-        self._sm.add_transition(States.WAITING_FOR_ACK,
+                                "_sm_resend_message")
+    _transitions.add_transition(States.WAITING_FOR_ACK,
                                 Events.ACK_RECEIVED,
                                 States.COMPLETE,
-                                self._sm_ack_received)
-        self._sm.add_transition(States.WAITING_FOR_ACK,
+                                "_sm_ack_received")
+    _transitions.add_transition(States.WAITING_FOR_ACK,
                                 Events.STOP,
                                 States.COMPLETE,
-                                self._sm_stopping_early)
+                                "_sm_stopping_early")
 
-        self._sm.add_transition(States.COMPLETE,
+    _transitions.add_transition(States.COMPLETE,
                                 Events.ACK_RECEIVED,
                                 States.COMPLETE,
                                 None)
-        self._sm.add_transition(States.COMPLETE,
+    _transitions.add_transition(States.COMPLETE,
                                 Events.TIMEOUT,
                                 States.COMPLETE,
                                 None)
-        self._sm.add_transition(States.COMPLETE,
+    _transitions.add_transition(States.COMPLETE,
                                 Events.STOP,
                                 States.COMPLETE,
                                 None)
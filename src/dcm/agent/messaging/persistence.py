@@ -13,13 +13,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+import collections
 import datetime
-import json
 import logging
 import os
 import sqlite3
 import threading
+import time
 
+import dcm.agent.codec as codec
 import dcm.agent.exceptions as exceptions
 import dcm.agent.messaging.states as messaging_states
 import dcm.agent.utils as agent_utils
@@ -59,16 +61,135 @@ create table if not exists alerts (
     subject           text,
     PRIMARY KEY (alert_hash)
 );
+
+create table if not exists outbox (
+    sequence          integer primary key not null,
+    creation_time     date,
+    doc               text
+);
+
+create table if not exists outbox_state (
+    name              string primary key not null,
+    value             integer
+);
 """
 
 
+def _get_command(request_doc):
+    try:
+        return request_doc['payload']['command']
+    except (KeyError, TypeError):
+        return None
+
+
+# The number of request documents read into memory at a time while the
+# command column is filled in.
+_g_migrate_chunk_size = 500
+
+
+def _migrate_add_command(conn):
+    # the command is copied out of the request document so that status
+    # queries do not have to load and parse every document.  The rows are
+    # walked in rowid order a chunk at a time so that a large database is
+    # never read into memory at once.
+    conn.execute("ALTER TABLE requests ADD COLUMN command string")
+    last_rowid = 0
+    while True:
+        rows = conn.execute(
+            "SELECT rowid, request_doc FROM requests WHERE rowid > ? "
+            "ORDER BY rowid LIMIT ?",
+            (last_rowid, _g_migrate_chunk_size)).fetchall()
+        if not rows:
+            break
+        last_rowid = rows[-1][0]
+        updates = []
+        for rowid, request_doc in rows:
+            try:
+                command = _get_command(codec.loads(request_doc))
+            except Exception:
+                command = None
+            if command is not None:
+                updates.append((command, rowid))
+        conn.executemany("UPDATE requests SET command=? WHERE rowid=?",
+                         updates)
+    conn.execute("CREATE INDEX IF NOT EXISTS requests_command_idx "
+                 "ON requests (command, state)")
+
+
+# Every entry moves the schema up one version.  The version of a database is
+# kept in PRAGMA user_version which counts the migrations applied to it.  The
+# first one is the original DDL which is safe to run on the databases that
+# were created before the schema was versioned.  An entry is either a SQL
+# script or a function which is passed the connection.
+_g_schema_migrations = [
+    _g_sqllite_ddl,
+    """
+create index if not exists requests_state_idx on requests (state);
+create index if not exists requests_update_time_idx
+    on requests (last_update_time);
+create index if not exists alerts_time_idx on alerts (alert_time);
+""",
+    _migrate_add_command,
+]
+
+
+def _get_column_order():
+    return ["request_id", "creation_time", "request_doc",
+            "reply_doc", "state", "agent_id", "last_update_time", "command"]
+
+
+# The statements are kept constant so that the sqlite3 statement cache only
+# ever prepares each of them once per connection.
+_g_select_requests = ("SELECT " + ", ".join(_get_column_order()) +
+                      " FROM requests")
+_g_select_by_state = _g_select_requests + " WHERE state=?"
+_g_select_by_request_id = _g_select_requests + " WHERE request_id=?"
+_g_insert_request = ("INSERT INTO requests(request_id, creation_time, "
+                     "request_doc, reply_doc, state, agent_id, "
+                     "last_update_time, command) "
+                     "VALUES(?, ?, ?, ?, ?, ?, ?, ?)")
+_g_update_request = ("UPDATE requests SET state=?, reply_doc=?, "
+                     "last_update_time=? WHERE request_id=?")
+_g_update_state = "UPDATE requests SET state=?, reply_doc=? WHERE state=?"
+_g_delete_expired = "DELETE FROM requests WHERE last_update_time < ?"
+_g_delete_expired_chunk = (
+    "DELETE FROM requests WHERE request_id IN (SELECT request_id "
+    "FROM requests WHERE last_update_time < ? ORDER BY last_update_time "
+    "LIMIT ?)")
+_g_delete_oldest_chunk = (
+    "DELETE FROM requests WHERE request_id IN (SELECT request_id "
+    "FROM requests WHERE state IN (?, ?, ?) ORDER BY last_update_time "
+    "LIMIT ?)")
+_g_count_requests = "SELECT count(*) FROM requests"
+_g_count_by_state = "SELECT state, count(*) FROM requests GROUP BY state"
+_g_select_command_states = ("SELECT DISTINCT state FROM requests "
+                            "WHERE command=?")
+
+_g_statement_cache_size = 64
+
+
+class Durability(object):
+    """
+    How the record of a request is kept.  A command picks one with the
+    durability entry of its section in plugin.conf.
+    """
+    # committed to the DB before the request is acked
+    STRICT = "strict"
+    # written to the DB and committed with the next group commit
+    RELAXED = "relaxed"
+    # only kept in memory.  Safe for commands that can be run again.
+    EPHEMERAL = "ephemeral"
+
+    ALL = [STRICT, RELAXED, EPHEMERAL]
+
+
 def fail_started_state(db_record):
     db_record.state = messaging_states.ReplyStates.REPLY
     r = {
         'Exception': "The job was executed but the state of the execution "
                      "was lost.",
         'return_code': 1}
-    db_record.reply_doc = json.dumps(r)
+    db_record.reply_doc = codec.dumps(r)
     db_record.last_update_time = datetime.datetime.now()
 
 
@@ -84,6 +205,62 @@ class RequestDBObject(object):
         self.agent_id = agent_id
 
 
+class MemoryRecordStore(object):
+    """
+    Keeps the records of ephemeral requests in memory.  It has the request
+    record methods of SQLiteAgentDB so that a ReplyRPC can use either.  Only
+    the most recent max_records are remembered, a retransmission of a
+    request that has been forgotten is handled as a new request.
+    """
+
+    def __init__(self, max_records=1024):
+        self._lock = threading.RLock()
+        self._records = collections.OrderedDict()
+        self._max_records = max_records
+
+    def lock(self):
+        self._lock.acquire()
+
+    def unlock(self):
+        self._lock.release()
+
+    @agent_utils.class_method_sync
+    def new_record(self, request_id, request_doc, reply_doc, state,
+                   agent_id):
+        if request_id != request_doc['request_id']:
+            raise exceptions.PersistenceException("The request_id must match "
+                                                  "the request_doc")
+        if request_id in self._records:
+            raise exceptions.PersistenceException(
+                "The request %s already has a record" % request_id)
+        self._records[request_id] = RequestDBObject(
+            request_id, request_doc, agent_id, state, reply_doc=reply_doc)
+        while len(self._records) > self._max_records:
+            self._records.popitem(last=False)
+
+    @agent_utils.class_method_sync
+    def update_record(self, request_id, state, reply_doc=None):
+        record = self._records.get(request_id)
+        if record is None:
+            raise exceptions.PersistenceException(
+                "There is no record of the request %s" % request_id)
+        record.state = state
+        record.reply_doc = reply_doc
+        record.last_update_time = datetime.datetime.now()
+        self._records.move_to_end(request_id)
+
+    @agent_utils.class_method_sync
+    def lookup_req(self, request_id):
+        return self._records.get(request_id)
+
+    def flush(self):
+        pass
+
+    @agent_utils.class_method_sync
+    def get_record_count(self):
+        return len(self._records)
+
+
 class RequestObject(object):
 
     # this is the disconnected object
@@ -96,11 +273,6 @@ class RequestObject(object):
         self.agent_id = connected_obj.agent_id
 
 
-def _get_column_order():
-    return ["request_id", "creation_time", "request_doc",
-            "reply_doc", "state", "agent_id", "last_update_time"]
-
-
 class SQLiteRequestObject(object):
 
     # this is the disconnected object
@@ -117,15 +289,44 @@ class SQLiteRequestObject(object):
 class SQLiteAgentDB(object):
     _lock = threading.RLock()
 
-    def __init__(self, db_file):
+    def __init__(self, db_file, journal_mode=None, synchronous=None,
+                 migrate=True):
+        """
+        :param db_file: The path to the database file.
+        :param journal_mode: The sqlite journal_mode of the database.  WAL
+        lets readers work while a commit is going on and only has to sync
+        the log when committing.  The journal mode is kept in the database
+        file so when this is None whatever it already uses is left alone.
+        :param synchronous: The sqlite synchronous level.  FULL syncs every
+        commit so that a committed request survives a power loss.  NORMAL
+        in WAL mode only survives a crash of the agent.  None keeps the
+        sqlite default.
+        :param migrate: Bring the schema up to date.  Tools that only look
+        at the database of a running agent open it without migrating so
+        that they never change it, see needs_migration().
+        """
         self._db_file = db_file
+        self._conversion_logged = False
 
         try:
             self._db_conn = sqlite3.connect(
-                self._db_file, check_same_thread=False)
+                self._db_file, check_same_thread=False,
+                cached_statements=_g_statement_cache_size)
             try:
-                self._db_conn.executescript(_g_sqllite_ddl)
-                self._db_conn.commit()
+                if migrate:
+                    # this can only be set on a new database, older ones
+                    # are moved over by convert_auto_vacuum()
+                    page_count = self._db_conn.execute(
+                        "PRAGMA page_count").fetchone()[0]
+                    if page_count == 0:
+                        self._db_conn.execute(
+                            "PRAGMA auto_vacuum=INCREMENTAL")
+                if journal_mode is not None:
+                    self._set_journal_mode(journal_mode)
+                if synchronous is not None:
+                    self._db_conn.execute("PRAGMA synchronous=" + synchronous)
+                if migrate:
+                    self._migrate()
             except Exception as ex:
                 _g_logger.exception(
                     "Could not open " + db_file + " " + str(ex))
@@ -135,6 +336,56 @@ class SQLiteAgentDB(object):
             _g_logger.exception(
                 "Could not connect to the DB " + db_file + " " + str(ex))
             raise
+        self._commit_writer = None
+        # the number of deferred writes in the open group commit batch
+        self._deferred_count = 0
+        self._commit_stats = {"commits": 0,
+                              "deferred_writes": 0,
+                              "largest_batch": 0}
+
+    def _set_journal_mode(self, journal_mode):
+        row = self._db_conn.execute(
+            "PRAGMA journal_mode=" + journal_mode).fetchone()
+        if row[0].lower() != journal_mode.lower():
+            # in memory databases can only use the memory journal
+            _g_logger.info("The DB " + self._db_file + " is using the " +
+                           row[0] + " journal mode")
+
+    def _migrate(self):
+        version = self._db_conn.execute("PRAGMA user_version").fetchone()[0]
+        if version > len(_g_schema_migrations):
+            _g_logger.warning(
+                "The DB %s has schema version %d which is newer than this "
+                "agent knows about (%d)" % (self._db_file, version,
+                                            len(_g_schema_migrations)))
+            return
+        for i in range(version, len(_g_schema_migrations)):
+            _g_logger.info("Migrating the DB %s to schema version %d"
+                           % (self._db_file, i + 1))
+            migration = _g_schema_migrations[i]
+            if not callable(migration):
+                self._db_conn.executescript(
+                    "BEGIN;" + migration +
+                    "PRAGMA user_version=%d; COMMIT;" % (i + 1))
+                continue
+            self._db_conn.execute("BEGIN")
+            try:
+                migration(self._db_conn)
+                self._db_conn.execute("PRAGMA user_version=%d" % (i + 1))
+                self._db_conn.commit()
+            except Exception:
+                self._db_conn.rollback()
+                raise
+
+    def get_schema_version(self):
+        return self._db_conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def needs_migration(self):
+        """
+        :return: A bool indicating if the schema is older than the one this
+        agent uses.  Only a database opened with migrate=False can be.
+        """
+        return self.get_schema_version() < len(_g_schema_migrations)
 
     def lock(self):
         self._lock.acquire()
@@ -150,17 +401,45 @@ class SQLiteAgentDB(object):
             msg = "DB: " + self._db_file + " does not exist."
         _g_logger.warn(msg)
 
-    def _execute(self, func):
+    def _commit(self):
+        # This should only be called locked
+        self._db_conn.commit()
+        self._commit_stats["commits"] += 1
+        if self._deferred_count:
+            self._commit_stats["largest_batch"] = max(
+                self._commit_stats["largest_batch"], self._deferred_count)
+            self._deferred_count = 0
+
+    def _execute(self, func, defer=False):
+        """
+        Run func with a cursor and commit the result.  When defer is set and
+        group commit is running the change is left in the open batch for the
+        commit writer.  While a batch is open every statement runs inside a
+        savepoint so that a failure only rolls back its own changes.
+        """
         try:
             cursor = self._db_conn.cursor()
+            batch_open = self._deferred_count > 0
             try:
+                if batch_open:
+                    cursor.execute("SAVEPOINT agent_op")
                 rc = func(cursor)
-                self._db_conn.commit()
+                if batch_open:
+                    cursor.execute("RELEASE SAVEPOINT agent_op")
+                if defer and self._commit_writer is not None:
+                    self._deferred_count += 1
+                    self._commit_stats["deferred_writes"] += 1
+                else:
+                    self._commit()
                 return rc
             except Exception as ex:
                 _g_logger.exception(
                     "Could not access " + self._db_file + " " + str(ex))
-                self._db_conn.rollback()
+                if batch_open:
+                    cursor.execute("ROLLBACK TO SAVEPOINT agent_op")
+                    cursor.execute("RELEASE SAVEPOINT agent_op")
+                else:
+                    self._db_conn.rollback()
                 raise
             finally:
                 cursor.close()
@@ -170,18 +449,94 @@ class SQLiteAgentDB(object):
             self._log_db_info()
             raise
 
+    def _query(self, func):
+        """
+        Run a read only func with a cursor.  Nothing is committed so an open
+        group commit batch is left alone, its changes are still visible.
+        """
+        try:
+            cursor = self._db_conn.cursor()
+            try:
+                return func(cursor)
+            finally:
+                cursor.close()
+        except Exception as ex:
+            _g_logger.exception(
+                "Failed to read the DB " + self._db_file + " " + str(ex))
+            self._log_db_info()
+            raise
+
+    @agent_utils.class_method_sync
+    def start_group_commit(self, interval):
+        """
+        Stop committing record changes one at a time.  new_record and
+        update_record leave their changes in a batch which a writer thread
+        commits every interval seconds.  The changes are visible to every
+        reader right away, flush() must be called before anything is sent
+        which relies on them surviving a crash.
+        """
+        if self._commit_writer is not None:
+            return
+        self._commit_writer = GroupCommitWriter(self, interval)
+        self._commit_writer.start()
+
+    def stop_group_commit(self):
+        self.lock()
+        try:
+            writer = self._commit_writer
+        finally:
+            self.unlock()
+        if writer is None:
+            return
+        writer.done()
+        writer.join()
+        self.lock()
+        try:
+            self._commit_writer = None
+            self.flush()
+        finally:
+            self.unlock()
+
+    def close(self):
+        self.stop_group_commit()
+        self.lock()
+        try:
+            self._db_conn.close()
+        finally:
+            self.unlock()
+
+    @agent_utils.class_method_sync
+    def flush(self):
+        """
+        Commit the open group commit batch.  When this returns every change
+        made so far is durable.
+        """
+        if not self._deferred_count:
+            return
+        try:
+            self._commit()
+        except Exception as ex:
+            _g_logger.exception(
+                "Failed to commit to the DB " + self._db_file + " " + str(ex))
+            self._log_db_info()
+            raise
+
+    @agent_utils.class_method_sync
+    def get_commit_stats(self):
+        stats = self._commit_stats.copy()
+        stats["pending_writes"] = self._deferred_count
+        return stats
+
     @agent_utils.class_method_sync
     def starting_agent(self):
         r = {
             'Exception':
             "The job was executed but the state of the execution was lost.",
             'return_code': 1}
-        reply_doc = json.dumps(r)
-
-        stmt = ("UPDATE requests SET state=?, reply_doc=? WHERE state=?")
+        reply_doc = codec.dumps(r)
 
         def do_it(cursor):
-            cursor.execute(stmt,
+            cursor.execute(_g_update_state,
                            (messaging_states.ReplyStates.REPLY,
                             reply_doc,
                             messaging_states.ReplyStates.ACKED))
@@ -196,16 +551,13 @@ class SQLiteAgentDB(object):
         self._execute(do_it)
 
     def _get_all_state(self, state):
-        stmt = ("SELECT " + ", ".join(_get_column_order()) +
-                " FROM requests WHERE state=\"" + state + '"')
-
         def do_it(cursor):
-            cursor.execute(stmt)
+            cursor.execute(_g_select_by_state, (state,))
             rows = cursor.fetchall()
             if not rows:
                 return []
             return [SQLiteRequestObject(i) for i in rows]
-        return self._execute(do_it)
+        return self._query(do_it)
 
     @agent_utils.class_method_sync
     def get_all_complete(self):
@@ -228,69 +580,191 @@ class SQLiteAgentDB(object):
         return self._get_all_state(messaging_states.ReplyStates.REPLY)
 
     @agent_utils.class_method_sync
-    def lookup_req(self, request_id):
-        stmt = ("SELECT " + ", ".join(_get_column_order()) + " FROM "
-                'requests where request_id=?')
+    def count_by_state(self):
+        """
+        :return: A dict of every request state in the DB to the number of
+        requests in that state.
+        """
+        def do_it(cursor):
+            cursor.execute(_g_count_by_state)
+            return dict(cursor.fetchall())
+        return self._query(do_it)
 
+    @agent_utils.class_method_sync
+    def get_command_states(self, command):
+        """
+        :return: A list of the distinct states of the requests for the
+        given command.
+        """
+        def do_it(cursor):
+            cursor.execute(_g_select_command_states, (command,))
+            return [row[0] for row in cursor.fetchall()]
+        return self._query(do_it)
+
+    @agent_utils.class_method_sync
+    def lookup_req(self, request_id):
         def do_it(cursor):
-            cursor.execute(stmt, [request_id])
+            cursor.execute(_g_select_by_request_id, (request_id,))
             row = cursor.fetchone()
             if not row:
                 return
             return SQLiteRequestObject(row)
-        return self._execute(do_it)
+        return self._query(do_it)
 
     @agent_utils.class_method_sync
     def new_record(self, request_id, request_doc, reply_doc, state,
                    agent_id):
-        stmt = ("INSERT INTO requests(request_id, creation_time, request_doc, "
-                "reply_doc, state, agent_id, last_update_time) "
-                "VALUES(?, ?, ?, ?, ?, ?, ?)")
-
         if request_id != request_doc['request_id']:
             raise exceptions.PersistenceException("The request_id must match "
                                                   "the request_doc")
 
+        command = _get_command(request_doc)
         if request_doc is not None:
-            request_doc = json.dumps(request_doc)
+            request_doc = codec.dumps(request_doc)
         if reply_doc is not None:
-            reply_doc = json.dumps(reply_doc)
+            reply_doc = codec.dumps(reply_doc)
 
         def do_it(cursor):
             nw = datetime.datetime.now()
             parms = (request_id, nw, request_doc,
-                     reply_doc, state, agent_id, nw)
-            cursor.execute(stmt, parms)
-        self._execute(do_it)
+                     reply_doc, state, agent_id, nw, command)
+            cursor.execute(_g_insert_request, parms)
+        self._execute(do_it, defer=True)
 
     @agent_utils.class_method_sync
     def update_record(self, request_id, state, reply_doc=None):
-        stmt = ("UPDATE requests SET state=?, reply_doc=?, last_update_time=? "
-                "WHERE request_id=?")
         try:
             if reply_doc is not None:
-                reply_doc = json.dumps(reply_doc)
+                reply_doc = codec.dumps(reply_doc)
 
             def do_it(cursor):
                 nw = datetime.datetime.now()
-                cursor.execute(stmt, (state, reply_doc, nw, request_id))
+                cursor.execute(_g_update_request,
+                               (state, reply_doc, nw, request_id))
                 if cursor.rowcount != 1:
                     raise exceptions.PersistenceException(
                         "%d rows were updated when exactly 1 should have "
                         "been" % cursor.rowcount)
-            self._execute(do_it)
+            self._execute(do_it, defer=True)
         except Exception as ex:
             raise exceptions.PersistenceException(ex)
 
     @agent_utils.class_method_sync
     def clean_all_expired(self, cut_off_time):
-        stmt = ("DELETE FROM requests WHERE request_id in (SELECT request_id "
-                "FROM requests WHERE last_update_time < ?)")
-
         def do_it(cursor):
-            cursor.execute(stmt, (cut_off_time,))
+            cursor.execute(_g_delete_expired, (cut_off_time,))
         self._execute(do_it)
 
+    @agent_utils.class_method_sync
+    def clean_expired_chunk(self, cut_off_time, limit):
+        """
+        Delete at most limit of the requests that were last updated before
+        cut_off_time, oldest first.
+        :return: The number of requests deleted.
+        """
+        def do_it(cursor):
+            cursor.execute(_g_delete_expired_chunk, (cut_off_time, limit))
+            return cursor.rowcount
+        return self._execute(do_it)
+
+    @agent_utils.class_method_sync
+    def clean_oldest_chunk(self, limit):
+        """
+        Delete at most limit of the oldest finished requests.  Requests
+        which are still being worked on are left alone.
+        :return: The number of requests deleted.
+        """
+        def do_it(cursor):
+            cursor.execute(_g_delete_oldest_chunk,
+                           (messaging_states.ReplyStates.REPLY_ACKED,
+                            messaging_states.ReplyStates.REPLY_NACKED,
+                            messaging_states.ReplyStates.NACKED,
+                            limit))
+            return cursor.rowcount
+        return self._execute(do_it)
+
+    @agent_utils.class_method_sync
+    def get_request_count(self):
+        def do_it(cursor):
+            cursor.execute(_g_count_requests)
+            return cursor.fetchone()[0]
+        return self._query(do_it)
+
+    @agent_utils.class_method_sync
+    def get_size_info(self):
+        """
+        :return: A dict with the number of bytes held by live pages in
+        used_size, the number of free pages and the size of the database
+        file on disk (0 for a database in memory).
+        """
+        def do_it(cursor):
+            page_size = cursor.execute("PRAGMA page_size").fetchone()[0]
+            page_count = cursor.execute("PRAGMA page_count").fetchone()[0]
+            free_pages = cursor.execute(
+                "PRAGMA freelist_count").fetchone()[0]
+            return page_size, page_count, free_pages
+        page_size, page_count, free_pages = self._query(do_it)
+        file_size = 0
+        for f in [self._db_file, self._db_file + "-wal"]:
+            if os.path.exists(f):
+                file_size += os.stat(f).st_size
+        return {"used_size": (page_count - free_pages) * page_size,
+                "free_pages": free_pages,
+                "file_size": file_size}
+
+    @agent_utils.class_method_sync
+    def reclaim_space(self, max_pages):
+        """
+        Give at most max_pages free pages back to the file system.  This
+        only works once incremental auto_vacuum is on, a database that was
+        made before that has to be switched over by convert_auto_vacuum().
+        :return: The number of pages released.
+        """
+        mode = self._db_conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        free_pages = self._db_conn.execute(
+            "PRAGMA freelist_count").fetchone()[0]
+        if free_pages == 0:
+            return 0
+        if mode != 2:
+            if not self._conversion_logged:
+                self._conversion_logged = True
+                _g_logger.warning(
+                    "The DB %s does not use incremental auto_vacuum so its "
+                    "%d free pages cannot be released.  It is converted "
+                    "the next time the agent starts." % (self._db_file,
+                                                         free_pages))
+            return 0
+        # this cannot be run inside of the group commit batch
+        self.flush()
+        # every step of the statement frees one page and execute() only
+        # takes the first step, executescript() runs it to the end
+        self._db_conn.executescript(
+            "PRAGMA incremental_vacuum(%d);" % int(max_pages))
+        # in WAL mode the file only shrinks once the log is checkpointed
+        self._db_conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        return free_pages - self._db_conn.execute(
+            "PRAGMA freelist_count").fetchone()[0]
+
+    @agent_utils.class_method_sync
+    def convert_auto_vacuum(self):
+        """
+        Switch a database that was made before incremental auto_vacuum was
+        turned on over to it.  This takes a full VACUUM which rewrites the
+        whole file and holds the DB the whole time, so it is only done when
+        the agent starts and nothing else is using the DB yet.
+        :return: A bool indicating if the database was converted.
+        """
+        mode = self._db_conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        if mode == 2:
+            return False
+        self.flush()
+        _g_logger.info("Running a full VACUUM on %s to turn on incremental "
+                       "auto_vacuum" % self._db_file)
+        self._db_conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self._db_conn.execute("VACUUM")
+        self._db_conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        return True
+
     @agent_utils.class_method_sync
     def clean_all(self, request_id):
         stmt = ("DELETE FROM requests WHERE request_id <> ?")
@@ -348,7 +822,7 @@ class SQLiteAgentDB(object):
             row = cursor.fetchone()
             return (row[0], row[1])
 
-        return self._execute(do_it)
+        return self._query(do_it)
 
     @agent_utils.class_method_sync
     def add_alert(self, alert_time, time_received,
@@ -381,33 +855,222 @@ class SQLiteAgentDB(object):
                 return 0
             return row[0]
 
-        return self._execute(do_it)
+        return self._query(do_it)
 
+    @agent_utils.class_method_sync
+    def outbox_add(self, sequence, doc):
+        stmt = ("INSERT INTO outbox(sequence, creation_time, doc) "
+                "VALUES(?, ?, ?)")
+        doc = codec.dumps(doc)
 
-class DBCleaner(threading.Thread):
+        def do_it(cursor):
+            cursor.execute(stmt, (sequence, datetime.datetime.now(), doc))
+        self._execute(do_it, defer=True)
 
-    def __init__(self, db, max_time, max_size, interval):
+    @agent_utils.class_method_sync
+    def outbox_ack(self, sequence):
+        """
+        Remove every outbox document up to and including sequence and
+        remember it as the last acknowledged sequence.
+        """
+        delete_stmt = "DELETE FROM outbox WHERE sequence <= ?"
+        state_stmt = ("INSERT OR REPLACE INTO outbox_state(name, value) "
+                      "VALUES('last_ack', ?)")
+
+        def do_it(cursor):
+            cursor.execute(delete_stmt, (sequence,))
+            cursor.execute(state_stmt, (sequence,))
+        self._execute(do_it, defer=True)
+
+    @agent_utils.class_method_sync
+    def outbox_trim(self, sequence):
+        """
+        Drop every outbox document up to and including sequence without
+        acknowledging it.
+        """
+        stmt = "DELETE FROM outbox WHERE sequence <= ?"
+
+        def do_it(cursor):
+            cursor.execute(stmt, (sequence,))
+        self._execute(do_it, defer=True)
+
+    @agent_utils.class_method_sync
+    def outbox_get_after(self, sequence):
+        stmt = ("SELECT sequence, doc FROM outbox WHERE sequence > ? "
+                "ORDER BY sequence")
+
+        def do_it(cursor):
+            cursor.execute(stmt, (sequence,))
+            return [(row[0], codec.loads(row[1]))
+                    for row in cursor.fetchall()]
+        return self._query(do_it)
+
+    @agent_utils.class_method_sync
+    def outbox_get_sequences(self):
+        """
+        :return: A tuple of the last acknowledged sequence and the highest
+        sequence in the outbox, each 0 if there is none.
+        """
+        ack_stmt = "SELECT value FROM outbox_state WHERE name='last_ack'"
+        max_stmt = "SELECT max(sequence) FROM outbox"
+
+        def do_it(cursor):
+            cursor.execute(ack_stmt)
+            row = cursor.fetchone()
+            last_ack = 0
+            if row is not None and row[0] is not None:
+                last_ack = row[0]
+            cursor.execute(max_stmt)
+            row = cursor.fetchone()
+            last = 0
+            if row is not None and row[0] is not None:
+                last = row[0]
+            return (last_ack, last)
+        return self._query(do_it)
+
+
+class GroupCommitWriter(threading.Thread):
+    """
+    Commits the deferred record changes of a SQLiteAgentDB every interval
+    seconds so that a burst of state changes costs a single transaction.
+    """
+
+    def __init__(self, db, interval):
+        super(GroupCommitWriter, self).__init__()
+        self._db = db
+        self._interval = interval
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self._interval):
+            try:
+                self._db.flush()
+            except Exception as ex:
+                _g_logger.exception("An exception occurred in the group "
+                                    "commit writer " + str(ex))
+
+    def done(self):
+        self._done.set()
+
+
+class DBCleaner(threading.Thread):
+    """
+    Sweeps old requests out of the DB every interval seconds.
+
+    Requests that have not been updated for max_time seconds are removed,
+    then the oldest finished requests are removed until no more than
+    max_rows requests are left and the live data is no bigger than
+    max_file_size bytes.  Everything is deleted in transactions of at most
+    chunk_size rows with a pause of chunk_pause seconds in between so that
+    the DB lock is never held for long.  The free pages are then given back
+    to the file system a few at a time.
+    """
+
+    def __init__(self, db, max_time, max_rows, interval,
+                 max_file_size=None, chunk_size=500, chunk_pause=0.05,
+                 vacuum_pages=1024):
         super(DBCleaner, self).__init__()
         self._max_time = max_time
-        self.max_size = max_size
+        self._max_rows = max_rows
+        self._max_file_size = max_file_size
         self._interval = interval
+        self._chunk_size = chunk_size
+        self._chunk_pause = chunk_pause
+        self._vacuum_pages = vacuum_pages
         self._done = threading.Event()
         self._cond = threading.Condition()
         self._db = db
+        self._stats_lock = threading.Lock()
+        self._stats = {"sweeps": 0,
+                       "rows_deleted": 0,
+                       "pages_released": 0,
+                       "sweep_time": 0.0,
+                       "last_rows_deleted": 0,
+                       "last_sweep_time": 0.0,
+                       "request_count": None,
+                       "used_size": None,
+                       "file_size": None}
 
     def run(self):
-        while not self._done.isSet():
+        while not self._done.is_set():
             self._cond.acquire()
             try:
                 self._cond.wait(self._interval)
-                cut_off_time = datetime.datetime.now() - datetime.timedelta(
-                    microseconds=self._max_time)
-                self._db.clean_all_expired(cut_off_time)
+            finally:
+                self._cond.release()
+            if self._done.is_set():
+                break
+            try:
+                self.sweep()
             except Exception as ex:
                 _g_logger.exception("An exception occurred in the db sweeper "
                                     "thread " + str(ex))
-            finally:
-                self._cond.release()
+
+    def _delete_chunks(self, delete_func, limit=None):
+        deleted = 0
+        while not self._done.is_set():
+            chunk = self._chunk_size
+            if limit is not None:
+                chunk = min(chunk, limit - deleted)
+                if chunk <= 0:
+                    break
+            n = delete_func(chunk)
+            deleted += n
+            if n < chunk:
+                break
+            # let everyone else at the DB between chunks
+            self._done.wait(self._chunk_pause)
+        return deleted
+
+    def sweep(self):
+        """
+        Run a single sweep of the DB.
+        :return: The number of requests deleted.
+        """
+        start = time.monotonic()
+        cut_off_time = datetime.datetime.now() - datetime.timedelta(
+            seconds=self._max_time)
+        deleted = self._delete_chunks(
+            lambda n: self._db.clean_expired_chunk(cut_off_time, n))
+
+        if self._max_rows:
+            excess = self._db.get_request_count() - self._max_rows
+            if excess > 0:
+                deleted += self._delete_chunks(
+                    self._db.clean_oldest_chunk, limit=excess)
+
+        if self._max_file_size:
+            while (self._db.get_size_info()["used_size"] >
+                    self._max_file_size and not self._done.is_set()):
+                n = self._db.clean_oldest_chunk(self._chunk_size)
+                if n == 0:
+                    break
+                deleted += n
+                self._done.wait(self._chunk_pause)
+        released = self._db.reclaim_space(self._vacuum_pages)
+
+        elapsed = time.monotonic() - start
+        size_info = self._db.get_size_info()
+        request_count = self._db.get_request_count()
+        with self._stats_lock:
+            self._stats["sweeps"] += 1
+            self._stats["rows_deleted"] += deleted
+            self._stats["pages_released"] += released
+            self._stats["sweep_time"] += elapsed
+            self._stats["last_rows_deleted"] = deleted
+            self._stats["last_sweep_time"] = elapsed
+            self._stats["request_count"] = request_count
+            self._stats["used_size"] = size_info["used_size"]
+            self._stats["file_size"] = size_info["file_size"]
+        _g_logger.info("The DB sweeper deleted %d requests in %.3f seconds.  "
+                       "%d requests are left and the DB file is %d bytes."
+                       % (deleted, elapsed, request_count,
+                          size_info["file_size"]))
+        return deleted
+
+    def get_stats(self):
+        with self._stats_lock:
+            return self._stats.copy()
 
     def done(self):
         self._cond.acquire()
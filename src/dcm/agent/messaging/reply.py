@@ -21,9 +21,11 @@ import sys
 
 import dcm.agent.exceptions as exceptions
 import dcm.agent.logger as dcm_logger
+import dcm.agent.messaging.persistence as persistence
 import dcm.agent.messaging.states as states
 import dcm.agent.messaging.types as message_types
 import dcm.agent.messaging.utils as utils
+import dcm.agent.events.callback as events
 import dcm.agent.events.state_machine as state_machine
 import dcm.agent.utils as agent_util
 import dcm.eventlog.tracer as tracer
@@ -47,7 +49,9 @@ class ReplyRPC(object):
                  db,
                  timeout=1.0,
                  reply_doc=None,
-                 start_state=states.ReplyStates.REQUESTING):
+                 start_state=states.ReplyStates.REQUESTING,
+                 durability=persistence.Durability.STRICT,
+                 memory_db=None):
         self._agent_id = agent_id
         self._request_id = request_id
         self._request_document = request_document
@@ -63,9 +67,12 @@ class ReplyRPC(object):
         self._lock = threading.RLock()
 
         self._response_doc = reply_doc
-        self._sm = state_machine.StateMachine(start_state)
-        self._setup_states()
+        self._sm = state_machine.StateMachine(
+            start_state, table=self._transitions, owner=self)
         self._db = db
+        self._memory_db = memory_db
+        self._durability = persistence.Durability.STRICT
+        self.set_durability(durability)
 
     def get_request_id(self):
         return self._request_id
@@ -79,6 +86,32 @@ class ReplyRPC(object):
     def get_message_payload(self):
         return self._request_document["payload"]
 
+    @agent_util.class_method_sync
+    def set_durability(self, durability):
+        """
+        Choose how the record of this request is kept, one of the
+        persistence.Durability values.  This must be called before the
+        request is acked or nacked.
+        """
+        if durability not in persistence.Durability.ALL:
+            _g_logger.warning("Unknown durability %s, using %s"
+                              % (durability, persistence.Durability.STRICT))
+            durability = persistence.Durability.STRICT
+        if durability == persistence.Durability.EPHEMERAL:
+            if self._memory_db is None:
+                self._memory_db = persistence.MemoryRecordStore()
+            self._db = self._memory_db
+        self._durability = durability
+
+    def get_durability(self):
+        return self._durability
+
+    def _make_durable(self):
+        # relaxed records are left for the group commit and ephemeral ones
+        # never reach the DB
+        if self._durability == persistence.Durability.STRICT:
+            self._db.flush()
+
     def shutdown(self):
         with tracer.RequestTracer(self._request_id):
             try:
@@ -206,7 +239,8 @@ class ReplyRPC(object):
         dcm_events.register_callback(
             self._cancel_callback,
             args=self._cancel_callback_args,
-            kwargs=self._cancel_callback_kwargs)
+            kwargs=self._cancel_callback_kwargs,
+            priority=events.Priority.HIGH)
 
     def _sm_requesting_user_accepts(self, **kwargs):
         """
@@ -217,6 +251,8 @@ class ReplyRPC(object):
                             None,
                             states.ReplyStates.ACKED,
                             self._agent_id)
+        # the ack promises the remote end that the request will not be lost
+        self._make_durable()
 
         ack_doc = {'type': message_types.MessageTypes.ACK,
                    'message_id': utils.new_message_id(),
@@ -258,6 +294,7 @@ class ReplyRPC(object):
                             None,
                             states.ReplyStates.ACKED,
                             self._agent_id)
+        self._make_durable()
 
         nack_doc = {'type': message_types.MessageTypes.NACK,
                     'message_id': utils.new_message_id(),
@@ -288,7 +325,8 @@ class ReplyRPC(object):
         dcm_events.register_callback(
             self._cancel_callback,
             args=self._cancel_callback_args,
-            kwargs=self._cancel_callback_kwargs)
+            kwargs=self._cancel_callback_kwargs,
+            priority=events.Priority.HIGH)
 
     def _sm_acked_reply(self, **kwargs):
         """
@@ -497,199 +535,201 @@ class ReplyRPC(object):
                        + str(message))
         self.shutdown()
 
-    def _setup_states(self):
-        self._sm.add_transition(states.ReplyStates.NEW,
+    # The protocol graph is built once for the class.  Handlers are named
+    # by method and looked up on each instance when an event occurs.
+    _transitions = state_machine.TransitionTable()
+    _transitions.add_transition(states.ReplyStates.NEW,
                                 states.ReplyEvents.REQUEST_RECEIVED,
                                 states.ReplyStates.REQUESTING,
-                                self._sm_initial_request_received)
+                                "_sm_initial_request_received")
 
-        self._sm.add_transition(states.ReplyStates.REQUESTING,
+    _transitions.add_transition(states.ReplyStates.REQUESTING,
                                 states.ReplyEvents.REQUEST_RECEIVED,
                                 states.ReplyStates.REQUESTING,
-                                self._sm_requesting_retransmission_received)
-        self._sm.add_transition(states.ReplyStates.REQUESTING,
+                                "_sm_requesting_retransmission_received")
+    _transitions.add_transition(states.ReplyStates.REQUESTING,
                                 states.ReplyEvents.CANCEL_RECEIVED,
                                 states.ReplyStates.CANCEL_RECEIVED_REQUESTING,
-                                self._sm_requesting_cancel_received)
-        self._sm.add_transition(states.ReplyStates.REQUESTING,
+                                "_sm_requesting_cancel_received")
+    _transitions.add_transition(states.ReplyStates.REQUESTING,
                                 states.ReplyEvents.USER_ACCEPTS_REQUEST,
                                 states.ReplyStates.ACKED,
-                                self._sm_requesting_user_accepts)
-        self._sm.add_transition(states.ReplyStates.REQUESTING,
+                                "_sm_requesting_user_accepts")
+    _transitions.add_transition(states.ReplyStates.REQUESTING,
                                 states.ReplyEvents.USER_REPLIES,
                                 states.ReplyStates.REPLY,
-                                self._sm_requesting_user_replies)
-        self._sm.add_transition(states.ReplyStates.REQUESTING,
+                                "_sm_requesting_user_replies")
+    _transitions.add_transition(states.ReplyStates.REQUESTING,
                                 states.ReplyEvents.USER_REJECTS_REQUEST,
                                 states.ReplyStates.NACKED,
-                                self._sm_requesting_user_rejects)
-        self._sm.add_transition(states.ReplyStates.REQUESTING,
+                                "_sm_requesting_user_rejects")
+    _transitions.add_transition(states.ReplyStates.REQUESTING,
                                 states.ReplyEvents.STATUS_RECEIVED,
                                 states.ReplyStates.REQUESTING,
-                                self._sm_send_status)
+                                "_sm_send_status")
 
-        self._sm.add_transition(states.ReplyStates.CANCEL_RECEIVED_REQUESTING,
+    _transitions.add_transition(states.ReplyStates.CANCEL_RECEIVED_REQUESTING,
                                 states.ReplyEvents.REQUEST_RECEIVED,
                                 states.ReplyStates.CANCEL_RECEIVED_REQUESTING,
-                                self._sm_requesting_retransmission_received)
-        self._sm.add_transition(states.ReplyStates.CANCEL_RECEIVED_REQUESTING,
+                                "_sm_requesting_retransmission_received")
+    _transitions.add_transition(states.ReplyStates.CANCEL_RECEIVED_REQUESTING,
                                 states.ReplyEvents.CANCEL_RECEIVED,
                                 states.ReplyStates.CANCEL_RECEIVED_REQUESTING,
                                 None)
-        self._sm.add_transition(states.ReplyStates.CANCEL_RECEIVED_REQUESTING,
+    _transitions.add_transition(states.ReplyStates.CANCEL_RECEIVED_REQUESTING,
                                 states.ReplyEvents.USER_ACCEPTS_REQUEST,
                                 states.ReplyStates.ACKED,
-                                self._sm_cancel_waiting_ack)
-        self._sm.add_transition(states.ReplyStates.CANCEL_RECEIVED_REQUESTING,
+                                "_sm_cancel_waiting_ack")
+    _transitions.add_transition(states.ReplyStates.CANCEL_RECEIVED_REQUESTING,
                                 states.ReplyEvents.USER_REPLIES,
                                 states.ReplyStates.REPLY,
-                                self._sm_requesting_user_replies)
-        self._sm.add_transition(states.ReplyStates.CANCEL_RECEIVED_REQUESTING,
+                                "_sm_requesting_user_replies")
+    _transitions.add_transition(states.ReplyStates.CANCEL_RECEIVED_REQUESTING,
                                 states.ReplyEvents.USER_REJECTS_REQUEST,
                                 states.ReplyStates.NACKED,
-                                self._sm_requesting_user_rejects)
-        self._sm.add_transition(states.ReplyStates.CANCEL_RECEIVED_REQUESTING,
+                                "_sm_requesting_user_rejects")
+    _transitions.add_transition(states.ReplyStates.CANCEL_RECEIVED_REQUESTING,
                                 states.ReplyEvents.STATUS_RECEIVED,
                                 states.ReplyStates.CANCEL_RECEIVED_REQUESTING,
-                                self._sm_send_status)
+                                "_sm_send_status")
 
-        self._sm.add_transition(states.ReplyStates.ACKED,
+    _transitions.add_transition(states.ReplyStates.ACKED,
                                 states.ReplyEvents.REQUEST_RECEIVED,
                                 states.ReplyStates.ACKED,
-                                self._sm_acked_request_received)
-        self._sm.add_transition(states.ReplyStates.ACKED,
+                                "_sm_acked_request_received")
+    _transitions.add_transition(states.ReplyStates.ACKED,
                                 states.ReplyEvents.CANCEL_RECEIVED,
                                 states.ReplyStates.ACKED,
-                                self._sm_acked_cancel_received)
-        self._sm.add_transition(states.ReplyStates.ACKED,
+                                "_sm_acked_cancel_received")
+    _transitions.add_transition(states.ReplyStates.ACKED,
                                 states.ReplyEvents.USER_REPLIES,
                                 states.ReplyStates.REPLY,
-                                self._sm_acked_reply)
-        self._sm.add_transition(states.ReplyStates.ACKED,
+                                "_sm_acked_reply")
+    _transitions.add_transition(states.ReplyStates.ACKED,
                                 states.ReplyEvents.STATUS_RECEIVED,
                                 states.ReplyStates.ACKED,
-                                self._sm_send_status)
-
-        # if the AM receives and ACK but has never heard of the request ID
-        # it will send a nack.  this should not happen in a normal course
-        # of events.  At this point we should just kill the request and
-        # log a scary message.  We also need to kill anything running for that
-        # that request
-        # This will happen when the agent manager quits on a request before
-        # the agent sends the ack.  when the AM receives the ack it has already
-        # canceled the request and thus NACKs the ACK
-        self._sm.add_transition(states.ReplyStates.ACKED,
+                                "_sm_send_status")
+
+    # if the AM receives and ACK but has never heard of the request ID
+    # it will send a nack.  this should not happen in a normal course
+    # of events.  At this point we should just kill the request and
+    # log a scary message.  We also need to kill anything running for that
+    # that request
+    # This will happen when the agent manager quits on a request before
+    # the agent sends the ack.  when the AM receives the ack it has already
+    # canceled the request and thus NACKs the ACK
+    _transitions.add_transition(states.ReplyStates.ACKED,
                                 states.ReplyEvents.REPLY_NACK_RECEIVED,
                                 states.ReplyStates.REPLY_NACKED,
-                                self._sm_ack_reply_nack_received)
+                                "_sm_ack_reply_nack_received")
 
-        # note, eventually we will want to reply retrans logic to just punt
-        self._sm.add_transition(states.ReplyStates.REPLY,
+    # note, eventually we will want to reply retrans logic to just punt
+    _transitions.add_transition(states.ReplyStates.REPLY,
                                 states.ReplyEvents.REQUEST_RECEIVED,
                                 states.ReplyStates.REPLY,
-                                self._sm_reply_request_retrans)
-        self._sm.add_transition(states.ReplyStates.REPLY,
+                                "_sm_reply_request_retrans")
+    _transitions.add_transition(states.ReplyStates.REPLY,
                                 states.ReplyEvents.USER_REPLIES,
                                 states.ReplyStates.REPLY,
-                                self._sm_acked_reply)
-        self._sm.add_transition(states.ReplyStates.REPLY,
+                                "_sm_acked_reply")
+    _transitions.add_transition(states.ReplyStates.REPLY,
                                 states.ReplyEvents.CANCEL_RECEIVED,
                                 states.ReplyStates.REPLY,
-                                self._sm_reply_cancel_received)
-        self._sm.add_transition(states.ReplyStates.REPLY,
+                                "_sm_reply_cancel_received")
+    _transitions.add_transition(states.ReplyStates.REPLY,
                                 states.ReplyEvents.REPLY_ACK_RECEIVED,
                                 states.ReplyStates.REPLY_ACKED,
-                                self._sm_reply_ack_received)
-        self._sm.add_transition(states.ReplyStates.REPLY,
+                                "_sm_reply_ack_received")
+    _transitions.add_transition(states.ReplyStates.REPLY,
                                 states.ReplyEvents.TIMEOUT,
                                 states.ReplyStates.REPLY,
-                                self._sm_reply_ack_timeout)
-        self._sm.add_transition(states.ReplyStates.REPLY,
+                                "_sm_reply_ack_timeout")
+    _transitions.add_transition(states.ReplyStates.REPLY,
                                 states.ReplyEvents.REPLY_NACK_RECEIVED,
                                 states.ReplyStates.REPLY_NACKED,
-                                self._sm_reply_nack_received)
-        self._sm.add_transition(states.ReplyStates.REPLY,
+                                "_sm_reply_nack_received")
+    _transitions.add_transition(states.ReplyStates.REPLY,
                                 states.ReplyEvents.STATUS_RECEIVED,
                                 states.ReplyStates.REPLY,
-                                self._sm_send_status)
+                                "_sm_send_status")
 
-        self._sm.add_transition(states.ReplyStates.REPLY,
+    _transitions.add_transition(states.ReplyStates.REPLY,
                                 states.ReplyEvents.DB_INFLATE,
                                 states.ReplyStates.REPLY,
-                                self._sm_acked_re_reply)
+                                "_sm_acked_re_reply")
 
-        self._sm.add_transition(states.ReplyStates.NACKED,
+    _transitions.add_transition(states.ReplyStates.NACKED,
                                 states.ReplyEvents.REQUEST_RECEIVED,
                                 states.ReplyStates.NACKED,
-                                self._sm_nacked_request_received)
-        self._sm.add_transition(states.ReplyStates.NACKED,
+                                "_sm_nacked_request_received")
+    _transitions.add_transition(states.ReplyStates.NACKED,
                                 states.ReplyEvents.STATUS_RECEIVED,
                                 states.ReplyStates.NACKED,
-                                self._sm_send_status)
+                                "_sm_send_status")
 
-        self._sm.add_transition(states.ReplyStates.REPLY_ACKED,
+    _transitions.add_transition(states.ReplyStates.REPLY_ACKED,
                                 states.ReplyEvents.REQUEST_RECEIVED,
                                 states.ReplyStates.REPLY_ACKED,
-                                self._sm_reply_request_retrans)
-        self._sm.add_transition(states.ReplyStates.REPLY_ACKED,
+                                "_sm_reply_request_retrans")
+    _transitions.add_transition(states.ReplyStates.REPLY_ACKED,
                                 states.ReplyEvents.REPLY_ACK_RECEIVED,
                                 states.ReplyStates.REPLY_ACKED,
-                                self._sm_reply_ack_re_acked)
-        self._sm.add_transition(states.ReplyStates.REPLY_ACKED,
+                                "_sm_reply_ack_re_acked")
+    _transitions.add_transition(states.ReplyStates.REPLY_ACKED,
                                 states.ReplyEvents.REPLY_NACK_RECEIVED,
                                 states.ReplyStates.REPLY_ACKED,
-                                self._sm_reply_ack_now_nacked)
-        self._sm.add_transition(states.ReplyStates.REPLY_ACKED,
+                                "_sm_reply_ack_now_nacked")
+    _transitions.add_transition(states.ReplyStates.REPLY_ACKED,
                                 states.ReplyEvents.CANCEL_RECEIVED,
                                 states.ReplyStates.REPLY_ACKED,
                                 None)
-        self._sm.add_transition(states.ReplyStates.REPLY_ACKED,
+    _transitions.add_transition(states.ReplyStates.REPLY_ACKED,
                                 states.ReplyEvents.STATUS_RECEIVED,
                                 states.ReplyStates.REPLY_ACKED,
-                                self._sm_send_status)
-        self._sm.add_transition(states.ReplyStates.REPLY_ACKED,
+                                "_sm_send_status")
+    _transitions.add_transition(states.ReplyStates.REPLY_ACKED,
                                 states.ReplyEvents.TIMEOUT,
                                 states.ReplyStates.REPLY_ACKED,
                                 None)
 
-        # this transition should only occur when the AM makes a mistake
-        # or messages are received out of order.
-        self._sm.add_transition(states.ReplyStates.REPLY_ACKED,
+    # this transition should only occur when the AM makes a mistake
+    # or messages are received out of order.
+    _transitions.add_transition(states.ReplyStates.REPLY_ACKED,
                                 states.ReplyEvents.DB_INFLATE,
                                 states.ReplyStates.REPLY_ACKED,
-                                self._sm_reinflated_reply_ack)
+                                "_sm_reinflated_reply_ack")
 
-        self._sm.add_transition(states.ReplyStates.REPLY_NACKED,
+    _transitions.add_transition(states.ReplyStates.REPLY_NACKED,
                                 states.ReplyEvents.REQUEST_RECEIVED,
                                 states.ReplyStates.REPLY_NACKED,
-                                self._sm_reply_request_retrans)
-        self._sm.add_transition(states.ReplyStates.REPLY_NACKED,
+                                "_sm_reply_request_retrans")
+    _transitions.add_transition(states.ReplyStates.REPLY_NACKED,
                                 states.ReplyEvents.REPLY_ACK_RECEIVED,
                                 states.ReplyStates.REPLY_NACKED,
-                                self._sm_reply_nack_re_nacked)
-        self._sm.add_transition(states.ReplyStates.REPLY_NACKED,
+                                "_sm_reply_nack_re_nacked")
+    _transitions.add_transition(states.ReplyStates.REPLY_NACKED,
                                 states.ReplyEvents.REPLY_NACK_RECEIVED,
                                 states.ReplyStates.REPLY_NACKED,
-                                self._sm_reply_nack_now_acked)
-        self._sm.add_transition(states.ReplyStates.REPLY_NACKED,
+                                "_sm_reply_nack_now_acked")
+    _transitions.add_transition(states.ReplyStates.REPLY_NACKED,
                                 states.ReplyEvents.CANCEL_RECEIVED,
                                 states.ReplyStates.REPLY_NACKED,
                                 None)
 
-        # this will happen when the plugin finishes and thus replies
-        # to a request that had its ACK NACKed.  In this case we
-        # just cancel the messaging and log a message
-        self._sm.add_transition(states.ReplyStates.REPLY_NACKED,
+    # this will happen when the plugin finishes and thus replies
+    # to a request that had its ACK NACKed.  In this case we
+    # just cancel the messaging and log a message
+    _transitions.add_transition(states.ReplyStates.REPLY_NACKED,
                                 states.ReplyEvents.USER_REPLIES,
                                 states.ReplyStates.REPLY_NACKED,
-                                self._sm_replied_nacked_reply)
+                                "_sm_replied_nacked_reply")
 
-        # this next state should only occur when a message is out
-        # of order or the agent manager made a mistake
-        self._sm.add_transition(states.ReplyStates.REPLY_NACKED,
+    # this next state should only occur when a message is out
+    # of order or the agent manager made a mistake
+    _transitions.add_transition(states.ReplyStates.REPLY_NACKED,
                                 states.ReplyEvents.DB_INFLATE,
                                 states.ReplyStates.REPLY_NACKED,
-                                self._sm_reinflated_reply_ack)
+                                "_sm_reinflated_reply_ack")
 
 
 class RequestListener(object):
@@ -708,6 +748,8 @@ class RequestListener(object):
         self._db = db
         self._id_system = id_system
         self._lock = threading.RLock()
+        # the records of the ephemeral requests
+        self._memory_db = persistence.MemoryRecordStore()
         self._db.starting_agent()
 
     def get_reply_observers(self):
@@ -759,7 +801,11 @@ class RequestListener(object):
                 req.incoming_message(incoming_doc)
                 return
             # if the request id has already been seen by the database
-            db_record = self._db.lookup_req(request_id)
+            durability = persistence.Durability.EPHEMERAL
+            db_record = self._memory_db.lookup_req(request_id)
+            if db_record is None:
+                durability = persistence.Durability.STRICT
+                db_record = self._db.lookup_req(request_id)
             if db_record:
                 _g_logger.info("Inflating the record from the DB."
                                + request_id)
@@ -772,7 +818,9 @@ class RequestListener(object):
                     self._db,
                     timeout=self._timeout,
                     reply_doc=db_record.reply_doc,
-                    start_state=db_record.state)
+                    start_state=db_record.state,
+                    durability=durability,
+                    memory_db=self._memory_db)
 
                 # this will probably be used in the near future so get it
                 # on the memory list
@@ -807,7 +855,8 @@ class RequestListener(object):
                     request_id,
                     incoming_doc,
                     self._db,
-                    timeout=self._timeout)
+                    timeout=self._timeout,
+                    memory_db=self._memory_db)
                 self._call_reply_observers("new_message", req)
 
                 # only add the message if processing was successful
@@ -866,6 +915,7 @@ class RequestListener(object):
             self._messages_processed += 1
         finally:
             self._lock.release()
+        self._conn.request_complete(request_id)
         self._call_reply_observers("message_done", reply_message)
 
     def get_messages_processed(self):
@@ -21,6 +21,7 @@ import dcm.agent.exceptions as exceptions
 import dcm.agent.messaging.states as states
 import dcm.agent.messaging.types as types
 import dcm.agent.messaging.utils as utils
+import dcm.agent.events.callback as events
 import dcm.agent.events.state_machine as state_machine
 import dcm.agent.utils as agent_util
 
@@ -39,7 +40,8 @@ class RequestRPC(object):
         self._doc = document
         self._request_id = str(uuid.uuid4())
         self._sm = state_machine.StateMachine(
-            states.RequesterStates.REQUEST_NEW)
+            states.RequesterStates.REQUEST_NEW,
+            table=self._transitions, owner=self)
         self._timeout = timeout
         self._reply_callback = reply_callback
         self._reply_args = reply_args
@@ -55,7 +57,6 @@ class RequestRPC(object):
         self._target = target_id
         self._message_timer = None
 
-        self._setup_states()
         self.ack_sender = 0
         self._lock = threading.RLock()
 
@@ -149,7 +150,8 @@ class RequestRPC(object):
         self._completion_timer = dcm_events.register_callback(
             self.ack_sent_timeout,
             kwargs={'timer': self._completion_timer},
-            delay=self._cleanup_timeout)
+            delay=self._cleanup_timeout,
+            priority=events.Priority.HIGH)
 
     @agent_util.class_method_sync
     def cleanup(self):
@@ -293,7 +295,8 @@ class RequestRPC(object):
                 args.extend(self._reply_args)
             dcm_events.register_callback(
                 self._user_reply_callback,
-                args=self._reply_args, kwargs=self._reply_kwargs)
+                args=self._reply_args, kwargs=self._reply_kwargs,
+                priority=events.Priority.HIGH)
 
     def _sm_user_cb_returned(self, **kwargs):
         """
@@ -425,109 +428,111 @@ class RequestRPC(object):
         """
         pass
 
-    def _setup_states(self):
-        self._sm.add_transition(states.RequesterStates.REQUEST_NEW,
+    # The protocol graph is built once for the class.  Handlers are named
+    # by method and looked up on each instance when an event occurs.
+    _transitions = state_machine.TransitionTable()
+    _transitions.add_transition(states.RequesterStates.REQUEST_NEW,
                                 states.RequesterEvents.REQUEST_MADE,
                                 states.RequesterStates.REQUESTING,
-                                self._sm_send_request)
+                                "_sm_send_request")
 
-        self._sm.add_transition(states.RequesterStates.REQUESTING,
+    _transitions.add_transition(states.RequesterStates.REQUESTING,
                                 states.RequesterEvents.TIMEOUT,
                                 states.RequesterStates.REQUESTING,
-                                self._sm_requesting_timeout)
-        self._sm.add_transition(states.RequesterStates.REQUESTING,
+                                "_sm_requesting_timeout")
+    _transitions.add_transition(states.RequesterStates.REQUESTING,
                                 states.RequesterEvents.ACK_RECEIVED,
                                 states.RequesterStates.REQUESTED,
-                                self._sm_requesting_ack)
-        self._sm.add_transition(states.RequesterStates.REQUESTING,
+                                "_sm_requesting_ack")
+    _transitions.add_transition(states.RequesterStates.REQUESTING,
                                 states.RequesterEvents.NACK_RECEIVED,
                                 states.RequesterStates.REQUEST_FAILING,
-                                self._sm_requesting_nack_received)
-        self._sm.add_transition(states.RequesterStates.REQUESTING,
+                                "_sm_requesting_nack_received")
+    _transitions.add_transition(states.RequesterStates.REQUESTING,
                                 states.RequesterEvents.REPLY_RECEIVED,
                                 states.RequesterStates.USER_CALLBACK,
-                                self._sm_requesting_reply_received)
-        self._sm.add_transition(states.RequesterStates.REQUESTING,
+                                "_sm_requesting_reply_received")
+    _transitions.add_transition(states.RequesterStates.REQUESTING,
                                 states.RequesterEvents.CANCEL_REQUESTED,
                                 states.RequesterStates.REQUESTING,
-                                self._sm_send_cancel)
+                                "_sm_send_cancel")
 
-        self._sm.add_transition(states.RequesterStates.REQUESTED,
+    _transitions.add_transition(states.RequesterStates.REQUESTED,
                                 states.RequesterEvents.ACK_RECEIVED,
                                 states.RequesterStates.REQUESTED,
-                                self._sm_requested_ack)
-        self._sm.add_transition(states.RequesterStates.REQUESTED,
+                                "_sm_requested_ack")
+    _transitions.add_transition(states.RequesterStates.REQUESTED,
                                 states.RequesterEvents.CANCEL_REQUESTED,
                                 states.RequesterStates.REQUESTED,
-                                self._sm_send_cancel)
-        self._sm.add_transition(states.RequesterStates.REQUESTED,
+                                "_sm_send_cancel")
+    _transitions.add_transition(states.RequesterStates.REQUESTED,
                                 states.RequesterEvents.NACK_RECEIVED,
                                 states.RequesterStates.REQUEST_FAILING,
-                                self._sm_requested_nack_received)
-        self._sm.add_transition(states.RequesterStates.REQUESTED,
+                                "_sm_requested_nack_received")
+    _transitions.add_transition(states.RequesterStates.REQUESTED,
                                 states.RequesterEvents.REPLY_RECEIVED,
                                 states.RequesterStates.USER_CALLBACK,
-                                self._sm_requested_reply_received)
-        self._sm.add_transition(states.RequesterStates.REQUESTED,
+                                "_sm_requested_reply_received")
+    _transitions.add_transition(states.RequesterStates.REQUESTED,
                                 states.RequesterEvents.TIMEOUT,
                                 states.RequesterStates.REQUESTED,
-                                self._sm_requested_timeout)
+                                "_sm_requested_timeout")
 
-        self._sm.add_transition(states.RequesterStates.USER_CALLBACK,
+    _transitions.add_transition(states.RequesterStates.USER_CALLBACK,
                                 states.RequesterEvents.REPLY_RECEIVED,
                                 states.RequesterStates.USER_CALLBACK,
-                                self._sm_usercb_reply)
-        self._sm.add_transition(states.RequesterStates.USER_CALLBACK,
+                                "_sm_usercb_reply")
+    _transitions.add_transition(states.RequesterStates.USER_CALLBACK,
                                 states.RequesterEvents.CANCEL_REQUESTED,
                                 states.RequesterStates.USER_CALLBACK,
-                                self._sm_cancel_requested_when_closing)
-        self._sm.add_transition(states.RequesterStates.USER_CALLBACK,
+                                "_sm_cancel_requested_when_closing")
+    _transitions.add_transition(states.RequesterStates.USER_CALLBACK,
                                 states.RequesterEvents.CALLBACK_RETURNED,
                                 states.RequesterStates.ACK_SENT,
-                                self._sm_user_cb_returned)
-        #  the next one is a super rare case where the timeout expires
-        # but before it can get the lock the remote ends ack is processed
-        # and the users callback returns.  XXX TODO make its own CB
-        self._sm.add_transition(states.RequesterStates.USER_CALLBACK,
+                                "_sm_user_cb_returned")
+    #  the next one is a super rare case where the timeout expires
+    # but before it can get the lock the remote ends ack is processed
+    # and the users callback returns.  XXX TODO make its own CB
+    _transitions.add_transition(states.RequesterStates.USER_CALLBACK,
                                 states.RequesterEvents.TIMEOUT,
                                 states.RequesterStates.USER_CALLBACK,
-                                self._sm_requested_timeout)
+                                "_sm_requested_timeout")
 
-        self._sm.add_transition(states.RequesterStates.REQUEST_FAILING,
+    _transitions.add_transition(states.RequesterStates.REQUEST_FAILING,
                                 states.RequesterEvents.NACK_RECEIVED,
                                 states.RequesterStates.REQUEST_FAILING,
-                                self._sm_nak_in_failed)
-        self._sm.add_transition(states.RequesterStates.REQUEST_FAILING,
+                                "_sm_nak_in_failed")
+    _transitions.add_transition(states.RequesterStates.REQUEST_FAILING,
                                 states.RequesterEvents.CANCEL_REQUESTED,
                                 states.RequesterStates.REQUEST_FAILING,
-                                self._sm_cancel_requested_when_closing)
-        self._sm.add_transition(states.RequesterStates.REQUEST_FAILING,
+                                "_sm_cancel_requested_when_closing")
+    _transitions.add_transition(states.RequesterStates.REQUEST_FAILING,
                                 states.RequesterEvents.CALLBACK_RETURNED,
                                 states.RequesterStates.CLEANUP,
-                                self._sm_failing_cb_returns)
-        #  the next one is a super rare case where the timeout expires
-        # but before it can get the lock the remote ends nacks
-        # XXX TODO make its own CB
-        self._sm.add_transition(states.RequesterStates.REQUEST_FAILING,
+                                "_sm_failing_cb_returns")
+    #  the next one is a super rare case where the timeout expires
+    # but before it can get the lock the remote ends nacks
+    # XXX TODO make its own CB
+    _transitions.add_transition(states.RequesterStates.REQUEST_FAILING,
                                 states.RequesterEvents.TIMEOUT,
                                 states.RequesterStates.REQUEST_FAILING,
-                                self._sm_requested_timeout)
+                                "_sm_requested_timeout")
 
-        self._sm.add_transition(states.RequesterStates.ACK_SENT,
+    _transitions.add_transition(states.RequesterStates.ACK_SENT,
                                 states.RequesterEvents.REPLY_RECEIVED,
                                 states.RequesterStates.ACK_SENT,
-                                self._sm_ack_sent_reply_received)
-        self._sm.add_transition(states.RequesterStates.ACK_SENT,
+                                "_sm_ack_sent_reply_received")
+    _transitions.add_transition(states.RequesterStates.ACK_SENT,
                                 states.RequesterEvents.CLEANUP_TIMEOUT,
                                 states.RequesterStates.CLEANUP,
-                                self._sm_ack_cleanup_timeout)
-        self._sm.add_transition(states.RequesterStates.ACK_SENT,
+                                "_sm_ack_cleanup_timeout")
+    _transitions.add_transition(states.RequesterStates.ACK_SENT,
                                 states.RequesterEvents.NACK_RECEIVED,
                                 states.RequesterStates.CLEANUP,
-                                self._sm_failing_cb_returns)
-        # again a timeout could theoretically happen in this state if the
-        # timeout thread is quite slow at getting the lock
-        self._sm.add_transition(states.RequesterStates.ACK_SENT,
+                                "_sm_failing_cb_returns")
+    # again a timeout could theoretically happen in this state if the
+    # timeout thread is quite slow at getting the lock
+    _transitions.add_transition(states.RequesterStates.ACK_SENT,
                                 states.RequesterEvents.TIMEOUT,
                                 states.RequesterStates.ACK_SENT,
-                                self._sm_requested_timeout)
+                                "_sm_requested_timeout")
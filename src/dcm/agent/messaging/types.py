@@ -26,3 +26,5 @@ class MessageTypes(object):
     ALERT = "ALERT"
     ALERT_ACK = "ALERT_ACK"
     HEMLOCK = "HEMLOCK"
+    BATCH = "BATCH"
+    SEQ_ACK = "SEQ_ACK"
@@ -17,6 +17,7 @@ import logging
 import threading
 import uuid
 
+import dcm.agent.events.callback as events
 import dcm.agent.utils as agent_utils
 
 
@@ -63,7 +64,8 @@ class MessageTimer(object):
         self._send_doc['entity'] = "timer"
         conn.send(self._send_doc)
         self._timer = dcm_events.register_callback(
-            self._cb, args=[self], delay=self._timeout)
+            self._cb, args=[self], delay=self._timeout,
+            priority=events.Priority.HIGH)
 
     @agent_utils.class_method_sync
     def cancel(self):
@@ -100,6 +100,12 @@ class Plugin(object):
                       to instruct the dcm-agent-add-plugin that this plugin
                       will be run for a long time and should be set up for
                       polling with get_job_description.
+
+    :var durability: The variable durability can be set on the class to
+                     tell the dcm-agent-add-plugin how the record of each
+                     request for this plugin is kept.  It is one of
+                     strict, relaxed or ephemeral, see
+                     dcm.agent.messaging.persistence.Durability.
     """
 
     protocol_arguments = {}
@@ -14,9 +14,9 @@
 # limitations under the License.
 #
 import datetime
-import json
 import threading
 
+import dcm.agent.codec as codec
 import dcm.agent.exceptions as exceptions
 import dcm.agent.utils as utils
 
@@ -40,19 +40,27 @@ class JsonPage(BasePage):
     def __init__(self, page_size, obj_list):
         super(JsonPage, self).__init__(page_size)
         self._obj_list = obj_list
+        self._next = 0
+        # the encoded size of the object that did not fit on the last page
+        self._next_size = None
 
     @utils.class_method_sync
     def get_next_page(self):
-        page_list = []
+        start = self._next
+        end = start
         size_so_far = 0
-        for json_obj in self._obj_list:
-            line_size = len(json.dumps(json_obj))
+        while end < len(self._obj_list):
+            line_size = self._next_size
+            if line_size is None:
+                line_size = len(codec.dumps(self._obj_list[end]))
             if size_so_far + line_size > self._page_size:
+                self._next_size = line_size
                 break
-            page_list.append(json_obj)
+            self._next_size = None
             size_so_far += line_size
-        self._obj_list = self._obj_list[len(page_list):]
-        return (page_list, len(self._obj_list))
+            end += 1
+        self._next = end
+        return (self._obj_list[start:end], len(self._obj_list) - end)
 
 
 class StringPage(BasePage):
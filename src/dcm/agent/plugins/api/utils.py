@@ -17,11 +17,11 @@
 dcm-agent extension plugins.
 """
 import base64
-import json
 import logging
 import os
 import re
 
+import dcm.agent.codec as codec
 import dcm.agent.utils as agent_util
 import dcm.agent.logger as dcm_logger
 
@@ -46,7 +46,7 @@ def json_param_type(json_str):
         return json_str
     if json_str.lower() == "null":
         return None
-    return json.loads(json_str)
+    return codec.loads(json_str)
 
 
 def user_name(proposed_name):
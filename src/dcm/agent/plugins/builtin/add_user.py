@@ -43,7 +43,10 @@ class AddUser(plugin_base.ScriptPlugin):
                                    self.args.lastName,
                                    self.args.administrator.lower()]
         self.ssh_public_key = self.args.authentication
-        self._db = persistence.SQLiteAgentDB(conf.storage_dbfile)
+        self._db = persistence.SQLiteAgentDB(
+            conf.storage_dbfile,
+            journal_mode=conf.storage_db_journal_mode,
+            synchronous=conf.storage_db_synchronous)
 
     def run(self):
         key_file = self.conf.get_temp_file(self.args.userId + ".pub")
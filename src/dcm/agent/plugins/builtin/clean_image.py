@@ -50,7 +50,10 @@ class CleanImage(plugin_base.Plugin):
             conf, job_id, items_map, name, arguments)
         self._done_event = threading.Event()
         self._topic_error = None
-        self._db = persistence.SQLiteAgentDB(conf.storage_dbfile)
+        self._db = persistence.SQLiteAgentDB(
+            conf.storage_dbfile,
+            journal_mode=conf.storage_db_journal_mode,
+            synchronous=conf.storage_db_synchronous)
 
     def run_scrubber(self, opts):
         exe = os.path.join(os.path.dirname(sys.executable),
@@ -0,0 +1,36 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import dcm.agent.connection.stats as conn_stats
+import dcm.agent.plugins.api.base as plugin_base
+
+
+class GetConnectionStats(plugin_base.Plugin):
+
+    def __init__(self, conf, job_id, items_map, name, arguments):
+        super(GetConnectionStats, self).__init__(
+            conf, job_id, items_map, name, arguments)
+
+    def run(self):
+        reply_object = conn_stats.get_active_connection_stats()
+        if reply_object is None:
+            return plugin_base.PluginReply(
+                1, error_message="The connection does not keep statistics")
+        return plugin_base.PluginReply(
+            0, reply_type="connection_stats", reply_object=reply_object)
+
+
+def load_plugin(conf, job_id, items_map, name, arguments):
+    return GetConnectionStats(conf, job_id, items_map, name, arguments)
@@ -37,6 +37,7 @@ import dcm.agent
 import dcm.agent.cmd.configure as configure
 import dcm.agent.cmd.service as service
 import dcm.agent.config as config
+import dcm.agent.connection.stats as conn_stats
 import dcm.agent.dispatcher as dispatcher
 import dcm.agent.logger as logger
 import dcm.agent.messaging.persistence as persistence
@@ -247,6 +248,34 @@ class TestProtocolCommands(unittest.TestCase):
         self.assertEqual(r["payload"]["reply_type"], "agent_data")
         self.assertEqual(r["payload"]["return_code"], 0)
 
+    def test_get_event_loop_stats(self):
+        doc = {
+            "command": "get_event_loop_stats",
+            "arguments": {}
+        }
+        req_rpc = self._rpc_wait_reply(doc)
+        r = req_rpc.get_reply()
+        self.assertEqual(r["payload"]["reply_type"], "event_loop_stats")
+        self.assertEqual(r["payload"]["return_code"], 0)
+        self.assertIn("wait_time", r["payload"]["reply_object"])
+
+    def test_get_connection_stats(self):
+        conn = mock.Mock()
+        conn.get_connection_stats.return_value = {"frames_out": 3}
+        conn_stats.set_active_connection(conn)
+        try:
+            doc = {
+                "command": "get_connection_stats",
+                "arguments": {}
+            }
+            req_rpc = self._rpc_wait_reply(doc)
+        finally:
+            conn_stats.set_active_connection(None)
+        r = req_rpc.get_reply()
+        self.assertEqual(r["payload"]["reply_type"], "connection_stats")
+        self.assertEqual(r["payload"]["return_code"], 0)
+        self.assertEqual(r["payload"]["reply_object"], {"frames_out": 3})
+
     @test_utils.system_changing
     def test_add_user_remove_user(self):
         user_name = "dcm" + str(random.randint(10, 99))
@@ -15,7 +15,6 @@
 #
 from distutils.log import warn
 import getpass
-import json
 import os
 import shutil
 import tempfile
@@ -27,6 +26,7 @@ from dcm.agent import logger
 
 import dcm.agent.cmd.service as dcmagent
 import dcm.agent.cmd.configure as configure
+import dcm.agent.messaging.states as states
 import dcm.agent.tests.utils.general as test_utils
 
 
@@ -149,25 +149,22 @@ class TestProgramOptions(unittest.TestCase):
     def test_status_db_jobs_request_lookup(
             self, id_platform, guess_effective_cloud_mock, fake_db):
 
-        class FakeRequest(object):
-            def __init__(self, doc):
-                self.request_doc = json.dumps({'payload': doc})
-
         class FakeDB(object):
-            def get_all_complete(self):
-                return [FakeRequest({'command': 'initialize'})]
+            def needs_migration(self):
+                return False
 
-            def get_all_reply(self):
-                return []
+            def close(self):
+                pass
 
-            def get_all_rejected(self):
-                return []
+            def get_command_states(self, command):
+                return [states.ReplyStates.REPLY_ACKED]
 
-            def get_all_ack(self):
-                return []
+            def count_by_state(self):
+                return {states.ReplyStates.REPLY_ACKED: 1}
 
-            def get_all_reply_nacked(self):
-                return []
+            def get_size_info(self):
+                return {"used_size": 4096, "free_pages": 0,
+                        "file_size": 4096}
 
         fake_db.return_value = FakeDB()
         id_platform.return_value = ("ubuntu", "14.04")
@@ -182,25 +179,22 @@ class TestProgramOptions(unittest.TestCase):
     def test_status_exception_in_request_lookup(
             self, id_platform, guess_effective_cloud_mock, fake_db):
 
-        class FakeRequest(object):
-            def __init__(self, doc):
-                self.request_doc = json.dumps({'payload': doc})
-
         class FakeDB(object):
-            def get_all_complete(self):
-                return [FakeRequest({'nocommand': 'initialize'})]
+            def needs_migration(self):
+                return False
 
-            def get_all_reply(self):
-                return []
+            def close(self):
+                pass
 
-            def get_all_rejected(self):
+            def get_command_states(self, command):
                 return []
 
-            def get_all_ack(self):
-                return []
+            def count_by_state(self):
+                return {states.ReplyStates.REPLY_ACKED: 1}
 
-            def get_all_reply_nacked(self):
-                return []
+            def get_size_info(self):
+                return {"used_size": 4096, "free_pages": 0,
+                        "file_size": 4096}
 
         fake_db.return_value = FakeDB()
         id_platform.return_value = ("ubuntu", "14.04")
@@ -215,25 +209,22 @@ class TestProgramOptions(unittest.TestCase):
     def test_status_db_jobs_request_lookup_not_initialized(
             self, id_platform, guess_effective_cloud_mock, fake_db):
 
-        class FakeRequest(object):
-            def __init__(self, doc):
-                self.request_doc = json.dumps({'payload': doc})
-
         class FakeDB(object):
-            def get_all_complete(self):
-                return []
+            def needs_migration(self):
+                return False
 
-            def get_all_reply(self):
-                return [FakeRequest({'command': 'initialize'})]
+            def close(self):
+                pass
 
-            def get_all_rejected(self):
-                return []
+            def get_command_states(self, command):
+                return [states.ReplyStates.REPLY]
 
-            def get_all_ack(self):
-                return []
+            def count_by_state(self):
+                return {states.ReplyStates.REPLY: 1}
 
-            def get_all_reply_nacked(self):
-                return []
+            def get_size_info(self):
+                return {"used_size": 4096, "free_pages": 0,
+                        "file_size": 4096}
 
         fake_db.return_value = FakeDB()
         id_platform.return_value = ("ubuntu", "14.04")
@@ -248,25 +239,22 @@ class TestProgramOptions(unittest.TestCase):
     def test_status_db_jobs_request_lookup_rejected_initialized(
             self, id_platform, guess_effective_cloud_mock, fake_db):
 
-        class FakeRequest(object):
-            def __init__(self, doc):
-                self.request_doc = json.dumps({'payload': doc})
-
         class FakeDB(object):
-            def get_all_complete(self):
-                return []
+            def needs_migration(self):
+                return False
 
-            def get_all_reply(self):
-                return []
+            def close(self):
+                pass
 
-            def get_all_rejected(self):
-                return [FakeRequest({'command': 'initialize'})]
+            def get_command_states(self, command):
+                return [states.ReplyStates.NACKED]
 
-            def get_all_ack(self):
-                return []
+            def count_by_state(self):
+                return {states.ReplyStates.NACKED: 1}
 
-            def get_all_reply_nacked(self):
-                return []
+            def get_size_info(self):
+                return {"used_size": 4096, "free_pages": 0,
+                        "file_size": 4096}
 
         fake_db.return_value = FakeDB()
         id_platform.return_value = ("ubuntu", "14.04")
@@ -281,25 +269,22 @@ class TestProgramOptions(unittest.TestCase):
     def test_status_db_jobs_request_lookup_acked_initialized(
             self, id_platform, guess_effective_cloud_mock, fake_db):
 
-        class FakeRequest(object):
-            def __init__(self, doc):
-                self.request_doc = json.dumps({'payload': doc})
-
         class FakeDB(object):
-            def get_all_complete(self):
-                return []
+            def needs_migration(self):
+                return False
 
-            def get_all_reply(self):
-                return []
+            def close(self):
+                pass
 
-            def get_all_rejected(self):
-                return []
+            def get_command_states(self, command):
+                return [states.ReplyStates.ACKED]
 
-            def get_all_ack(self):
-                return [FakeRequest({'command': 'initialize'})]
+            def count_by_state(self):
+                return {states.ReplyStates.ACKED: 1}
 
-            def get_all_reply_nacked(self):
-                return []
+            def get_size_info(self):
+                return {"used_size": 4096, "free_pages": 0,
+                        "file_size": 4096}
 
         fake_db.return_value = FakeDB()
         id_platform.return_value = ("ubuntu", "14.04")
@@ -314,25 +299,22 @@ class TestProgramOptions(unittest.TestCase):
     def test_status_db_jobs_request_lookup_nacked_initialized(
             self, id_platform, guess_effective_cloud_mock, fake_db):
 
-        class FakeRequest(object):
-            def __init__(self, doc):
-                self.request_doc = json.dumps({'payload': doc})
-
         class FakeDB(object):
-            def get_all_complete(self):
-                return []
+            def needs_migration(self):
+                return False
 
-            def get_all_reply(self):
-                return []
+            def close(self):
+                pass
 
-            def get_all_rejected(self):
-                return []
+            def get_command_states(self, command):
+                return [states.ReplyStates.REPLY_NACKED]
 
-            def get_all_ack(self):
-                return []
+            def count_by_state(self):
+                return {states.ReplyStates.REPLY_NACKED: 1}
 
-            def get_all_reply_nacked(self):
-                return [FakeRequest({'command': 'initialize'})]
+            def get_size_info(self):
+                return {"used_size": 4096, "free_pages": 0,
+                        "file_size": 4096}
 
         fake_db.return_value = FakeDB()
         id_platform.return_value = ("ubuntu", "14.04")
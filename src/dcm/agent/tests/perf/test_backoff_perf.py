@@ -0,0 +1,34 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import unittest
+
+import dcm.agent.connection.websocket as websocket
+import dcm.agent.tests.utils.backoff_sim as backoff_sim
+import dcm.agent.tests.utils.general as test_utils
+
+
+class TestReconnectStorm(unittest.TestCase):
+
+    @test_utils.performance_test
+    def test_fleet_reconnect_peak(self):
+        for agents in [1000, 10000]:
+            for strategy in websocket.BackoffStrategy.ALL:
+                r = backoff_sim.simulate(strategy, agents=agents,
+                                         capacity=agents // 20)
+                print("%6d agents %-20s peak %6d attempts/s  attempts %7d  "
+                      "refused %7d  all connected after %7.1fs" % (
+                          r.agents, r.strategy, r.peak_rate, r.attempts,
+                          r.refused, r.all_connected_time))
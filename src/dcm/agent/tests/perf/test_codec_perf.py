@@ -0,0 +1,89 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import json
+import time
+import unittest
+
+import dcm.agent.codec as codec
+import dcm.agent.tests.utils.general as test_utils
+
+
+def _reply_doc(i):
+    return {
+        "type": "REPLY",
+        "request_id": "request-%d" % i,
+        "message_id": "message-%d" % i,
+        "agent_id": "agent-0123456789",
+        "payload": {
+            "reply_type": "void",
+            "reply_object": {
+                "stdout": "line of output\n" * 20,
+                "stderr": "",
+                "return_code": 0,
+                "env": {"PATH": "/usr/bin:/bin", "HOME": "/root"}
+            }
+        }
+    }
+
+
+def _handshake_doc():
+    return {
+        "ipv4": ["10.0.0.%d" % i for i in range(4)],
+        "ipv6": [],
+        "agent_id": "agent-0123456789",
+        "token": "x" * 64,
+        "vm_instance": "i-0123456789abcdef",
+        "injected_id": None,
+        "version": "1.2.3",
+        "protocol_version": 104,
+        "platform": "ubuntu",
+        "platform_version": "14.04",
+        "features": {
+            "message_batching": 65536,
+            "plugins": ["plugin_%d" % i for i in range(60)]
+        }
+    }
+
+
+class TestCodecPerformance(unittest.TestCase):
+
+    def _time(self, func, docs, rounds=20):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for d in docs:
+                func(d)
+        return (time.perf_counter() - start) / (rounds * len(docs))
+
+    def _compare(self, name, docs):
+        data = [json.dumps(d) for d in docs]
+        raw = [d.encode() for d in data]
+        std_dumps = self._time(json.dumps, docs)
+        std_loads = self._time(lambda b: json.loads(b.decode()), raw)
+        fast_dumps = self._time(codec.dumps, docs)
+        fast_loads = self._time(codec.loads, raw)
+        print("%-10s json dumps %6.2fus loads %6.2fus  %s dumps %6.2fus "
+              "loads %6.2fus" % (
+                  name, std_dumps * 1000000.0, std_loads * 1000000.0,
+                  codec.BACKEND, fast_dumps * 1000000.0,
+                  fast_loads * 1000000.0))
+
+    @test_utils.performance_test
+    def test_reply_documents(self):
+        self._compare("reply", [_reply_doc(i) for i in range(1000)])
+
+    @test_utils.performance_test
+    def test_handshake_documents(self):
+        self._compare("handshake", [_handshake_doc() for _ in range(1000)])
@@ -0,0 +1,82 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import threading
+import time
+import unittest
+
+import dcm.agent.events.async_space as async_space
+import dcm.agent.events.callback as events
+import dcm.agent.tests.utils.general as test_utils
+
+
+class TestEventLoopPerformance(unittest.TestCase):
+
+    def _dispatch_latency(self, event_space, count=20000, producers=4):
+        latencies = []
+        done = threading.Event()
+
+        def _callback(sent):
+            latencies.append(time.perf_counter() - sent)
+            if len(latencies) == count:
+                done.set()
+
+        def _producer():
+            for _ in range(count // producers):
+                event_space.register_callback(
+                    _callback, args=[time.perf_counter()])
+
+        threads = [threading.Thread(target=_producer)
+                   for _ in range(producers)]
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        for t in threads:
+            t.start()
+        while not done.is_set():
+            event_space.poll(timeblock=0.05)
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        for t in threads:
+            t.join()
+        event_space.reset()
+
+        latencies.sort()
+        print("%-20s %8.0f callbacks/s  p50 %7.1fus  p99 %7.1fus  "
+              "cpu %5.2fs" % (
+                  type(event_space).__name__, count / wall,
+                  latencies[len(latencies) // 2] * 1000000.0,
+                  latencies[int(len(latencies) * 0.99)] * 1000000.0,
+                  cpu))
+
+    def _idle_cpu(self, event_space, seconds=2.0):
+        event_space.register_callback(lambda: None, delay=seconds * 10)
+        cpu_start = time.process_time()
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            event_space.poll(timeblock=0.5)
+        print("%-20s idle cpu for %.1fs: %.4fs" % (
+            type(event_space).__name__, seconds,
+            time.process_time() - cpu_start))
+        event_space.reset()
+
+    @test_utils.performance_test
+    def test_dispatch_latency(self):
+        self._dispatch_latency(events.EventSpace())
+        self._dispatch_latency(async_space.AsyncEventSpace())
+
+    @test_utils.performance_test
+    def test_idle_cpu(self):
+        self._idle_cpu(events.EventSpace())
+        self._idle_cpu(async_space.AsyncEventSpace())
@@ -0,0 +1,60 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import random
+import time
+import unittest
+
+import dcm.agent.events.callback as events
+import dcm.agent.tests.utils.general as test_utils
+
+
+def _noop():
+    pass
+
+
+class TestEventSpacePerformance(unittest.TestCase):
+
+    def _schedule_and_cancel(self, pending):
+        event_space = events.EventSpace()
+        rand = random.Random(pending)
+        delays = [rand.uniform(1.0, 3600.0) for _ in range(pending)]
+
+        start = time.perf_counter()
+        handles = [event_space.register_callback(_noop, delay=d)
+                   for d in delays]
+        schedule_time = time.perf_counter() - start
+
+        rand.shuffle(handles)
+        start = time.perf_counter()
+        for ub in handles:
+            event_space.cancel_callback(ub)
+        cancel_time = time.perf_counter() - start
+
+        self.assertFalse(event_space.poll(timeblock=0.0))
+        print("%8d pending timers: schedule %10.0f ops/s  cancel %10.0f ops/s"
+              % (pending, pending / schedule_time, pending / cancel_time))
+
+    @test_utils.performance_test
+    def test_schedule_cancel_10k(self):
+        self._schedule_and_cancel(10000)
+
+    @test_utils.performance_test
+    def test_schedule_cancel_100k(self):
+        self._schedule_and_cancel(100000)
+
+    @test_utils.performance_test
+    def test_schedule_cancel_1m(self):
+        self._schedule_and_cancel(1000000)
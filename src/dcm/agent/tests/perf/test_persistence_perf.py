@@ -0,0 +1,216 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import datetime
+import os
+import tempfile
+import time
+import unittest
+import uuid
+
+import dcm.agent.codec as codec
+import dcm.agent.messaging.persistence as persistence
+import dcm.agent.messaging.states as states
+import dcm.agent.tests.utils.general as test_utils
+
+
+class TestGroupCommitPerformance(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for f in os.listdir(self.tmp_dir):
+            os.remove(os.path.join(self.tmp_dir, f))
+        os.rmdir(self.tmp_dir)
+
+    def _run_requests(self, interval, count=500):
+        db = persistence.SQLiteAgentDB(
+            os.path.join(self.tmp_dir, str(uuid.uuid4())), journal_mode="WAL")
+        if interval:
+            db.start_group_commit(interval)
+        try:
+            start = time.perf_counter()
+            for _ in range(count):
+                # the same writes a ReplyRPC makes for a successful request
+                request_id = str(uuid.uuid4())
+                db.new_record(request_id, {"request_id": request_id}, None,
+                              states.ReplyStates.ACKED, "AGENT_ID")
+                db.flush()
+                db.update_record(request_id, states.ReplyStates.REPLY,
+                                 reply_doc={"return_code": 0})
+                db.update_record(request_id, states.ReplyStates.REPLY_ACKED)
+            elapsed = time.perf_counter() - start
+        finally:
+            db.stop_group_commit()
+        stats = db.get_commit_stats()
+        print("group commit interval %-6s %d requests: %8.1f us per request "
+              "%d commits" % (interval, count, elapsed * 1000000.0 / count,
+                              stats["commits"]))
+        return elapsed
+
+    @test_utils.performance_test
+    def test_group_commit_request_writes(self):
+        immediate = self._run_requests(0)
+        grouped = self._run_requests(0.005)
+        self.assertLess(grouped, immediate)
+
+
+class TestDBScalePerformance(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for f in os.listdir(self.tmp_dir):
+            os.remove(os.path.join(self.tmp_dir, f))
+        os.rmdir(self.tmp_dir)
+
+    def _fill(self, db, count, active=100, expired=100):
+        # most rows are finished requests, a few are still in flight and a
+        # few are old enough for the sweeper
+        old = datetime.datetime.now() - datetime.timedelta(days=1)
+        now = datetime.datetime.now()
+        rows = []
+        for i in range(count):
+            if i < active:
+                state = states.ReplyStates.ACKED
+            else:
+                state = states.ReplyStates.REPLY_ACKED
+            tm = old if i >= count - expired else now
+            rows.append(("req-%d" % i, tm, '{"request_id": "req-%d"}' % i,
+                         None, state, "AGENT_ID", tm, "heartbeat"))
+        db._db_conn.executemany(persistence._g_insert_request, rows)
+        db._db_conn.commit()
+
+    def _time(self, func, count=1):
+        start = time.perf_counter()
+        for i in range(count):
+            func(i)
+        return (time.perf_counter() - start) * 1000000.0 / count
+
+    def _run_at_scale(self, count):
+        db = persistence.SQLiteAgentDB(
+            os.path.join(self.tmp_dir, "scale-%d" % count),
+            journal_mode="WAL")
+        try:
+            self._fill(db, count)
+            cut_off = datetime.datetime.now() - datetime.timedelta(hours=1)
+            results = [
+                ("lookup_req", self._time(
+                    lambda i: db.lookup_req("req-%d" % (i * 7 % count)),
+                    1000)),
+                ("get_all_ack", self._time(lambda i: db.get_all_ack(), 10)),
+                ("update_record", self._time(
+                    lambda i: db.update_record(
+                        "req-%d" % (i + 200), states.ReplyStates.REPLY_ACKED),
+                    100)),
+                ("starting_agent", self._time(
+                    lambda i: db.starting_agent(), 1)),
+                ("clean_all_expired", self._time(
+                    lambda i: db.clean_all_expired(cut_off), 1)),
+            ]
+        finally:
+            db.close()
+        for name, us in results:
+            print("%8d rows %-18s %10.1f us" % (count, name, us))
+        return dict(results)
+
+    @test_utils.performance_test
+    def test_db_operations_at_scale(self):
+        small = self._run_at_scale(10000)
+        self._run_at_scale(100000)
+        large = self._run_at_scale(1000000)
+        # with the indexes none of these walk the whole table, so 100 times
+        # the rows must cost far less than 100 times the time
+        for name in ["lookup_req", "get_all_ack", "starting_agent",
+                     "clean_all_expired"]:
+            self.assertLess(large[name], small[name] * 20)
+
+    def _old_status(self, db):
+        # what dcm-agent --status used to do
+        found = []
+        for get_all in [db.get_all_complete, db.get_all_ack,
+                        db.get_all_reply, db.get_all_reply_nacked,
+                        db.get_all_rejected]:
+            for r in get_all():
+                doc = codec.loads(r.request_doc)
+                if doc.get("payload", {}).get("command") == "initialize":
+                    found.append(r.state)
+        return found
+
+    def _new_status(self, db):
+        db.get_command_states("initialize")
+        return db.count_by_state()
+
+    @test_utils.performance_test
+    def test_status_queries(self):
+        db = persistence.SQLiteAgentDB(os.path.join(self.tmp_dir, "status"),
+                                       journal_mode="WAL")
+        try:
+            self._fill(db, 100000)
+            old = self._time(lambda i: self._old_status(db))
+            new = self._time(lambda i: self._new_status(db))
+        finally:
+            db.close()
+        print("status of 100000 rows: loading every row %.1f ms, aggregate "
+              "queries %.1f ms" % (old / 1000.0, new / 1000.0))
+        self.assertLess(new, old)
+
+    def _longest_hold(self, db, func):
+        # the longest that any single DB call made by func held the lock
+        longest = [0.0]
+        real_execute = db._execute
+
+        def _timed_execute(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return real_execute(*args, **kwargs)
+            finally:
+                longest[0] = max(longest[0], time.perf_counter() - start)
+        db._execute = _timed_execute
+        try:
+            start = time.perf_counter()
+            func()
+            return longest[0], time.perf_counter() - start
+        finally:
+            db._execute = real_execute
+
+    @test_utils.performance_test
+    def test_sweeper_lock_hold(self):
+        count = 100000
+        results = {}
+        for name in ["single delete", "chunked sweep"]:
+            db = persistence.SQLiteAgentDB(
+                os.path.join(self.tmp_dir, name.replace(" ", "_")),
+                journal_mode="WAL")
+            try:
+                self._fill(db, count, expired=count // 2)
+                cut_off = datetime.datetime.now() - datetime.timedelta(
+                    hours=1)
+                if name == "single delete":
+                    func = lambda: db.clean_all_expired(cut_off)
+                else:
+                    cleaner = persistence.DBCleaner(
+                        db, 3600, 0, 60, chunk_pause=0)
+                    func = cleaner.sweep
+                longest, total = self._longest_hold(db, func)
+            finally:
+                db.close()
+            results[name] = longest
+            print("%-14s %d expired of %d rows: longest lock hold %7.1f ms, "
+                  "total %7.1f ms" % (name, count // 2, count,
+                                      longest * 1000.0, total * 1000.0))
+        self.assertLess(results["chunked sweep"], results["single delete"])
@@ -0,0 +1,73 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import time
+import tracemalloc
+import unittest
+
+import mock
+
+import dcm.agent.events.state_machine as state_machine
+import dcm.agent.messaging.reply as reply
+import dcm.agent.messaging.states as states
+import dcm.agent.tests.utils.general as test_utils
+
+
+class _PerInstanceReplyRPC(reply.ReplyRPC):
+    """
+    A ReplyRPC that builds its own copy of the transition graph out of bound
+    methods, the way every state machine used to be set up.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(_PerInstanceReplyRPC, self).__init__(*args, **kwargs)
+        sm = state_machine.StateMachine(states.ReplyStates.REQUESTING)
+        state_map = self._transitions.get_state_map()
+        for state, events in state_map.items():
+            for event, (new_state, func_name) in events.items():
+                func = None
+                if func_name is not None:
+                    func = getattr(self, func_name)
+                sm.add_transition(state, event, new_state, func)
+        self._sm = sm
+
+
+class TestReplyRPCPerformance(unittest.TestCase):
+
+    def _measure(self, cls, count=10000):
+        conn = mock.Mock()
+        listener = mock.Mock()
+        db = mock.Mock()
+        docs = [{"request_id": str(i)} for i in range(count)]
+
+        tracemalloc.start()
+        start_mem = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        rpcs = [cls(listener, "AGENT_ID", conn, str(i), docs[i], db)
+                for i in range(count)]
+        elapsed = time.perf_counter() - start
+        used = tracemalloc.get_traced_memory()[0] - start_mem
+        tracemalloc.stop()
+
+        print("%-22s %d objects: %7.1f us and %6d bytes per request" % (
+            cls.__name__, len(rpcs), elapsed * 1000000.0 / count,
+            used // count))
+        return used
+
+    @test_utils.performance_test
+    def test_construct_10k_reply_rpc(self):
+        per_instance = self._measure(_PerInstanceReplyRPC)
+        shared = self._measure(reply.ReplyRPC)
+        self.assertLess(shared, per_instance)
@@ -0,0 +1,74 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import shutil
+import ssl
+import tempfile
+import time
+import unittest
+
+import mock
+
+import dcm.agent.connection.stats as conn_stats
+import dcm.agent.connection.tls as tls
+import dcm.agent.connection.websocket as websocket
+import dcm.agent.tests.utils.general as test_utils
+import dcm.agent.tests.utils.ws_server as ws_server
+
+
+@unittest.skipIf(not ws_server.openssl_available(),
+                 "The openssl command is needed to make a certificate")
+class TestTLSResumePerformance(unittest.TestCase):
+
+    count = 200
+
+    def setUp(self):
+        self.cert_dir = tempfile.mkdtemp()
+        self.cert_file, key_file = ws_server.make_self_signed_cert(
+            self.cert_dir)
+        server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        server_context.load_cert_chain(self.cert_file, key_file)
+        self.server = ws_server.LocalWsServer(
+            ssl_context=server_context).start()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.cert_dir)
+
+    def _connect_time(self, resume):
+        connector = tls.TLSConnector(ca_certs=self.cert_file,
+                                     resume_sessions=resume)
+        stats = conn_stats.ConnectionStats()
+        times = []
+        for _ in range(self.count):
+            ws = websocket._WebSocketClient(
+                mock.Mock(), self.server.get_url(), None, stats=stats,
+                tls_connector=connector)
+            start = time.perf_counter()
+            ws.connect()
+            times.append(time.perf_counter() - start)
+            ws.close()
+            ws.run_forever()
+        times.sort()
+        return (sum(times) / len(times), times[len(times) // 2],
+                stats.get_stats()["tls_resumed"])
+
+    @test_utils.performance_test
+    def test_full_vs_resumed_handshake(self):
+        for name, resume in (("full", False), ("resumed", True)):
+            mean, median, resumed = self._connect_time(resume)
+            print("%-8s mean %7.3fms  median %7.3fms  %d/%d resumed" % (
+                name, mean * 1000.0, median * 1000.0, resumed,
+                self.count))
@@ -0,0 +1,82 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import threading
+import time
+import unittest
+
+import mock
+
+import dcm.agent.connection.async_websocket as async_websocket
+import dcm.agent.connection.websocket as websocket
+import dcm.agent.events.globals as event_globals
+import dcm.agent.handshake as handshake
+import dcm.agent.tests.utils.general as test_utils
+import dcm.agent.tests.utils.ws_server as ws_server
+
+
+class TestWebSocketTransportPerformance(unittest.TestCase):
+
+    count = 20000
+
+    def setUp(self):
+        event_globals.global_space.reset()
+        self.server = ws_server.LocalWsServer().start()
+        self.hs_manager = mock.Mock()
+        self.hs_manager.get_send_document.return_value = {"type": "HS"}
+        self.hs_manager.incoming_document.return_value = \
+            handshake.HandshakeIncomingReply(
+                handshake.HandshakeIncomingReply.REPLY_CODE_SUCCESS,
+                message_batching=65536)
+
+    def tearDown(self):
+        self.server.stop()
+        event_globals.global_space.reset()
+        event_globals.set_event_space_type(
+            event_globals.EventSpaceTypes.THREADED)
+
+    def _run(self, name, conn):
+        threads = threading.active_count()
+        conn.connect(lambda doc: None, self.hs_manager)
+        docs = [{"type": "LOG", "message": "msg %d" % i}
+                for i in range(self.count)]
+
+        start = time.perf_counter()
+        for d in docs:
+            conn.send(d)
+        end = time.monotonic() + 60.0
+        while len(self.server.received) < self.count and \
+                time.monotonic() < end:
+            event_globals.global_space.poll(timeblock=0.01)
+        elapsed = time.perf_counter() - start
+        extra_threads = threading.active_count() - threads
+        conn.close()
+        event_globals.global_space.poll(timeblock=0.1)
+
+        self.assertEqual(len(self.server.received), self.count)
+        print("%-9s %8.0f messages/s  %d extra threads" % (
+            name, self.count / elapsed, extra_threads))
+
+    @test_utils.performance_test
+    def test_threaded_transport(self):
+        self._run("ws", websocket.WebSocketConnection(
+            self.server.get_url(), batch_max_bytes=65536))
+
+    @test_utils.performance_test
+    def test_asyncio_transport(self):
+        event_globals.set_event_space_type(
+            event_globals.EventSpaceTypes.ASYNCIO)
+        self._run("ws_async", async_websocket.AsyncWebSocketConnection(
+            self.server.get_url(), batch_max_bytes=65536))
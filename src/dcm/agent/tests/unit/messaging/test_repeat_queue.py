@@ -13,9 +13,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+import json
+import queue
+import threading
+import time
 import unittest
 
+import mock
+
 import dcm.agent.connection.websocket as websocket
+import dcm.agent.exceptions as exceptions
 
 
 class TestRequesterStandardPath(unittest.TestCase):
@@ -59,3 +66,101 @@ class TestRequesterStandardPath(unittest.TestCase):
                 break
 
         self.assertEqual(count_back, max_id)
+
+    def test_request_complete_resets_the_count(self):
+        msg = {'request_id': 'sdfsfsfsd'}
+        max_id = 5
+        q = websocket.RepeatQueue(max_req_id=max_id)
+        for i in range(max_id):
+            self.assertTrue(q.put(msg))
+        self.assertFalse(q.put(msg))
+        q.request_complete('sdfsfsfsd')
+        self.assertTrue(q.put(msg))
+        self.assertEqual(q.get_stats()['tracked_requests'], 1)
+        q.request_complete('sdfsfsfsd')
+        self.assertEqual(q.get_stats()['tracked_requests'], 0)
+
+    def test_tracking_is_bounded(self):
+        q = websocket.RepeatQueue(max_message_ids=10,
+                                  max_tracked_requests=10)
+        for i in range(100):
+            q.put({'message_id': i, 'request_id': i})
+        stats = q.get_stats()
+        self.assertEqual(stats['length'], 100)
+        self.assertEqual(stats['tracked_message_ids'], 10)
+        self.assertEqual(stats['tracked_requests'], 10)
+
+    def test_message_id_can_repeat_after_it_is_sent(self):
+        msg = {'message_id': 'sdfsfsfsd'}
+        q = websocket.RepeatQueue()
+        self.assertTrue(q.put(msg))
+        q.get()
+        self.assertTrue(q.put(msg))
+
+    def test_get_empty_raises(self):
+        q = websocket.RepeatQueue()
+        self.assertRaises(queue.Empty, q.get, block=False)
+        self.assertRaises(queue.Empty, q.get, timeout=0.01)
+
+    def test_get_does_not_block_writers(self):
+        q = websocket.RepeatQueue()
+        result = []
+
+        def _reader():
+            result.append(q.get(timeout=5.0))
+
+        t = threading.Thread(target=_reader)
+        t.start()
+        time.sleep(0.05)
+        q.put("hello")
+        t.join(5.0)
+        self.assertEqual(result, ["hello"])
+
+    def test_drop_oldest_on_overflow(self):
+        docs = [{'n': i, 'data': 'x' * 20} for i in range(10)]
+        size = len(json.dumps(docs[0]))
+        q = websocket.RepeatQueue(max_bytes=size * 3)
+        for d in docs:
+            self.assertTrue(q.put(d))
+        self.assertEqual(q.get_all(), docs[-3:])
+        stats = q.get_stats()
+        self.assertEqual(stats['dropped'], 7)
+        self.assertEqual(stats['bytes'], 0)
+
+    def test_drop_newest_on_overflow(self):
+        docs = [{'n': i, 'data': 'x' * 20} for i in range(10)]
+        size = len(json.dumps(docs[0]))
+        q = websocket.RepeatQueue(
+            max_bytes=size * 3,
+            overflow=websocket.SendQueueOverflow.DROP_NEWEST)
+        for d in docs[:3]:
+            self.assertTrue(q.put(d))
+        for d in docs[3:]:
+            self.assertFalse(q.put(d))
+        self.assertEqual(q.get_all(), docs[:3])
+        self.assertEqual(q.get_stats()['dropped'], 7)
+
+    def test_message_too_big_is_dropped(self):
+        q = websocket.RepeatQueue(max_bytes=10)
+        self.assertFalse(q.put({'data': 'x' * 20}))
+        self.assertTrue(q.empty())
+
+    def test_documents_are_encoded_once(self):
+        docs = [{'n': i} for i in range(3)]
+        q = websocket.RepeatQueue(max_bytes=1024)
+        with mock.patch.object(websocket.codec, "dumps",
+                               wraps=websocket.codec.dumps) as dumps:
+            for d in docs:
+                q.put(d)
+            entries = q.get_all_encoded()
+            for d, msg in entries:
+                q.put(d, encoded=msg)
+            frames = list(websocket.encode_messages(
+                [msg for _, msg in q.get_all_encoded()], batch_limit=1024))
+        self.assertEqual(dumps.call_count, 3)
+        self.assertEqual(entries, websocket.encode_documents(docs))
+        self.assertEqual(json.loads(frames[0][0])['messages'], docs)
+
+    def test_bad_overflow_policy(self):
+        self.assertRaises(exceptions.AgentOptionValueException,
+                          websocket.RepeatQueue, overflow="nope")
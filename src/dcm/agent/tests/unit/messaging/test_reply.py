@@ -20,6 +20,7 @@ import dcm.agent.config as config
 import dcm.agent.exceptions as exceptions
 import dcm.agent.messaging.persistence as persistence
 import dcm.agent.messaging.reply as reply
+import dcm.agent.messaging.states as states
 import dcm.agent.messaging.types as types
 import dcm.agent.tests.utils.general as test_utils
 
@@ -333,3 +334,113 @@ class TestRequestListener(unittest.TestCase):
         send_doc = param_list[0]
         self.assertTrue('type' in send_doc)
         self.assertEqual(send_doc['type'], types.MessageTypes.NACK)
+
+
+class TestReplyDurability(unittest.TestCase):
+
+    def setUp(self):
+        self.parent = mock.Mock()
+        self.db = self.parent.db
+        self.conn = self.parent.conn
+        self.request_id = "requestID"
+
+    def _new_rpc(self, durability, memory_db=None):
+        return reply.ReplyRPC(
+            mock.Mock(), "AGENT_ID", self.conn, self.request_id,
+            {"request_id": self.request_id}, self.db,
+            durability=durability, memory_db=memory_db)
+
+    def _call_names(self):
+        return [c[0] for c in self.parent.mock_calls]
+
+    def test_strict_flushes_before_ack(self):
+        rpc = self._new_rpc(persistence.Durability.STRICT)
+        rpc.ack(None, None, None)
+        self.assertEqual(self._call_names(),
+                         ["db.new_record", "db.flush", "conn.send"])
+
+    def test_strict_flushes_before_nack(self):
+        rpc = self._new_rpc(persistence.Durability.STRICT)
+        rpc.nak({})
+        self.assertEqual(self._call_names(),
+                         ["db.new_record", "db.flush", "conn.send"])
+
+    def test_relaxed_does_not_wait(self):
+        rpc = self._new_rpc(persistence.Durability.RELAXED)
+        rpc.ack(None, None, None)
+        rpc.reply({"reply": "payload"})
+        self.assertNotIn("db.flush", self._call_names())
+        self.assertEqual(self.db.new_record.call_count, 1)
+        self.assertEqual(self.db.update_record.call_count, 1)
+        rpc.kill()
+
+    def test_ephemeral_never_uses_db(self):
+        memory_db = persistence.MemoryRecordStore()
+        rpc = self._new_rpc(persistence.Durability.EPHEMERAL,
+                            memory_db=memory_db)
+        rpc.ack(None, None, None)
+        rpc.reply({"reply": "payload"})
+        rpc.incoming_message({"type": types.MessageTypes.ACK,
+                              "request_id": self.request_id,
+                              "message_id": "messageID"})
+        self.assertEqual(self.db.mock_calls, [])
+        self.assertEqual(memory_db.lookup_req(self.request_id).state,
+                         states.ReplyStates.REPLY_ACKED)
+
+    def test_set_durability_before_ack(self):
+        rpc = self._new_rpc(persistence.Durability.STRICT)
+        rpc.set_durability(persistence.Durability.EPHEMERAL)
+        rpc.ack(None, None, None)
+        self.assertEqual(self.db.mock_calls, [])
+        self.assertEqual(rpc.get_durability(),
+                         persistence.Durability.EPHEMERAL)
+
+    def test_unknown_durability_is_strict(self):
+        rpc = self._new_rpc("sometimes")
+        self.assertEqual(rpc.get_durability(),
+                         persistence.Durability.STRICT)
+
+
+class TestRequestListenerDurability(unittest.TestCase):
+
+    def setUp(self):
+        self.db = persistence.SQLiteAgentDB(":memory:")
+        self.conf = config.AgentConfig([])
+        self.conn = mock.Mock()
+        self.disp = mock.Mock()
+        self.request_id = "requestID"
+        self.request_doc = {
+            'type': types.MessageTypes.REQUEST,
+            'request_id': self.request_id,
+            'message_id': "messageID",
+            'payload': {}
+        }
+
+        def _incoming_request(req):
+            req.set_durability(persistence.Durability.EPHEMERAL)
+            req.ack(None, None, None)
+        self.disp.incoming_request.side_effect = _incoming_request
+
+    def tearDown(self):
+        dcm_events.reset()
+
+    def test_ephemeral_retransmission_from_memory(self):
+        listener = reply.RequestListener(
+            self.conf, self.conn, self.disp, self.db)
+        listener.incoming_parent_q_message(self.request_doc)
+        listener.reply(self.request_id, {"reply": "payload"})
+        listener.incoming_parent_q_message(
+            {"type": types.MessageTypes.ACK,
+             "request_id": self.request_id,
+             "message_id": "messageID2"})
+        self.assertFalse(listener.is_busy())
+        self.assertIsNone(self.db.lookup_req(self.request_id))
+
+        # the retransmitted request is answered with a reply and is not
+        # run again
+        listener.incoming_parent_q_message(self.request_doc)
+        self.assertEqual(self.disp.incoming_request.call_count, 1)
+        (param_list, keywords) = self.conn.send.call_args
+        self.assertEqual(param_list[0]['type'], types.MessageTypes.REPLY)
+        self.assertIsNone(self.db.lookup_req(self.request_id))
+        listener.shutdown()
@@ -0,0 +1,157 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import threading
+import time
+import unittest
+
+import dcm.agent.events.async_space as async_space
+import dcm.agent.events.callback as events
+import dcm.agent.events.globals as event_globals
+import dcm.agent.tests.utils.general as test_utils
+
+
+class TestAsyncEventSpace(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        test_utils.connect_to_debugger()
+
+    def setUp(self):
+        self.event_space = async_space.AsyncEventSpace()
+
+    def tearDown(self):
+        self.event_space.reset()
+
+    def test_simple_callback(self):
+        y_val = []
+
+        def test_callback(x_param, apple_param=None):
+            y_val.append((x_param, apple_param))
+
+        ub = self.event_space.register_callback(
+            test_callback, args=[1], kwargs={'apple_param': "sauce"})
+        self.assertTrue(self.event_space.poll(timeblock=0.0))
+        self.assertEqual(y_val, [(1, "sauce")])
+        self.assertTrue(ub.has_run())
+
+    def test_callback_delay(self):
+        x_val = []
+        d = 0.1
+        start = time.monotonic()
+        self.event_space.register_callback(
+            x_val.append, args=[2], delay=d)
+        self.event_space.register_callback(x_val.append, args=[1])
+        self.event_space.poll(timeblock=d * 2.0)
+        self.assertEqual(x_val, [1, 2])
+        self.assertGreaterEqual(time.monotonic() - start, d)
+
+    def test_cancel_a_callback(self):
+        x_val = []
+        ub = self.event_space.register_callback(
+            x_val.append, args=[1], delay=0.1)
+
+        def cancel_it():
+            self.assertTrue(self.event_space.cancel_callback(ub))
+
+        self.event_space.register_callback(cancel_it)
+        self.event_space.poll(timeblock=0.2)
+        self.assertEqual(x_val, [])
+        self.assertEqual(self.event_space.get_pending_count(), 0)
+
+    def test_register_from_another_thread(self):
+        param = []
+
+        def register_new_callback():
+            time.sleep(0.05)
+            self.event_space.register_callback(param.append, args=[1])
+
+        t = threading.Thread(target=register_new_callback)
+        t.start()
+        self.event_space.poll(timeblock=0.2)
+        t.join()
+        self.assertEqual(param, [1])
+
+    def test_in_thread_callback(self):
+        threads = []
+
+        def test_callback():
+            threads.append(threading.current_thread())
+
+        ub = self.event_space.register_callback(test_callback,
+                                                in_thread=True)
+        self.event_space.poll(timeblock=0.0)
+        ub.join()
+        self.assertNotEqual(threads[0], threading.current_thread())
+
+    def test_in_thread_callback_retried_when_pool_full(self):
+        self.event_space.configure_thread_pool(max_threads=1, max_queue=0)
+        release = threading.Event()
+        connected = threading.Event()
+        self.event_space.register_callback(release.wait, in_thread=True)
+        ub = self.event_space.register_callback(connected.set,
+                                                in_thread=True)
+        self.event_space.poll(timeblock=0.0)
+        self.assertFalse(connected.is_set())
+
+        threading.Timer(0.1, release.set).start()
+        self.event_space.poll(timeblock=0.5)
+        ub.join()
+        self.assertTrue(connected.is_set())
+        self.assertIsNone(ub.get_exception())
+
+    def test_stop(self):
+        x_val = []
+        self.event_space.register_callback(x_val.append, args=[1],
+                                           delay=0.05)
+        self.event_space.stop()
+        self.assertFalse(self.event_space.poll(timeblock=0.1))
+        self.assertEqual(x_val, [])
+
+    def test_coalesced_debounce(self):
+        calls = []
+        for i in range(3):
+            self.event_space.register_coalesced(
+                "key", calls.append, args=[i], delay=0.05, debounce=True)
+            time.sleep(0.01)
+        self.assertEqual(self.event_space.get_pending_count(), 1)
+        self.event_space.poll(timeblock=0.2)
+        self.assertEqual(calls, [2])
+
+
+class TestGlobalEventSpaceType(unittest.TestCase):
+
+    def setUp(self):
+        event_globals.global_space.reset()
+
+    def tearDown(self):
+        event_globals.set_event_space_type(
+            event_globals.EventSpaceTypes.THREADED)
+
+    def test_switch_to_asyncio(self):
+        event_globals.set_event_space_type(
+            event_globals.EventSpaceTypes.ASYNCIO)
+        self.assertIsInstance(event_globals.global_space.get_space(),
+                              async_space.AsyncEventSpace)
+        x_val = []
+        event_globals.global_space.register_callback(x_val.append,
+                                                     args=[1])
+        event_globals.global_space.poll(timeblock=0.0)
+        self.assertEqual(x_val, [1])
+
+        event_globals.set_event_space_type(
+            event_globals.EventSpaceTypes.THREADED)
+        self.assertIsInstance(event_globals.global_space.get_space(),
+                              events.EventSpace)
@@ -0,0 +1,204 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import asyncio
+import socket
+import ssl
+import time
+import unittest
+
+import mock
+
+import dcm.agent.connection.async_websocket as async_websocket
+import dcm.agent.connection.websocket as websocket
+import dcm.agent.events.globals as event_globals
+import dcm.agent.exceptions as exceptions
+import dcm.agent.handshake as handshake
+import dcm.agent.tests.utils.general as test_utils
+import dcm.agent.tests.utils.ws_server as ws_server
+
+
+class TestAsyncWebSocketConnection(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        test_utils.connect_to_debugger()
+
+    def setUp(self):
+        event_globals.global_space.reset()
+        event_globals.set_event_space_type(
+            event_globals.EventSpaceTypes.ASYNCIO)
+        self.server = ws_server.LocalWsServer().start()
+        self.incoming = []
+        self.hs_manager = mock.Mock()
+        self.hs_manager.get_send_document.return_value = {"type": "HS"}
+        self.hs_manager.incoming_document.return_value = \
+            handshake.HandshakeIncomingReply(
+                handshake.HandshakeIncomingReply.REPLY_CODE_SUCCESS)
+        self.conn = None
+
+    def tearDown(self):
+        if self.conn is not None:
+            self.conn.close()
+            event_globals.global_space.poll(timeblock=0.1)
+        self.server.stop()
+        event_globals.global_space.reset()
+        event_globals.set_event_space_type(
+            event_globals.EventSpaceTypes.THREADED)
+
+    def _connect(self, **kwargs):
+        self.conn = async_websocket.AsyncWebSocketConnection(
+            self.server.get_url(), backoff_amount=10, max_backoff=100,
+            **kwargs)
+        self.conn.connect(self.incoming.append, self.hs_manager)
+
+    def _poll_until(self, check, timeout=10.0):
+        end = time.monotonic() + timeout
+        while not check():
+            if time.monotonic() > end:
+                return False
+            event_globals.global_space.poll(timeblock=0.02)
+        return True
+
+    def test_handshake_and_send(self):
+        self._connect()
+        self.assertTrue(self._poll_until(self.conn.is_open))
+        self.assertEqual(self.server.handshakes, [{"type": "HS"}])
+        docs = [{"type": "LOG", "message": "msg %d" % i} for i in range(5)]
+        for d in docs:
+            self.conn.send(d)
+        self.assertTrue(self._poll_until(
+            lambda: len(self.server.received) >= 5))
+        self.assertEqual(self.server.received, docs)
+
+    def test_send_before_open_is_queued(self):
+        self._connect()
+        self.conn.send({"type": "LOG", "message": "early"})
+        self.assertTrue(self._poll_until(
+            lambda: len(self.server.received) >= 1))
+        self.assertEqual(self.server.received[0]["message"], "early")
+
+    def test_batched_and_compressed(self):
+        self.hs_manager.incoming_document.return_value = \
+            handshake.HandshakeIncomingReply(
+                handshake.HandshakeIncomingReply.REPLY_CODE_SUCCESS,
+                message_batching=65536,
+                message_compression=handshake.COMPRESSION_ZLIB)
+        self._connect(batch_max_bytes=65536, compression_level=6,
+                      compression_threshold=64)
+        docs = [{"type": "LOG", "message": "msg %d" % i} for i in range(50)]
+        for d in docs:
+            self.conn.send(d)
+        self.assertTrue(self._poll_until(
+            lambda: len(self.server.received) >= 50))
+        self.assertEqual(self.server.received, docs)
+
+    def test_incoming_documents(self):
+        self._connect()
+        self.assertTrue(self._poll_until(self.conn.is_open))
+        self.server.send({"type": "CMD", "request_id": "r1"})
+        self.assertTrue(self._poll_until(lambda: len(self.incoming) >= 1))
+        self.assertEqual(self.incoming[0]["request_id"], "r1")
+
+    def test_reconnect_after_drop(self):
+        self._connect()
+        self.assertTrue(self._poll_until(self.conn.is_open))
+        self.server.drop_clients()
+        self.assertTrue(self._poll_until(
+            lambda: self.server.connections >= 2 and self.conn.is_open()))
+        self.conn.send({"type": "LOG", "message": "after"})
+        self.assertTrue(self._poll_until(
+            lambda: len(self.server.received) >= 1))
+        self.assertEqual(len(self.server.handshakes), 2)
+
+    def test_rejected_handshake_retries(self):
+        self.hs_manager.incoming_document.return_value = \
+            handshake.HandshakeIncomingReply(
+                handshake.HandshakeIncomingReply.REPLY_CODE_BAD_TOKEN)
+        self._connect()
+        self.assertTrue(self._poll_until(
+            lambda: len(self.server.handshakes) >= 2))
+        self.assertFalse(self.conn.is_open())
+
+    def test_connection_stats(self):
+        self._connect(ping_interval=0.05)
+        self.assertTrue(self._poll_until(
+            lambda: self.conn.get_connection_stats()["rtt"]["count"] > 0))
+        self.conn.send({"type": "LOG"})
+        self.assertTrue(self._poll_until(
+            lambda: len(self.server.received) >= 1))
+        s = self.conn.get_connection_stats()
+        self.assertEqual(s["state"], websocket.WsConnStates.OPEN)
+        self.assertEqual(s["connects"], 1)
+        self.assertGreaterEqual(s["frames_out"], 2)
+        self.assertGreaterEqual(s["frames_in"], 1)
+        self.assertIsNotNone(s["smoothed_rtt"])
+
+    def test_fails_over_to_the_next_endpoint(self):
+        dead = ws_server.LocalWsServer().start()
+        dead_url = dead.get_url()
+        dead.stop()
+        self.conn = async_websocket.AsyncWebSocketConnection(
+            ",".join([dead_url, self.server.get_url()]),
+            backoff_amount=60000, max_backoff=600000)
+        self.conn.connect(self.incoming.append, self.hs_manager)
+        self.assertTrue(self._poll_until(self.conn.is_open))
+        self.assertEqual(self.conn.get_connection_stats()["url"],
+                         self.server.get_url())
+
+    def test_needs_the_asyncio_space(self):
+        event_globals.set_event_space_type(
+            event_globals.EventSpaceTypes.THREADED)
+        conn = async_websocket.AsyncWebSocketConnection(
+            self.server.get_url())
+        self.assertRaises(exceptions.AgentOptionValueException,
+                          conn.connect, self.incoming.append,
+                          self.hs_manager)
+
+
+class TestAsyncWebSocketConnect(unittest.TestCase):
+
+    def test_tls_policy_matches_the_threaded_connection(self):
+        conn = async_websocket.AsyncWebSocketConnection(
+            "wss://localhost/ws")
+        context = conn._tls_connector.get_context()
+        self.assertFalse(context.check_hostname)
+        self.assertEqual(context.verify_mode, ssl.CERT_REQUIRED)
+
+        conn = async_websocket.AsyncWebSocketConnection(
+            "wss://localhost/ws", allow_unknown_certs=True)
+        context = conn._tls_connector.get_context()
+        self.assertEqual(context.verify_mode, ssl.CERT_NONE)
+
+    def test_stalled_upgrade_times_out(self):
+        # the listening socket accepts the TCP connection into its backlog
+        # but never answers the upgrade
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        loop = asyncio.new_event_loop()
+        try:
+            conn = async_websocket.AsyncWebSocketConnection(
+                "ws://127.0.0.1:%d/ws" % listener.getsockname()[1],
+                connect_timeout=0.2)
+            start = time.monotonic()
+            self.assertRaises(asyncio.TimeoutError,
+                              loop.run_until_complete, conn._connect())
+            self.assertLess(time.monotonic() - start, 5.0)
+            self.assertEqual(conn.get_connection_stats()["state"],
+                             websocket.WsConnStates.WAITING)
+        finally:
+            loop.close()
+            listener.close()
@@ -16,11 +16,14 @@
 import datetime
 import math
 import mock
+import random
 import time
 import unittest
 
 import dcm.agent.connection.websocket as websocket
+import dcm.agent.exceptions as exceptions
 import dcm.agent.handshake as handshake
+import dcm.agent.tests.utils.backoff_sim as backoff_sim
 import dcm.agent.tests.utils.general as test_utils
 
 from dcm.agent.events.globals import global_space as dcm_events
@@ -225,3 +228,70 @@ class TestBackoff(unittest.TestCase):
         self.assertFalse(backoff.ready())
         backoff.activity()
         self.assertTrue(backoff.ready())
+
+
+class TestBackoffStrategies(unittest.TestCase):
+
+    def _waits(self, strategy, count=20, initial=1.0, max_backoff=60.0):
+        clock = backoff_sim.SimulatedClock()
+        backoff = websocket.Backoff(max_backoff,
+                                    initial_backoff_second=initial,
+                                    strategy=strategy, clock=clock,
+                                    rng=random.Random(1))
+        waits = []
+        for _ in range(count):
+            backoff.error()
+            wait = backoff.seconds_until_ready()
+            waits.append(wait)
+            clock.now += wait
+        return waits
+
+    def test_exponential_doubles(self):
+        waits = self._waits(websocket.BackoffStrategy.EXPONENTIAL, count=7)
+        self.assertEqual(waits, [2.0, 4.0, 8.0, 16.0, 32.0, 60.0, 60.0])
+
+    def test_full_jitter_is_bounded(self):
+        waits = self._waits(websocket.BackoffStrategy.FULL_JITTER)
+        ceiling = 1.0
+        for w in waits:
+            ceiling = min(60.0, ceiling * 2.0)
+            self.assertGreaterEqual(w, 0.0)
+            self.assertLessEqual(w, ceiling)
+        self.assertGreater(len(set(waits)), 1)
+
+    def test_decorrelated_jitter_is_bounded(self):
+        waits = self._waits(websocket.BackoffStrategy.DECORRELATED_JITTER)
+        last = 1.0
+        for w in waits:
+            self.assertGreaterEqual(w, 1.0)
+            self.assertLessEqual(w, min(60.0, last * 3.0))
+            last = w
+        self.assertGreater(len(set(waits)), 1)
+
+    def test_connection_lost(self):
+        clock = backoff_sim.SimulatedClock()
+        backoff = websocket.Backoff(
+            60.0, initial_backoff_second=1.0, clock=clock)
+        backoff.connection_lost()
+        self.assertEqual(backoff.seconds_until_ready(), 0.0)
+        backoff = websocket.Backoff(
+            60.0, initial_backoff_second=1.0, clock=clock,
+            strategy=websocket.BackoffStrategy.DECORRELATED_JITTER)
+        backoff.connection_lost()
+        self.assertGreaterEqual(backoff.seconds_until_ready(), 1.0)
+        backoff.activity()
+        self.assertEqual(backoff.seconds_until_ready(), 0.0)
+
+    def test_bad_strategy(self):
+        self.assertRaises(exceptions.AgentOptionValueException,
+                          websocket.Backoff, 60.0, strategy="linear")
+
+    def test_jitter_lowers_the_reconnect_peak(self):
+        exponential = backoff_sim.simulate(
+            websocket.BackoffStrategy.EXPONENTIAL, agents=500, capacity=50)
+        self.assertEqual(exponential.peak_rate, 500)
+        for strategy in [websocket.BackoffStrategy.FULL_JITTER,
+                         websocket.BackoffStrategy.DECORRELATED_JITTER]:
+            result = backoff_sim.simulate(strategy, agents=500, capacity=50)
+            self.assertLess(result.peak_rate, exponential.peak_rate)
+            self.assertLess(result.attempts, exponential.attempts)
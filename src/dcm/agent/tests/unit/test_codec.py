@@ -0,0 +1,61 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import json
+import unittest
+
+import mock
+
+import dcm.agent.codec as codec
+import dcm.agent.tests.utils.general as test_utils
+
+
+class TestCodec(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        test_utils.connect_to_debugger()
+
+    def test_round_trip(self):
+        doc = {"type": "REPLY", "request_id": "abc", "message_id": "def",
+               "payload": {"return_code": 0, "list": [1, 2.5, None, True],
+                           "unicode": "é中"}}
+        encoded = codec.dumps(doc)
+        self.assertIsInstance(encoded, str)
+        self.assertEqual(json.loads(encoded), doc)
+        self.assertEqual(codec.loads(encoded), doc)
+
+    def test_loads_bytes(self):
+        doc = {"type": "ACK", "unicode": "é"}
+        data = json.dumps(doc).encode()
+        self.assertEqual(codec.loads(data), doc)
+        self.assertEqual(codec.loads(bytearray(data)), doc)
+
+    def test_loads_invalid(self):
+        self.assertRaises(ValueError, codec.loads, b"{not json")
+
+    def test_dumps_unsupported(self):
+        self.assertRaises(TypeError, codec.dumps, {"x": object()})
+
+    def test_dumps_falls_back_to_json(self):
+        big = 2 ** 70
+        self.assertEqual(json.loads(codec.dumps({"n": big})), {"n": big})
+
+    def test_fast_encoder_errors_fall_back(self):
+        def _fail(obj):
+            raise TypeError("unsupported")
+
+        with mock.patch.object(codec, "_fast_dumps", _fail):
+            self.assertEqual(codec.dumps({"a": 1}), json.dumps({"a": 1}))
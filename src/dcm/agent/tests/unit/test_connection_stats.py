@@ -0,0 +1,134 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+import dcm.agent.connection.stats as conn_stats
+import dcm.agent.tests.utils.general as test_utils
+
+
+class _Clock(object):
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestConnectionStats(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        test_utils.connect_to_debugger()
+
+    def setUp(self):
+        self.clock = _Clock()
+        self.stats = conn_stats.ConnectionStats(clock=self.clock)
+
+    def test_frame_counters(self):
+        self.stats.frame_sent(10)
+        self.stats.frame_sent(20)
+        self.stats.frame_received(5)
+        s = self.stats.get_stats()
+        self.assertEqual(s["frames_out"], 2)
+        self.assertEqual(s["bytes_out"], 30)
+        self.assertEqual(s["frames_in"], 1)
+        self.assertEqual(s["bytes_in"], 5)
+
+    def test_time_in_each_state(self):
+        self.stats.state_changed("WAITING")
+        self.clock.now += 2.0
+        self.stats.state_changed("OPEN")
+        self.clock.now += 5.0
+        self.stats.state_changed("WAITING")
+        self.clock.now += 1.0
+        s = self.stats.get_stats()
+        self.assertEqual(s["state"], "WAITING")
+        self.assertAlmostEqual(s["time_in_state"], 1.0)
+        self.assertAlmostEqual(s["state_times"]["WAITING"], 3.0)
+        self.assertAlmostEqual(s["state_times"]["OPEN"], 5.0)
+
+    def test_handshakes_and_reconnects(self):
+        for duration in (0.5, 0.25):
+            self.stats.handshake_started()
+            self.clock.now += duration
+            self.stats.handshake_finished(True)
+        self.stats.handshake_started()
+        self.stats.handshake_finished(False)
+        s = self.stats.get_stats()
+        self.assertEqual(s["connects"], 2)
+        self.assertEqual(s["reconnects"], 1)
+        self.assertAlmostEqual(s["last_handshake_time"], 0.0)
+        self.assertEqual(s["handshake_time"]["count"], 3)
+
+    def test_round_trip_time(self):
+        payload = self.stats.next_ping()
+        self.clock.now += 0.1
+        self.assertAlmostEqual(
+            self.stats.pong_received(payload.encode()), 0.1)
+        payload = self.stats.next_ping()
+        self.clock.now += 0.9
+        self.stats.pong_received(payload)
+        s = self.stats.get_stats()
+        self.assertAlmostEqual(s["last_rtt"], 0.9)
+        self.assertAlmostEqual(s["smoothed_rtt"],
+                               0.1 + conn_stats.RTT_SMOOTHING * 0.8)
+        self.assertEqual(s["rtt"]["count"], 2)
+
+    def test_unknown_pongs_are_ignored(self):
+        self.assertIsNone(self.stats.pong_received(b"beep"))
+        payload = self.stats.next_ping()
+        self.stats.pong_received(payload)
+        self.assertIsNone(self.stats.pong_received(payload))
+        self.assertEqual(self.stats.get_stats()["rtt"]["count"], 1)
+
+    def test_outstanding_pings_are_bounded(self):
+        first = self.stats.next_ping()
+        for _ in range(conn_stats.MAX_OUTSTANDING_PINGS):
+            self.stats.next_ping()
+        self.assertIsNone(self.stats.pong_received(first))
+
+
+class TestStatsSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+        conn_stats.set_active_connection(None)
+
+    def test_write_and_read(self):
+        path = os.path.join(self.test_dir, conn_stats.SNAPSHOT_FILE_NAME)
+        self.assertIsNone(conn_stats.read_snapshot(path))
+        stats = conn_stats.ConnectionStats().get_stats()
+        conn_stats.write_snapshot(path, stats)
+        written_at, read_stats = conn_stats.read_snapshot(path)
+        self.assertEqual(read_stats, stats)
+        self.assertFalse(os.path.exists(path + ".tmp"))
+
+    def test_active_connection(self):
+        self.assertIsNone(conn_stats.get_active_connection_stats())
+        conn = mock.Mock()
+        conn.get_connection_stats.return_value = {"frames_out": 1}
+        conn_stats.set_active_connection(conn)
+        self.assertEqual(conn_stats.get_active_connection_stats(),
+                         {"frames_out": 1})
@@ -108,3 +108,30 @@ class TestLoggingClear(unittest.TestCase):
         self.assertEqual(log_dict['type'], "LOG")
         self.assertEqual(log_dict['level'], "ERROR")
         self.assertEqual(urllib.parse.unquote(log_dict['message']), msg)
+
+
+class TestLoggingHandler(unittest.TestCase):
+    # needs no logging configuration so that it runs on its own
+
+    def setUp(self):
+        dcm_events.reset()
+        self.conn = mock.Mock()
+        self.handler = logger.dcmLogger()
+        self.handler.set_conn(mock.Mock(), self.conn)
+        self.my_logger = logging.getLogger(str(uuid.uuid4()))
+        self.my_logger.propagate = False
+        self.my_logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.my_logger.removeHandler(self.handler)
+        dcm_events.reset()
+
+    def test_logging_handler_coalesces_records(self):
+        for i in range(10):
+            self.my_logger.error("burst message %d" % i)
+        self.assertEqual(dcm_events.get_pending_count(), 1)
+        dcm_events.poll(timeblock=0.0)
+        self.assertEqual(self.conn.send.call_count, 10)
+        args, kwargs = self.conn.send.call_args
+        self.assertEqual(urllib.parse.unquote(args[0]['message']),
+                         "burst message 9")
@@ -0,0 +1,213 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import socket
+import time
+import unittest
+
+import mock
+
+import dcm.agent.connection.endpoints as endpoints
+import dcm.agent.connection.websocket as websocket
+import dcm.agent.handshake as handshake
+import dcm.agent.tests.utils.general as test_utils
+import dcm.agent.tests.utils.ws_server as ws_server
+
+from dcm.agent.events.globals import global_space as dcm_events
+
+
+class _Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestEndpointSelector(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        test_utils.connect_to_debugger()
+
+    def setUp(self):
+        self.clock = _Clock()
+        self.latencies = {"ws://a": 0.3, "ws://b": 0.01, "ws://c": 0.1}
+        self.selector = endpoints.EndpointSelector(
+            ["ws://a", "ws://b", "ws://c"], cool_off=5.0, max_cool_off=60.0,
+            probe_interval=100.0, probe=self._probe, clock=self.clock)
+
+    def _probe(self, urls, timeout):
+        return dict((url, self.latencies.get(url)) for url in urls)
+
+    def test_parse_urls(self):
+        self.assertEqual(endpoints.parse_urls("ws://a"), ["ws://a"])
+        self.assertEqual(endpoints.parse_urls(" ws://a, ws://b,,ws://a "),
+                         ["ws://a", "ws://b"])
+        self.assertEqual(endpoints.parse_urls(["ws://a", "ws://b"]),
+                         ["ws://a", "ws://b"])
+
+    def test_configured_order_before_probing(self):
+        self.assertEqual(self.selector.select(), "ws://a")
+
+    def test_fastest_after_probe(self):
+        self.assertTrue(self.selector.probe_due())
+        self.selector.probe()
+        self.assertFalse(self.selector.probe_due())
+        self.assertEqual(self.selector.select(), "ws://b")
+        self.clock.now += 100.0
+        self.assertTrue(self.selector.probe_due())
+
+    def test_single_endpoint_is_never_probed(self):
+        selector = endpoints.EndpointSelector(["ws://a"], probe=self._probe)
+        self.assertFalse(selector.probe_due())
+
+    def test_failover_and_recovery(self):
+        self.selector.probe()
+        self.assertTrue(self.selector.failed("ws://b"))
+        self.assertEqual(self.selector.select(), "ws://c")
+        self.clock.now += 5.0
+        self.assertEqual(self.selector.select(), "ws://b")
+
+    def test_cool_off_doubles(self):
+        self.selector.probe()
+        self.selector.failed("ws://b")
+        self.clock.now += 5.0
+        self.selector.failed("ws://b")
+        self.clock.now += 9.0
+        self.assertEqual(self.selector.select(), "ws://c")
+        self.clock.now += 1.0
+        self.assertEqual(self.selector.select(), "ws://b")
+
+    def test_success_forgives_failures(self):
+        self.selector.probe()
+        self.selector.failed("ws://b")
+        self.selector.succeeded("ws://b", 0.01)
+        self.assertEqual(self.selector.select(), "ws://b")
+
+    def test_connection_time_does_not_rank(self):
+        self.selector.probe()
+        fastest = self.selector.select()
+        # a full connection includes TLS and the upgrade so it is always
+        # slower than a probe, it must not push the endpoint down the list
+        self.selector.succeeded(fastest, 10.0)
+        self.assertEqual(self.selector.select(), fastest)
+        stats = dict((s["url"], s) for s in self.selector.get_stats())
+        self.assertEqual(stats[fastest]["connect_time"], 10.0)
+
+    def test_all_down(self):
+        for url in ("ws://a", "ws://b"):
+            self.assertTrue(self.selector.failed(url))
+        self.clock.now += 1.0
+        self.assertFalse(self.selector.failed("ws://c"))
+        # the one that comes back first
+        self.assertEqual(self.selector.select(), "ws://a")
+
+    def test_probe_marks_unreachable_down(self):
+        self.latencies["ws://b"] = None
+        self.selector.probe()
+        self.assertEqual(self.selector.select(), "ws://c")
+        stats = dict((s["url"], s) for s in self.selector.get_stats())
+        self.assertFalse(stats["ws://b"]["up"])
+        self.assertTrue(stats["ws://c"]["up"])
+
+    def test_connect_latency_probe(self):
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        closed = socket.socket()
+        closed.bind(("127.0.0.1", 0))
+        closed_port = closed.getsockname()[1]
+        closed.close()
+        try:
+            up = "ws://127.0.0.1:%d/ws" % listener.getsockname()[1]
+            down = "ws://127.0.0.1:%d/ws" % closed_port
+            results = endpoints.probe_connect_latency([up, down],
+                                                      timeout=2.0)
+        finally:
+            listener.close()
+        self.assertIsNotNone(results[up])
+        self.assertIsNone(results[down])
+
+
+class TestWebSocketFailover(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        test_utils.connect_to_debugger()
+
+    def setUp(self):
+        dcm_events.reset()
+        self.servers = [ws_server.LocalWsServer(latency=latency).start()
+                        for latency in (0.3, 0.0, 0.1)]
+        self.stopped = []
+        self.hs_manager = mock.Mock()
+        self.hs_manager.get_send_document.return_value = {"type": "HS"}
+        self.hs_manager.incoming_document.return_value = \
+            handshake.HandshakeIncomingReply(
+                handshake.HandshakeIncomingReply.REPLY_CODE_SUCCESS)
+
+    def tearDown(self):
+        for server in self.servers:
+            if server not in self.stopped:
+                server.stop()
+        dcm_events.reset()
+
+    def _probe(self, urls, timeout):
+        # loopback connects are all about the same so each stand-in
+        # server's artificial latency is added to the real measurement
+        latency = dict((s.get_url(), s.latency) for s in self.servers)
+        results = endpoints.probe_connect_latency(urls, timeout)
+        for url, measured in results.items():
+            if measured is not None:
+                results[url] = measured + latency[url]
+        return results
+
+    def _poll_until(self, check, timeout=10.0):
+        end = time.monotonic() + timeout
+        while not check():
+            if time.monotonic() > end:
+                return False
+            dcm_events.poll(timeblock=0.05)
+        return True
+
+    def test_fastest_then_failover(self):
+        slow, fast, medium = self.servers
+        # a backoff far longer than the test so that only failing over can
+        # reach the next endpoint in time
+        conn = websocket.WebSocketConnection(
+            ",".join(s.get_url() for s in self.servers),
+            backoff_amount=60000, max_backoff=600000)
+        conn._endpoints = endpoints.EndpointSelector(
+            [s.get_url() for s in self.servers], probe=self._probe)
+        conn.connect(lambda doc: None, self.hs_manager)
+        try:
+            self.assertTrue(self._poll_until(
+                lambda: len(fast.handshakes) == 1))
+            self.assertEqual(len(slow.handshakes), 0)
+            self.assertEqual(len(medium.handshakes), 0)
+
+            fast.stop()
+            self.stopped.append(fast)
+            self.assertTrue(self._poll_until(
+                lambda: len(medium.handshakes) == 1))
+            conn.send({"type": "LOG", "message": "after failover"})
+            self.assertTrue(self._poll_until(
+                lambda: len(medium.received) == 1))
+            self.assertEqual(len(slow.handshakes), 0)
+        finally:
+            conn.close()
+            conn.join(5.0)
@@ -305,3 +305,231 @@ class TestEventSpace(unittest.TestCase):
 
         event_space.poll(timeblock=d*2)
         self.assertEqual(len(x_val), 0)
+
+    def test_cancel_removes_callback(self):
+        event_space = events.EventSpace()
+
+        def test_callback():
+            pass
+
+        ub1 = event_space.register_callback(test_callback, delay=100.0)
+        ub2 = event_space.register_callback(test_callback)
+        self.assertTrue(event_space.cancel_callback(ub1))
+        self.assertTrue(event_space.cancel_callback(ub2))
+        self.assertEqual(event_space.get_pending_count(), 0)
+        self.assertFalse(event_space.poll(timeblock=0.0))
+
+    def test_thread_pool_reuses_threads(self):
+        event_space = events.EventSpace(max_threads=1, max_queue=10)
+        threads = []
+
+        def test_callback():
+            threads.append(threading.current_thread())
+
+        ubs = [event_space.register_callback(test_callback, in_thread=True)
+               for _ in range(5)]
+        event_space.poll(timeblock=0.0)
+        for ub in ubs:
+            ub.join()
+        self.assertEqual(len(threads), 5)
+        self.assertEqual(len(set(threads)), 1)
+        stats = event_space.get_thread_pool_stats()
+        self.assertEqual(stats['completed'], 5)
+        self.assertEqual(stats['rejected'], 0)
+        event_space.reset()
+        self.assertEqual(event_space.get_thread_pool_stats()['threads'], 0)
+
+    def test_thread_pool_retries_when_full(self):
+        event_space = events.EventSpace(max_threads=1, max_queue=1)
+        release = threading.Event()
+
+        def blocking_callback():
+            release.wait()
+
+        ubs = [event_space.register_callback(blocking_callback,
+                                             in_thread=True)
+               for _ in range(3)]
+        event_space.poll(timeblock=0.0)
+        stats = event_space.get_thread_pool_stats()
+        self.assertEqual(stats['rejected'], 1)
+        self.assertEqual(stats['active_threads'] + stats['queue_length'], 2)
+        # the rejected callback waits for a thread instead of being dropped
+        self.assertFalse(ubs[2].has_run())
+        self.assertEqual(event_space.get_pending_count(), 1)
+        release.set()
+        event_space.poll(timeblock=events.REJECTED_RETRY_DELAY * 4)
+        ubs[2].join()
+        self.assertIsNone(ubs[2].get_exception())
+        event_space.reset()
+
+    def test_connection_thread_runs_with_a_full_pool(self):
+        # a connection forming thread registered while the pool is full
+        # must still run or the connection never leaves CONNECTING
+        event_space = events.EventSpace(max_threads=1, max_queue=0)
+        release = threading.Event()
+        connected = threading.Event()
+        event_space.register_callback(release.wait, in_thread=True)
+        event_space.poll(timeblock=0.0)
+        ub = event_space.register_callback(connected.set, in_thread=True)
+        event_space.poll(timeblock=0.0)
+        self.assertFalse(connected.is_set())
+
+        threading.Timer(0.1, release.set).start()
+        event_space.poll(timeblock=0.5)
+        ub.join()
+        self.assertTrue(connected.is_set())
+        event_space.reset()
+
+    def test_cancel_a_retried_callback(self):
+        event_space = events.EventSpace(max_threads=1, max_queue=0)
+        release = threading.Event()
+        x_val = []
+        event_space.register_callback(release.wait, in_thread=True)
+        ub = event_space.register_callback(x_val.append, args=[1],
+                                           in_thread=True)
+        event_space.poll(timeblock=0.0)
+        self.assertTrue(event_space.cancel_callback(ub))
+        self.assertEqual(event_space.get_pending_count(), 0)
+        release.set()
+        event_space.poll(timeblock=events.REJECTED_RETRY_DELAY * 2)
+        self.assertEqual(x_val, [])
+        event_space.reset()
+
+    def test_loop_stats(self):
+        event_space = events.EventSpace()
+
+        def slow_callback():
+            time.sleep(0.05)
+
+        event_space.register_callback(slow_callback)
+        event_space.register_callback(slow_callback)
+        ub = event_space.register_callback(lambda: None, delay=10.0)
+        event_space.poll(timeblock=0.0)
+
+        stats = event_space.get_loop_stats()
+        self.assertEqual(stats['run_time']['count'], 2)
+        self.assertGreaterEqual(stats['run_time']['max'], 0.05)
+        # the second callback had to wait for the first one to finish
+        self.assertGreaterEqual(stats['wait_time']['max'], 0.05)
+        self.assertEqual(stats['functions']['slow_callback']['count'], 2)
+        self.assertEqual(stats['pending'], 1)
+        self.assertEqual(stats['oldest_overdue'], 0.0)
+
+        event_space.cancel_callback(ub)
+        event_space.get_loop_stats(clear=True)
+        self.assertEqual(event_space.get_loop_stats()['run_time']['count'],
+                         0)
+
+    def test_loop_stats_oldest_overdue(self):
+        event_space = events.EventSpace()
+        event_space.register_callback(lambda: None)
+        time.sleep(0.05)
+        stats = event_space.get_loop_stats()
+        self.assertEqual(stats['ready'], 1)
+        self.assertGreaterEqual(stats['oldest_overdue'], 0.05)
+        event_space.reset()
+
+    def test_high_priority_runs_first(self):
+        event_space = events.EventSpace()
+        order = []
+        event_space.register_callback(order.append, args=["low"],
+                                      priority=events.Priority.LOW)
+        event_space.register_callback(order.append, args=["normal"])
+        event_space.register_callback(order.append, args=["high"],
+                                      priority=events.Priority.HIGH)
+        event_space.poll(timeblock=0.0)
+        self.assertEqual(order, ["high", "normal", "low"])
+
+    def test_high_priority_jumps_a_backlog(self):
+        event_space = events.EventSpace()
+        order = []
+
+        def log_callback(i):
+            order.append(i)
+            if i == 0:
+                event_space.register_callback(
+                    order.append, args=["reply"],
+                    priority=events.Priority.HIGH)
+
+        for i in range(200):
+            event_space.register_callback(log_callback, args=[i],
+                                          priority=events.Priority.LOW)
+        event_space.poll(timeblock=0.2)
+        self.assertEqual(len(order), 201)
+        # the reply only waited for the rest of the batch it arrived in
+        self.assertLess(order.index("reply"), 20)
+
+    def test_low_priority_is_not_starved(self):
+        event_space = events.EventSpace(
+            lane_weights={events.Priority.HIGH: 4,
+                          events.Priority.NORMAL: 2,
+                          events.Priority.LOW: 1})
+        order = []
+
+        def high_callback(i):
+            order.append("high")
+            # keep the high lane busy forever
+            event_space.register_callback(high_callback, args=[i],
+                                          priority=events.Priority.HIGH)
+
+        for i in range(10):
+            event_space.register_callback(high_callback, args=[i],
+                                          priority=events.Priority.HIGH)
+        event_space.register_callback(order.append, args=["low"],
+                                      priority=events.Priority.LOW)
+        event_space.poll(timeblock=0.05)
+        event_space.wakeup(cancel_all=True)
+        self.assertIn("low", order)
+        self.assertLessEqual(order.index("low"), 7)
+        stats = event_space.get_loop_stats()
+        self.assertEqual(stats['lanes'], {"high": 0, "normal": 0, "low": 0})
+
+    def test_bad_priority(self):
+        event_space = events.EventSpace()
+        self.assertRaises(Exception, event_space.register_callback,
+                          lambda: None, priority=7)
+
+    def test_coalesced_callbacks_merge(self):
+        event_space = events.EventSpace()
+        calls = []
+        ubs = [event_space.register_coalesced("key", calls.append, args=[i])
+               for i in range(5)]
+        other = event_space.register_coalesced("other", calls.append,
+                                               args=["other"])
+        self.assertEqual(len(set(ubs)), 1)
+        self.assertNotEqual(ubs[0], other)
+        self.assertEqual(event_space.get_pending_count(), 2)
+        event_space.poll(timeblock=0.0)
+        # the latest arguments win
+        self.assertEqual(calls, [4, "other"])
+        self.assertEqual(event_space.get_loop_stats()['coalesced_merges'], 4)
+
+        # once it has run the key starts a new callback
+        ub = event_space.register_coalesced("key", calls.append, args=[5])
+        self.assertNotEqual(ub, ubs[0])
+        event_space.poll(timeblock=0.0)
+        self.assertEqual(calls, [4, "other", 5])
+
+    def test_coalesced_cancel(self):
+        event_space = events.EventSpace()
+        calls = []
+        ub1 = event_space.register_coalesced("key", calls.append, args=[1],
+                                             delay=10.0)
+        self.assertTrue(event_space.cancel_callback(ub1))
+        ub2 = event_space.register_coalesced("key", calls.append, args=[2])
+        self.assertNotEqual(ub1, ub2)
+        event_space.poll(timeblock=0.0)
+        self.assertEqual(calls, [2])
+
+    def test_coalesced_debounce(self):
+        event_space = events.EventSpace()
+        calls = []
+        ub = event_space.register_coalesced(
+            "key", calls.append, args=[1], delay=0.05, debounce=True)
+        first_ready = ub.get_time_ready()
+        time.sleep(0.02)
+        event_space.register_coalesced(
+            "key", calls.append, args=[2], delay=0.05, debounce=True)
+        self.assertGreater(ub.get_time_ready(), first_ready)
+        event_space.poll(timeblock=0.2)
+        self.assertEqual(calls, [2])
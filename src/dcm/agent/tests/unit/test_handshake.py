@@ -73,3 +73,7 @@ test=2
         self.assertIn("test", features)
         self.assertEqual(features["hello"], "world")
         self.assertEqual(features["test"], '2')
+        self.assertEqual(features["message_batching"],
+                         conf.connection_batch_max_bytes)
+        self.assertEqual(features["message_compression"],
+                         handshake.COMPRESSION_ZLIB)
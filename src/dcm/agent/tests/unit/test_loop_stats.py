@@ -0,0 +1,45 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import unittest
+
+import dcm.agent.events.loop_stats as loop_stats
+
+
+class TestLoopStats(unittest.TestCase):
+
+    def test_histogram_percentiles(self):
+        hist = loop_stats.Histogram(bounds=(0.1, 1.0, 10.0))
+        for _ in range(98):
+            hist.record(0.05)
+        hist.record(5.0)
+        hist.record(20.0)
+        stats = hist.get_stats()
+        self.assertEqual(stats['count'], 100)
+        self.assertEqual(stats['p50'], 0.1)
+        self.assertEqual(stats['p99'], 10.0)
+        self.assertEqual(stats['max'], 20.0)
+        self.assertEqual(stats['buckets'],
+                         [[0.1, 98], [1.0, 0], [10.0, 1], [None, 1]])
+
+    def test_function_names_are_capped(self):
+        stats = loop_stats.EventLoopStats(max_functions=2)
+        for name in ["a", "b", "c", "d"]:
+            stats.record(name, 0.0, 0.001)
+        functions = stats.get_stats()['functions']
+        self.assertEqual(sorted(functions.keys()),
+                         [loop_stats.OTHER_FUNCTIONS_NAME, "a", "b"])
+        self.assertEqual(
+            functions[loop_stats.OTHER_FUNCTIONS_NAME]['count'], 2)
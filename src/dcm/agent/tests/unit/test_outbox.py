@@ -0,0 +1,233 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import os
+import tempfile
+import unittest
+
+import mock
+
+import dcm.agent.connection.outbox as outbox
+import dcm.agent.connection.websocket as websocket
+import dcm.agent.handshake as handshake
+import dcm.agent.messaging.persistence as persistence
+import dcm.agent.messaging.types as message_types
+
+
+class TestOutbox(unittest.TestCase):
+
+    def setUp(self):
+        _, self.db_file = tempfile.mkstemp("test_db")
+        self.db = persistence.SQLiteAgentDB(self.db_file)
+
+    def tearDown(self):
+        self.db.close()
+        for f in [self.db_file + "-wal", self.db_file + "-shm",
+                  self.db_file]:
+            if os.path.exists(f):
+                os.remove(f)
+
+    def test_add_stamps_sequences(self):
+        box = outbox.Outbox(self.db)
+        docs = [{"type": "LOG", "n": i} for i in range(3)]
+        for d in docs:
+            box.add(d)
+        self.assertEqual([d["sequence"] for d in docs], [1, 2, 3])
+        self.assertEqual(box.get_unacked(), docs)
+        self.assertEqual(box.pending_count(), 3)
+
+    def test_ack_removes_documents(self):
+        box = outbox.Outbox(self.db)
+        docs = [{"type": "LOG", "n": i} for i in range(5)]
+        for d in docs:
+            box.add(d)
+        box.ack(3)
+        self.assertEqual(box.last_acked(), 3)
+        self.assertEqual(box.get_unacked(), docs[3:])
+        # acks can arrive out of order
+        box.ack(2)
+        self.assertEqual(box.last_acked(), 3)
+        box.ack_all()
+        self.assertEqual(box.get_unacked(), [])
+        self.assertEqual(box.pending_count(), 0)
+
+    def test_survives_a_restart(self):
+        box = outbox.Outbox(self.db)
+        for i in range(4):
+            box.add({"n": i})
+        box.ack(2)
+
+        db = persistence.SQLiteAgentDB(self.db_file)
+        box = outbox.Outbox(db)
+        self.assertEqual(box.last_acked(), 2)
+        self.assertEqual(box.get_unacked(),
+                         [{"n": 2, "sequence": 3}, {"n": 3, "sequence": 4}])
+        doc = {"n": 4}
+        self.assertEqual(box.add(doc), 5)
+
+        box.ack_all()
+        box = outbox.Outbox(persistence.SQLiteAgentDB(self.db_file))
+        self.assertEqual(box.add({"n": 5}), 6)
+
+    def test_manager_ahead_of_the_database(self):
+        box = outbox.Outbox(self.db)
+        box.add({"n": 0})
+        box.ack(100)
+        self.assertEqual(box.add({"n": 1}), 101)
+
+    def test_drop_oldest_when_full(self):
+        box = outbox.Outbox(self.db, max_documents=3)
+        docs = [{"n": i} for i in range(5)]
+        for d in docs:
+            box.add(d)
+        self.assertEqual(box.get_unacked(), docs[2:])
+        self.assertEqual(box.pending_count(), 3)
+        self.assertEqual(box.dropped_count(), 2)
+        box.ack(4)
+        self.assertEqual(box.get_unacked(), docs[4:])
+
+    def test_drop_newest_when_full(self):
+        box = outbox.Outbox(
+            self.db, max_documents=2,
+            overflow=websocket.SendQueueOverflow.DROP_NEWEST)
+        docs = [{"n": i} for i in range(3)]
+        self.assertEqual([box.add(d) for d in docs], [1, 2, None])
+        self.assertNotIn("sequence", docs[2])
+        self.assertEqual(box.get_unacked(), docs[:2])
+        self.assertEqual(box.dropped_count(), 1)
+
+    def test_writes_join_the_group_commit_batch(self):
+        self.db.start_group_commit(60)
+        try:
+            box = outbox.Outbox(self.db)
+            commits = self.db.get_commit_stats()["commits"]
+            for i in range(10):
+                box.add({"n": i})
+            box.ack(5)
+            self.assertEqual(self.db.get_commit_stats()["commits"], commits)
+            self.assertEqual(len(box.get_unacked()), 5)
+        finally:
+            self.db.stop_group_commit()
+
+    def test_stamp_does_not_write(self):
+        box = outbox.Outbox(self.db)
+        doc = {"n": 0}
+        self.assertEqual(box.stamp(doc), 1)
+        self.assertEqual(self.db.outbox_get_after(0), [])
+        box.save()
+        self.assertEqual(self.db.outbox_get_after(0), [(1, doc)])
+
+    def test_ack_before_save(self):
+        box = outbox.Outbox(self.db)
+        box.stamp({"n": 0})
+        box.ack(1)
+        box.save()
+        self.assertEqual(self.db.outbox_get_after(0), [])
+
+
+class TestResumableSession(unittest.TestCase):
+
+    def setUp(self):
+        _, self.db_file = tempfile.mkstemp("test_db")
+        self.db = persistence.SQLiteAgentDB(self.db_file)
+        self.box = outbox.Outbox(self.db)
+        self.conn = websocket.WebSocketConnection(
+            "wss://localhost/ws", outbox=self.box)
+        self.conn._ws = mock.Mock()
+        self.conn._cond.acquire()
+
+    def tearDown(self):
+        self.conn._cond.release()
+        self.db.close()
+        for f in [self.db_file + "-wal", self.db_file + "-shm",
+                  self.db_file]:
+            if os.path.exists(f):
+                os.remove(f)
+
+    def _hs(self, last_sequence):
+        return handshake.HandshakeIncomingReply(
+            handshake.HandshakeIncomingReply.REPLY_CODE_SUCCESS,
+            last_sequence=last_sequence)
+
+    def test_send_goes_through_the_outbox(self):
+        doc = {"type": "LOG", "message_id": "a"}
+        self.conn.send(doc)
+        self.assertEqual(doc["sequence"], 1)
+        self.assertEqual(self.box.get_unacked(), [doc])
+        self.assertEqual(self.conn._send_queue.get_all(), [doc])
+
+    def test_resume_replays_the_gap(self):
+        docs = [{"type": "LOG", "message_id": str(i)} for i in range(5)]
+        for d in docs:
+            self.conn.send(d)
+        self.conn._send_queue.get_all()
+        # one more that never left the queue and one without a sequence
+        late = {"type": "LOG", "message_id": "late"}
+        self.conn.send(late)
+        self.conn._send_queue.put("not a document")
+
+        self.assertTrue(self.conn._resume_session(self._hs(3)))
+        self.assertEqual(self.box.last_acked(), 3)
+        self.assertEqual(self.conn._send_queue.get_all(),
+                         docs[3:] + [late, "not a document"])
+
+    def test_manager_without_resume(self):
+        self.conn.send({"type": "LOG", "message_id": "a"})
+        self.assertFalse(self.conn._resume_session(self._hs(None)))
+        self.assertEqual(self.box.pending_count(), 0)
+
+    def test_handshake_offers_resume(self):
+        self.box.add({"n": 1})
+        self.box.ack(1)
+        self.conn._handshake_manager = mock.Mock()
+        self.conn._handshake_manager.get_send_document.return_value = {
+            "features": {}}
+        self.conn._sm_start_handshake()
+        sent = self.conn._ws.send.call_args[0][0]
+        hs_doc = websocket.codec.loads(sent)
+        self.assertTrue(hs_doc["features"]["resumable_session"])
+        self.assertEqual(hs_doc["last_sequence"], 1)
+
+    def test_retransmissions_are_not_sent_on_a_resumed_session(self):
+        self.conn._resumable = True
+        doc = {"type": "REPLY", "message_id": "a"}
+        self.conn.send(doc)
+        self.conn._send_queue.get_all()
+        self.conn.send(doc)
+        self.assertTrue(self.conn._send_queue.empty())
+
+        self.conn._resumable = False
+        self.conn.send(doc)
+        self.assertEqual(self.conn._send_queue.get_all(), [doc])
+        self.assertEqual(self.box.pending_count(), 1)
+
+    def test_no_outbox_after_a_manager_without_resume(self):
+        self.conn._resumable = self.conn._resume_session(self._hs(None))
+        self.conn._manager_resumes = self.conn._resumable
+        doc = {"type": "LOG", "message_id": "a"}
+        self.conn.send(doc)
+        self.assertNotIn("sequence", doc)
+        self.assertEqual(self.box.pending_count(), 0)
+
+    def test_seq_ack(self):
+        for i in range(3):
+            self.conn.send({"type": "LOG", "message_id": str(i)})
+        receive = mock.Mock()
+        self.conn._receive_callback = receive
+        self.conn._sm_open_incoming_message(
+            incoming_data={"type": message_types.MessageTypes.SEQ_ACK,
+                           "sequence": 2})
+        self.assertEqual(self.box.last_acked(), 2)
+        self.assertEqual(self.box.pending_count(), 1)
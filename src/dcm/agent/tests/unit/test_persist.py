@@ -16,12 +16,15 @@
 import datetime
 import json
 import os
+import sqlite3
 import tempfile
 import time
 import threading
 import unittest
 import uuid
 
+import mock
+
 import dcm.agent.exceptions as exceptions
 import dcm.agent.messaging.persistence as persistence
 import dcm.agent.messaging.states as messaging_states
@@ -198,7 +201,11 @@ class TestPersistDisk(unittest.TestCase):
         self.db = persistence.SQLiteAgentDB(self.db_file)
 
     def tearDown(self):
-        os.remove(self.db_file)
+        self.db.close()
+        for f in [self.db_file + "-wal", self.db_file + "-shm",
+                  self.db_file]:
+            if os.path.exists(f):
+                os.remove(f)
 
     def test_record_sweeper(self):
         request_id = str(uuid.uuid4())
@@ -211,11 +218,12 @@ class TestPersistDisk(unittest.TestCase):
         request_doc = {"request_id": request_id2}
         self.db.new_record(request_id2, request_doc, None, state, agent_id)
 
-        cleaner = persistence.DBCleaner(self.db, 10, 10, 0.05)
+        cleaner = persistence.DBCleaner(self.db, 0.1, 10, 0.05)
         cleaner.start()
 
         time.sleep(0.5)
         cleaner.done()
+        cleaner.join()
         res = self.db.lookup_req(request_id)
         self.assertTrue(not res)
         res = self.db.lookup_req(request_id2)
@@ -242,6 +250,189 @@ class TestPersistDisk(unittest.TestCase):
 
 
 
+class TestSchema(unittest.TestCase):
+
+    def setUp(self):
+        _, self.db_file = tempfile.mkstemp("test_db")
+
+    def tearDown(self):
+        for f in [self.db_file + "-wal", self.db_file + "-shm",
+                  self.db_file]:
+            if os.path.exists(f):
+                os.remove(f)
+
+    def test_new_db_is_current(self):
+        db = persistence.SQLiteAgentDB(self.db_file, journal_mode="WAL")
+        self.assertEqual(db.get_schema_version(),
+                         len(persistence._g_schema_migrations))
+        journal_mode = db._db_conn.execute(
+            "PRAGMA journal_mode").fetchone()[0]
+        self.assertEqual(journal_mode.lower(), "wal")
+        db.close()
+
+    def test_default_keeps_journal_mode(self):
+        # WAL sticks to the database file, opening with the defaults must
+        # not switch a database over to it
+        db = persistence.SQLiteAgentDB(self.db_file)
+        db.close()
+
+        conn = sqlite3.connect(self.db_file)
+        journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        conn.close()
+        self.assertEqual(journal_mode.lower(), "delete")
+
+    def test_open_without_migrating(self):
+        conn = sqlite3.connect(self.db_file)
+        conn.executescript(persistence._g_schema_migrations[0])
+        conn.execute("PRAGMA user_version=1")
+        conn.commit()
+        conn.close()
+
+        db = persistence.SQLiteAgentDB(self.db_file, migrate=False)
+        self.assertTrue(db.needs_migration())
+        self.assertEqual(db.get_schema_version(), 1)
+        db.close()
+
+        db = persistence.SQLiteAgentDB(self.db_file)
+        self.assertFalse(db.needs_migration())
+        db.close()
+
+    def test_migrate_unversioned_db(self):
+        # a database made by an agent from before the schema was versioned
+        request_id = str(uuid.uuid4())
+        conn = sqlite3.connect(self.db_file)
+        conn.executescript(persistence._g_sqllite_ddl)
+        conn.execute("INSERT INTO requests(request_id, state) VALUES(?, ?)",
+                     (request_id, messaging_states.ReplyStates.ACKED))
+        conn.commit()
+        conn.close()
+
+        db = persistence.SQLiteAgentDB(self.db_file)
+        self.assertEqual(db.get_schema_version(),
+                         len(persistence._g_schema_migrations))
+        self.assertEqual(db.lookup_req(request_id).state,
+                         messaging_states.ReplyStates.ACKED)
+        plan = db._db_conn.execute(
+            "EXPLAIN QUERY PLAN " + persistence._g_select_by_state,
+            (messaging_states.ReplyStates.ACKED,)).fetchall()
+        self.assertIn("requests_state_idx", str(plan))
+        plan = db._db_conn.execute(
+            "EXPLAIN QUERY PLAN " + persistence._g_delete_expired,
+            (datetime.datetime.now(),)).fetchall()
+        self.assertIn("requests_update_time_idx", str(plan))
+        db.close()
+
+    def test_migrate_backfills_command(self):
+        conn = sqlite3.connect(self.db_file)
+        conn.executescript(persistence._g_schema_migrations[0])
+        conn.executescript(persistence._g_schema_migrations[1])
+        conn.execute("PRAGMA user_version=2")
+        for request_id, doc in [
+                ("req1", '{"payload": {"command": "initialize"}}'),
+                ("req2", '{"payload": {}}'),
+                ("req3", 'not json')]:
+            conn.execute("INSERT INTO requests(request_id, request_doc, "
+                         "state) VALUES(?, ?, ?)",
+                         (request_id, doc,
+                          messaging_states.ReplyStates.REPLY_ACKED))
+        conn.commit()
+        conn.close()
+
+        db = persistence.SQLiteAgentDB(self.db_file)
+        self.assertEqual(db.get_schema_version(),
+                         len(persistence._g_schema_migrations))
+        self.assertEqual(db.lookup_req("req1").command, "initialize")
+        self.assertIsNone(db.lookup_req("req2").command)
+        self.assertIsNone(db.lookup_req("req3").command)
+        db.close()
+
+    def test_migrate_backfills_command_in_chunks(self):
+        conn = sqlite3.connect(self.db_file)
+        conn.executescript(persistence._g_schema_migrations[0])
+        conn.executescript(persistence._g_schema_migrations[1])
+        conn.execute("PRAGMA user_version=2")
+        for i in range(7):
+            conn.execute("INSERT INTO requests(request_id, request_doc, "
+                         "state) VALUES(?, ?, ?)",
+                         ("req%d" % i,
+                          '{"payload": {"command": "cmd%d"}}' % i,
+                          messaging_states.ReplyStates.REPLY_ACKED))
+        conn.commit()
+        conn.close()
+
+        with mock.patch.object(persistence, "_g_migrate_chunk_size", 3):
+            db = persistence.SQLiteAgentDB(self.db_file)
+        for i in range(7):
+            self.assertEqual(db.lookup_req("req%d" % i).command, "cmd%d" % i)
+        db.close()
+
+    def test_reopen_does_not_migrate(self):
+        persistence.SQLiteAgentDB(self.db_file).close()
+        version = len(persistence._g_schema_migrations)
+        with mock.patch.object(persistence, "_g_schema_migrations",
+                               ["THIS IS NOT SQL"]):
+            db = persistence.SQLiteAgentDB(self.db_file)
+        self.assertEqual(db.get_schema_version(), version)
+        db.close()
+
+    def test_memory_db(self):
+        db = persistence.SQLiteAgentDB(":memory:")
+        self.assertEqual(db.get_schema_version(),
+                         len(persistence._g_schema_migrations))
+        self.assertEqual(db.get_all_ack(), [])
+
+    def test_state_with_quotes(self):
+        db = persistence.SQLiteAgentDB(self.db_file)
+        self.assertEqual(db._get_all_state('x" OR "1"="1'), [])
+        db.close()
+
+
+class TestStatusQueries(unittest.TestCase):
+
+    def setUp(self):
+        self.db = persistence.SQLiteAgentDB(":memory:")
+        self.agent_id = str(uuid.uuid4())
+
+    def _new_record(self, command, state):
+        request_id = str(uuid.uuid4())
+        request_doc = {"request_id": request_id,
+                       "payload": {"command": command}}
+        self.db.new_record(request_id, request_doc, None, state,
+                           self.agent_id)
+        return request_id
+
+    def test_count_by_state(self):
+        self.assertEqual(self.db.count_by_state(), {})
+        for _ in range(3):
+            self._new_record("heartbeat",
+                             messaging_states.ReplyStates.REPLY_ACKED)
+        self._new_record("heartbeat", messaging_states.ReplyStates.ACKED)
+        self.assertEqual(
+            self.db.count_by_state(),
+            {messaging_states.ReplyStates.REPLY_ACKED: 3,
+             messaging_states.ReplyStates.ACKED: 1})
+
+    def test_command_states(self):
+        self.assertEqual(self.db.get_command_states("initialize"), [])
+        self._new_record("heartbeat", messaging_states.ReplyStates.NACKED)
+        request_id = self._new_record("initialize",
+                                      messaging_states.ReplyStates.ACKED)
+        self.assertEqual(self.db.get_command_states("initialize"),
+                         [messaging_states.ReplyStates.ACKED])
+        self.db.update_record(request_id,
+                              messaging_states.ReplyStates.REPLY_ACKED)
+        self.assertEqual(self.db.get_command_states("initialize"),
+                         [messaging_states.ReplyStates.REPLY_ACKED])
+        self.assertEqual(self.db.lookup_req(request_id).command,
+                         "initialize")
+
+    def test_command_index_used(self):
+        plan = self.db._db_conn.execute(
+            "EXPLAIN QUERY PLAN " + persistence._g_select_command_states,
+            ("initialize",)).fetchall()
+        self.assertIn("requests_command_idx", str(plan))
+
+
 class TestPersistMultiThread(unittest.TestCase):
 
     def setUp(self):
@@ -249,7 +440,11 @@ class TestPersistMultiThread(unittest.TestCase):
         self.db = persistence.SQLiteAgentDB(self.db_file)
 
     def tearDown(self):
-        os.remove(self.db_file)
+        self.db.close()
+        for f in [self.db_file + "-wal", self.db_file + "-shm",
+                  self.db_file]:
+            if os.path.exists(f):
+                os.remove(f)
 
     def test_thread_lookup(self):
         request_id = str(uuid.uuid4())
@@ -360,3 +555,274 @@ class TestPersistMultiThread(unittest.TestCase):
         self.assertTrue(res is not None)
         res = self.db.lookup_req(request_id2)
         self.assertTrue(res is not None)
+
+
+class TestGroupCommit(unittest.TestCase):
+
+    def setUp(self):
+        _, self.db_file = tempfile.mkstemp("test_db")
+        self.db = persistence.SQLiteAgentDB(self.db_file)
+        self.agent_id = str(uuid.uuid4())
+
+    def tearDown(self):
+        self.db.close()
+        for f in [self.db_file + "-wal", self.db_file + "-shm",
+                  self.db_file]:
+            if os.path.exists(f):
+                os.remove(f)
+
+    def _new_record(self, state=messaging_states.ReplyStates.ACKED):
+        request_id = str(uuid.uuid4())
+        self.db.new_record(request_id, {"request_id": request_id}, None,
+                           state, self.agent_id)
+        return request_id
+
+    def _lookup_from_disk(self, request_id):
+        # a second connection only sees what has been committed
+        db = persistence.SQLiteAgentDB(self.db_file)
+        try:
+            return db.lookup_req(request_id)
+        finally:
+            db.close()
+
+    def test_changes_visible_before_commit(self):
+        # a long interval so that the writer never runs during the test
+        self.db.start_group_commit(60)
+        request_id = self._new_record()
+        self.db.update_record(request_id,
+                              messaging_states.ReplyStates.REPLY,
+                              reply_doc={"return_code": 0})
+
+        rec = self.db.lookup_req(request_id)
+        self.assertEqual(rec.state, messaging_states.ReplyStates.REPLY)
+        self.assertEqual(len(self.db.get_all_reply()), 1)
+        self.assertIsNone(self._lookup_from_disk(request_id))
+        self.assertEqual(self.db.get_commit_stats()["pending_writes"], 2)
+
+        self.db.flush()
+        rec = self._lookup_from_disk(request_id)
+        self.assertEqual(rec.state, messaging_states.ReplyStates.REPLY)
+        self.assertEqual(self.db.get_commit_stats()["pending_writes"], 0)
+
+    def test_writer_batches_changes(self):
+        self.db.start_group_commit(0.01)
+        start = self.db.get_commit_stats()["commits"]
+        request_ids = [self._new_record() for _ in range(50)]
+        for request_id in request_ids:
+            self.db.update_record(request_id,
+                                  messaging_states.ReplyStates.REPLY_ACKED)
+
+        deadline = time.time() + 5.0
+        while self.db.get_commit_stats()["pending_writes"] and \
+                time.time() < deadline:
+            time.sleep(0.01)
+        stats = self.db.get_commit_stats()
+        self.assertEqual(stats["pending_writes"], 0)
+        self.assertEqual(stats["deferred_writes"], 100)
+        self.assertLess(stats["commits"] - start, 100)
+        for request_id in request_ids:
+            rec = self._lookup_from_disk(request_id)
+            self.assertEqual(rec.state,
+                             messaging_states.ReplyStates.REPLY_ACKED)
+
+    def test_failed_update_keeps_batch(self):
+        self.db.start_group_commit(60)
+        request_id = self._new_record()
+        self.assertRaises(exceptions.PersistenceException,
+                          self.db.update_record,
+                          "NotThere",
+                          messaging_states.ReplyStates.REPLY)
+        self.assertRaises(Exception,
+                          self.db.new_record,
+                          request_id, {"request_id": request_id}, None,
+                          messaging_states.ReplyStates.ACKED, self.agent_id)
+        self.db.flush()
+        rec = self._lookup_from_disk(request_id)
+        self.assertEqual(rec.state, messaging_states.ReplyStates.ACKED)
+
+    def test_immediate_write_commits_batch(self):
+        self.db.start_group_commit(60)
+        request_id = self._new_record()
+        self.db.add_alert(1, 1, "hash", 1, 1, "subject", "message")
+        self.assertEqual(self.db.get_commit_stats()["pending_writes"], 0)
+        self.assertIsNotNone(self._lookup_from_disk(request_id))
+
+    def test_stop_commits_pending(self):
+        self.db.start_group_commit(60)
+        request_id = self._new_record()
+        self.db.stop_group_commit()
+        self.assertIsNotNone(self._lookup_from_disk(request_id))
+
+        # once stopped every change is committed right away
+        request_id = self._new_record()
+        self.assertIsNotNone(self._lookup_from_disk(request_id))
+
+
+class TestMemoryRecordStore(unittest.TestCase):
+
+    def setUp(self):
+        self.store = persistence.MemoryRecordStore(max_records=3)
+        self.agent_id = str(uuid.uuid4())
+
+    def _new_record(self, request_id):
+        self.store.new_record(request_id, {"request_id": request_id}, None,
+                              messaging_states.ReplyStates.ACKED,
+                              self.agent_id)
+
+    def test_update_and_lookup(self):
+        self._new_record("req1")
+        self.store.update_record("req1", messaging_states.ReplyStates.REPLY,
+                                 reply_doc={"return_code": 0})
+        rec = self.store.lookup_req("req1")
+        self.assertEqual(rec.state, messaging_states.ReplyStates.REPLY)
+        self.assertEqual(rec.reply_doc, {"return_code": 0})
+        self.assertIsNone(self.store.lookup_req("NotThere"))
+
+    def test_update_not_there(self):
+        self.assertRaises(exceptions.PersistenceException,
+                          self.store.update_record,
+                          "NotThere", messaging_states.ReplyStates.REPLY)
+
+    def test_duplicate_record(self):
+        self._new_record("req1")
+        self.assertRaises(exceptions.PersistenceException,
+                          self._new_record, "req1")
+
+    def test_oldest_forgotten(self):
+        for i in range(4):
+            self._new_record("req%d" % i)
+        self.store.update_record("req1",
+                                 messaging_states.ReplyStates.REPLY_ACKED)
+        self._new_record("req4")
+        self.assertEqual(self.store.get_record_count(), 3)
+        self.assertIsNone(self.store.lookup_req("req0"))
+        self.assertIsNone(self.store.lookup_req("req2"))
+        self.assertIsNotNone(self.store.lookup_req("req1"))
+
+
+class TestDBCleaner(unittest.TestCase):
+
+    def setUp(self):
+        _, self.db_file = tempfile.mkstemp("test_db")
+        self.db = persistence.SQLiteAgentDB(self.db_file)
+        self.agent_id = str(uuid.uuid4())
+
+    def tearDown(self):
+        self.db.close()
+        for f in [self.db_file + "-wal", self.db_file + "-shm",
+                  self.db_file]:
+            if os.path.exists(f):
+                os.remove(f)
+
+    def _add_records(self, count, state, age=0, doc_size=0):
+        last_update = datetime.datetime.now() - datetime.timedelta(
+            seconds=age)
+        request_ids = []
+        for i in range(count):
+            request_id = str(uuid.uuid4())
+            request_doc = {"request_id": request_id, "data": "x" * doc_size}
+            self.db.new_record(request_id, request_doc, None, state,
+                               self.agent_id)
+            self.db._db_conn.execute(
+                "UPDATE requests SET last_update_time=? WHERE request_id=?",
+                (last_update, request_id))
+            request_ids.append(request_id)
+        self.db._db_conn.commit()
+        return request_ids
+
+    def test_expired_in_chunks(self):
+        self._add_records(25, messaging_states.ReplyStates.ACKED, age=120)
+        fresh = self._add_records(5, messaging_states.ReplyStates.ACKED)
+        cleaner = persistence.DBCleaner(self.db, 60, 0, 60, chunk_size=10,
+                                        chunk_pause=0)
+        with mock.patch.object(self.db, "clean_expired_chunk",
+                               wraps=self.db.clean_expired_chunk) as spy:
+            self.assertEqual(cleaner.sweep(), 25)
+        self.assertEqual(spy.call_count, 3)
+        self.assertTrue(all(c[0][1] <= 10 for c in spy.call_args_list))
+        self.assertEqual(self.db.get_request_count(), 5)
+        self.assertIsNotNone(self.db.lookup_req(fresh[0]))
+
+    def test_max_rows_removes_oldest_finished(self):
+        oldest = self._add_records(
+            15, messaging_states.ReplyStates.REPLY_ACKED, age=30)
+        active = self._add_records(
+            5, messaging_states.ReplyStates.ACKED, age=40)
+        newest = self._add_records(
+            15, messaging_states.ReplyStates.REPLY_NACKED)
+        cleaner = persistence.DBCleaner(self.db, 3600, 20, 60,
+                                        chunk_size=4, chunk_pause=0)
+        self.assertEqual(cleaner.sweep(), 15)
+        self.assertEqual(self.db.get_request_count(), 20)
+        for request_id in oldest:
+            self.assertIsNone(self.db.lookup_req(request_id))
+        for request_id in active + newest:
+            self.assertIsNotNone(self.db.lookup_req(request_id))
+
+    def test_max_rows_keeps_active(self):
+        self._add_records(10, messaging_states.ReplyStates.ACKED)
+        cleaner = persistence.DBCleaner(self.db, 3600, 5, 60, chunk_pause=0)
+        self.assertEqual(cleaner.sweep(), 0)
+        self.assertEqual(self.db.get_request_count(), 10)
+
+    def test_max_file_size(self):
+        self._add_records(200, messaging_states.ReplyStates.REPLY_ACKED,
+                          doc_size=4096)
+        full_size = self.db.get_size_info()["file_size"]
+        limit = 200 * 1024
+        cleaner = persistence.DBCleaner(self.db, 3600, 0, 60,
+                                        max_file_size=limit,
+                                        chunk_size=20, chunk_pause=0)
+        self.assertGreater(cleaner.sweep(), 0)
+        size_info = self.db.get_size_info()
+        self.assertLessEqual(size_info["used_size"], limit)
+        # the freed pages were given back to the file system
+        self.assertEqual(size_info["free_pages"], 0)
+        self.assertLess(size_info["file_size"], full_size)
+
+    def test_stats(self):
+        self._add_records(3, messaging_states.ReplyStates.REPLY_ACKED,
+                          age=120)
+        self._add_records(2, messaging_states.ReplyStates.REPLY_ACKED)
+        cleaner = persistence.DBCleaner(self.db, 60, 0, 60, chunk_pause=0)
+        cleaner.sweep()
+        cleaner.sweep()
+        stats = cleaner.get_stats()
+        self.assertEqual(stats["sweeps"], 2)
+        self.assertEqual(stats["rows_deleted"], 3)
+        self.assertEqual(stats["last_rows_deleted"], 0)
+        self.assertEqual(stats["request_count"], 2)
+        self.assertGreater(stats["file_size"], 0)
+        self.assertGreaterEqual(stats["sweep_time"],
+                                stats["last_sweep_time"])
+
+    def test_done_wakes_thread(self):
+        cleaner = persistence.DBCleaner(self.db, 60, 0, 60)
+        cleaner.start()
+        cleaner.done()
+        cleaner.join(5.0)
+        self.assertFalse(cleaner.is_alive())
+        self.assertEqual(cleaner.get_stats()["sweeps"], 0)
+
+    def test_old_db_switched_to_incremental_vacuum(self):
+        self.db.close()
+        os.remove(self.db_file)
+        conn = sqlite3.connect(self.db_file)
+        conn.execute("PRAGMA auto_vacuum=NONE")
+        conn.executescript(persistence._g_sqllite_ddl)
+        conn.close()
+        self.db = persistence.SQLiteAgentDB(self.db_file)
+        self._add_records(100, messaging_states.ReplyStates.REPLY_ACKED,
+                          age=120, doc_size=1024)
+        cleaner = persistence.DBCleaner(self.db, 60, 0, 60, chunk_pause=0)
+        cleaner.sweep()
+        # the sweeper never runs a full VACUUM
+        mode = self.db._db_conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        self.assertEqual(mode, 0)
+        self.assertGreater(self.db.get_size_info()["free_pages"], 0)
+
+        self.assertTrue(self.db.convert_auto_vacuum())
+        mode = self.db._db_conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        self.assertEqual(mode, 2)
+        self.assertEqual(self.db.get_size_info()["free_pages"], 0)
+        self.assertFalse(self.db.convert_auto_vacuum())
@@ -13,6 +13,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+import threading
+import time
 import unittest
 import uuid
 
@@ -155,3 +157,109 @@ class TestPubSub(unittest.TestCase):
 
         self._event_space.poll(timeblock=0.0)
         self.assertIn('done', x_val)
+
+    def test_wildcard_subscriptions(self):
+        calls = []
+
+        def make_cb(name):
+            def cb():
+                calls.append(name)
+            return cb
+
+        self._pub_sub.subscribe("agent.job.complete", make_cb("exact"))
+        self._pub_sub.subscribe("agent.*.complete", make_cb("star"))
+        self._pub_sub.subscribe("agent.#", make_cb("hash"))
+        self._pub_sub.subscribe("other.#", make_cb("other"))
+
+        self._pub_sub.publish("agent.job.complete")
+        self._event_space.poll(timeblock=0.0)
+        self.assertEqual(calls, ["exact", "star", "hash"])
+
+        calls[:] = []
+        self._pub_sub.publish("agent.upgrade.complete")
+        self._pub_sub.publish("agent")
+        self._pub_sub.publish("agent.job.complete.later")
+        self._event_space.poll(timeblock=0.0)
+        self.assertEqual(calls, ["star", "hash", "hash", "hash"])
+
+    def test_bad_wildcard(self):
+        self.assertRaises(Exception, self._pub_sub.subscribe,
+                          "agent.#.complete", lambda: None)
+
+    def test_subscriber_snapshot(self):
+        topic = str(uuid.uuid4())
+
+        def test_callback():
+            pass
+
+        self._pub_sub.subscribe(topic, test_callback)
+        subs = self._pub_sub.get_subscribers(topic)
+        # publishing again hands out the same tuple
+        self.assertIs(subs, self._pub_sub.get_subscribers(topic))
+        self._pub_sub.unsubscribe(topic, test_callback)
+        self.assertEqual(subs, (test_callback,))
+        self.assertEqual(self._pub_sub.get_subscribers(topic), ())
+
+    def test_parallel_delivery(self):
+        topic = str(uuid.uuid4())
+        release = threading.Event()
+        running = []
+
+        def test_callback1():
+            running.append(1)
+            release.wait(1.0)
+            return 1
+
+        def test_callback2():
+            running.append(2)
+            raise Exception("error")
+
+        def test_callback3():
+            running.append(3)
+            release.set()
+            return 3
+
+        done = []
+
+        def done_cb(topic_error, results=None, x_param=None):
+            done.append((topic_error, results, x_param))
+
+        self._pub_sub.subscribe(topic, test_callback1)
+        self._pub_sub.subscribe(topic, test_callback2)
+        self._pub_sub.subscribe(topic, test_callback3)
+        self._pub_sub.publish(topic, done_cb=done_cb,
+                              done_kwargs={'x_param': "x"}, parallel=True)
+
+        end = time.monotonic() + 5.0
+        while not done and time.monotonic() < end:
+            self._event_space.poll(timeblock=0.05)
+        self.assertEqual(len(done), 1)
+        topic_error, results, x_param = done[0]
+        self.assertEqual(x_param, "x")
+        # every subscriber ran even though one failed
+        self.assertEqual(sorted(running), [1, 2, 3])
+        self.assertIsNotNone(topic_error)
+        self.assertEqual([r.return_value for r in results], [1, None, 3])
+        self.assertIsNone(results[0].error)
+        self.assertIsNotNone(results[1].error)
+
+    def test_parallel_delivery_drained_with_the_event_space(self):
+        topic = str(uuid.uuid4())
+        started = threading.Event()
+        finished = []
+
+        def test_callback():
+            started.set()
+            time.sleep(0.1)
+            finished.append(1)
+
+        self._pub_sub.subscribe(topic, test_callback)
+        self._pub_sub.publish(topic, parallel=True)
+        self._event_space.poll(timeblock=0.0)
+        self.assertTrue(started.wait(5.0))
+        # the delivery runs on the event space's pool so stopping the event
+        # space waits for it
+        self._event_space.reset()
+        self.assertEqual(finished, [1])
+        self.assertEqual(
+            self._event_space.get_thread_pool_stats()['threads'], 0)
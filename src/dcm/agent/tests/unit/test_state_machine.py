@@ -0,0 +1,98 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import unittest
+
+import mock
+
+import dcm.agent.events.state_machine as state_machine
+import dcm.agent.exceptions as exceptions
+
+
+class _Owner(object):
+
+    _transitions = state_machine.TransitionTable()
+    _transitions.add_transition("A", "go", "B", "_sm_a_to_b")
+    _transitions.add_transition("B", "go", "A", None)
+
+    def __init__(self):
+        self.calls = []
+        self.sm = state_machine.StateMachine(
+            "A", table=self._transitions, owner=self)
+
+    def _sm_a_to_b(self, value=None):
+        self.calls.append(value)
+
+
+class TestStateMachine(unittest.TestCase):
+
+    def test_shared_table_calls_instance_methods(self):
+        owner1 = _Owner()
+        owner2 = _Owner()
+        owner1.sm.event_occurred("go", value=1)
+        self.assertEqual(owner1.calls, [1])
+        self.assertEqual(owner2.calls, [])
+        owner1.sm.event_occurred("go")
+        owner2.sm.event_occurred("go", value=2)
+        self.assertEqual(owner1.calls, [1])
+        self.assertEqual(owner2.calls, [2])
+        self.assertEqual(owner1.sm.get_event_list(),
+                         [("go", "A", "B"), ("go", "B", "A")])
+
+    def test_shared_table_illegal_transition(self):
+        owner = _Owner()
+        self.assertRaises(exceptions.IllegalStateTransitionException,
+                          owner.sm.event_occurred, "stop")
+
+    def test_shared_table_cannot_be_changed(self):
+        owner = _Owner()
+        self.assertRaises(exceptions.AgentRuntimeException,
+                          owner.sm.add_transition, "A", "stop", "C", None)
+
+    def test_per_instance_transitions(self):
+        calls = []
+        sm = state_machine.StateMachine("A")
+        sm.add_transition("A", "go", "B", lambda: calls.append("called"))
+        sm.event_occurred("go")
+        self.assertEqual(calls, ["called"])
+
+    def test_history_is_bounded(self):
+        sm = state_machine.StateMachine("A", history_size=4)
+        sm.add_transition("A", "go", "B", None)
+        sm.add_transition("B", "go", "A", None)
+        for _ in range(100):
+            sm.event_occurred("go")
+        events = sm.get_event_list()
+        self.assertEqual(len(events), 4)
+        self.assertEqual(events[-1], ("go", "B", "A"))
+
+    def test_no_debug_formatting_when_disabled(self):
+        logger = mock.Mock()
+        logger.isEnabledFor.return_value = False
+        sm = state_machine.StateMachine("A", logger=logger)
+        sm.add_transition("A", "go", "B", lambda: None)
+        sm.event_occurred("go")
+        self.assertFalse(logger.debug.called)
+
+    def test_observer_sees_state_changes(self):
+        states = []
+        sm = state_machine.StateMachine("A", observer=states.append)
+        sm.add_transition("A", "go", "B", None)
+        sm.add_transition("B", "stay", "B", None)
+        sm.add_transition("B", "go", "A", None)
+        sm.event_occurred("go")
+        sm.event_occurred("stay")
+        sm.event_occurred("go")
+        self.assertEqual(states, ["B", "A"])
@@ -0,0 +1,79 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import unittest
+
+import dcm.agent.events.timer_wheel as timer_wheel
+
+
+class TestTimerWheel(unittest.TestCase):
+
+    def test_nothing_expires_early(self):
+        wheel = timer_wheel.TimerWheel(0.0, resolution=0.01)
+        wheel.add("a", 0.5)
+        self.assertEqual(wheel.advance(0.49), [])
+        self.assertEqual(wheel.advance(0.5), ["a"])
+        self.assertEqual(len(wheel), 0)
+
+    def test_expire_in_order(self):
+        wheel = timer_wheel.TimerWheel(0.0, resolution=0.01)
+        wheel.add("c", 3.0)
+        wheel.add("a", 1.0)
+        wheel.add("b", 2.0)
+        self.assertEqual(wheel.advance(10.0), ["a", "b", "c"])
+
+    def test_cascade_through_levels(self):
+        wheel = timer_wheel.TimerWheel(0.0, resolution=0.01, slot_bits=2,
+                                       levels=3)
+        deadlines = [0.03, 0.05, 0.17, 0.4, 0.63, 1.0, 2.5]
+        for d in deadlines:
+            wheel.add(d, d)
+        now = 0.0
+        expired = []
+        while now < 3.0:
+            now += 0.01
+            for e in wheel.advance(now):
+                self.assertGreaterEqual(now + 0.0001, e)
+                expired.append(e)
+        self.assertEqual(expired, deadlines)
+
+    def test_remove(self):
+        wheel = timer_wheel.TimerWheel(0.0)
+        wheel.add("a", 1.0)
+        wheel.add("b", 1.0)
+        self.assertTrue(wheel.remove("a"))
+        self.assertFalse(wheel.remove("a"))
+        self.assertNotIn("a", wheel)
+        self.assertEqual(wheel.advance(2.0), ["b"])
+
+    def test_next_expiry(self):
+        wheel = timer_wheel.TimerWheel(0.0, resolution=0.01)
+        self.assertIsNone(wheel.next_expiry())
+        wheel.add("a", 0.25)
+        self.assertAlmostEqual(wheel.next_expiry(), 0.25)
+        wheel.add("b", 1000.0)
+        self.assertAlmostEqual(wheel.next_expiry(), 0.25)
+        wheel.advance(0.25)
+        nxt = wheel.next_expiry()
+        self.assertGreater(nxt, 0.25)
+        self.assertLessEqual(nxt, 1000.0)
+
+    def test_clear(self):
+        wheel = timer_wheel.TimerWheel(0.0)
+        wheel.add("a", 1.0)
+        wheel.add("b", 100000.0)
+        self.assertEqual(sorted(wheel.clear()), ["a", "b"])
+        self.assertEqual(len(wheel), 0)
+        self.assertEqual(wheel.advance(200000.0), [])
@@ -0,0 +1,106 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import shutil
+import ssl
+import tempfile
+import time
+import unittest
+
+import mock
+
+import dcm.agent.connection.websocket as websocket
+import dcm.agent.handshake as handshake
+import dcm.agent.tests.utils.general as test_utils
+import dcm.agent.tests.utils.ws_server as ws_server
+
+from dcm.agent.events.globals import global_space as dcm_events
+
+
+@unittest.skipIf(not ws_server.openssl_available(),
+                 "The openssl command is needed to make a certificate")
+class TestTLSSessionResumption(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        test_utils.connect_to_debugger()
+        cls.cert_dir = tempfile.mkdtemp()
+        cls.cert_file, cls.key_file = ws_server.make_self_signed_cert(
+            cls.cert_dir)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.cert_dir)
+
+    def setUp(self):
+        dcm_events.reset()
+        server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        server_context.load_cert_chain(self.cert_file, self.key_file)
+        self.server = ws_server.LocalWsServer(
+            ssl_context=server_context).start()
+        self.hs_manager = mock.Mock()
+        self.hs_manager.get_send_document.return_value = {"type": "HS"}
+        self.hs_manager.incoming_document.return_value = \
+            handshake.HandshakeIncomingReply(
+                handshake.HandshakeIncomingReply.REPLY_CODE_SUCCESS)
+
+    def tearDown(self):
+        self.server.stop()
+        dcm_events.reset()
+
+    def _poll_until(self, check, timeout=10.0):
+        end = time.monotonic() + timeout
+        while not check():
+            if time.monotonic() > end:
+                return False
+            dcm_events.poll(timeblock=0.05)
+        return True
+
+    def _reconnect_stats(self, resume):
+        conn = websocket.WebSocketConnection(
+            self.server.get_url(), backoff_amount=10, max_backoff=100,
+            ca_certs=self.cert_file, tls_session_resumption=resume)
+        conn.connect(lambda doc: None, self.hs_manager)
+        try:
+            self.assertTrue(self._poll_until(
+                lambda: len(self.server.handshakes) == 1))
+            self.server.drop_clients()
+            self.assertTrue(self._poll_until(
+                lambda: len(self.server.handshakes) == 2))
+            return conn.get_connection_stats()
+        finally:
+            conn.close()
+            conn.join(5.0)
+
+    def test_reconnect_resumes_the_session(self):
+        stats = self._reconnect_stats(True)
+        self.assertEqual(stats["tls_handshakes"], 2)
+        self.assertEqual(stats["tls_resumed"], 1)
+
+    def test_resumption_can_be_disabled(self):
+        stats = self._reconnect_stats(False)
+        self.assertEqual(stats["tls_handshakes"], 2)
+        self.assertEqual(stats["tls_resumed"], 0)
+
+    def test_untrusted_certificate_is_rejected(self):
+        conn = websocket.WebSocketConnection(
+            self.server.get_url(), backoff_amount=10, max_backoff=100)
+        conn.connect(lambda doc: None, self.hs_manager)
+        try:
+            self._poll_until(lambda: False, timeout=0.5)
+            self.assertEqual(self.server.handshakes, [])
+        finally:
+            conn.close()
+            conn.join(5.0)
@@ -0,0 +1,369 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import collections
+import json
+import socket
+import threading
+import unittest
+import zlib
+
+import mock
+import ws4py.messaging as ws4py_messaging
+
+import dcm.agent.connection.stats as conn_stats
+import dcm.agent.connection.websocket as websocket
+import dcm.agent.handshake as handshake
+import dcm.agent.messaging.types as message_types
+import dcm.agent.tests.utils.general as test_utils
+
+from dcm.agent.events.globals import global_space as dcm_events
+
+
+class TestWebSocketBatching(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        test_utils.connect_to_debugger()
+
+    def _get_conn(self, batch_max_bytes=1024, limit=1024):
+        conn = websocket.WebSocketConnection(
+            "wss://localhost/ws", batch_max_bytes=batch_max_bytes)
+        conn._ws = mock.Mock()
+        conn._batch_limit = limit
+        return conn
+
+    def _send(self, conn, docs):
+        writer = websocket._FrameWriter(
+            conn._ws, conn._batch_limit, mock.Mock())
+        writer._send_docs(
+            collections.deque(websocket.encode_documents(docs)))
+
+    def _sent_frames(self, conn):
+        return [json.loads(args[0])
+                for args, _ in conn._ws.send.call_args_list]
+
+    def test_queued_docs_are_batched(self):
+        conn = self._get_conn()
+        docs = [{"type": "LOG", "message": "msg %d" % i} for i in range(10)]
+        self._send(conn, docs)
+        frames = self._sent_frames(conn)
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(frames[0]["type"], message_types.MessageTypes.BATCH)
+        self.assertEqual(frames[0]["messages"], docs)
+
+    def test_batches_respect_the_limit(self):
+        conn = self._get_conn(limit=200)
+        docs = [{"type": "LOG", "message": "x" * 50, "n": i}
+                for i in range(10)]
+        self._send(conn, docs)
+        received = []
+        for args, _ in conn._ws.send.call_args_list:
+            self.assertLessEqual(len(args[0]), 200)
+            frame = json.loads(args[0])
+            if frame["type"] == message_types.MessageTypes.BATCH:
+                received.extend(frame["messages"])
+            else:
+                received.append(frame)
+        self.assertGreater(conn._ws.send.call_count, 1)
+        self.assertEqual(received, docs)
+
+    def test_no_batching_without_negotiation(self):
+        conn = self._get_conn(limit=0)
+        docs = [{"type": "LOG", "n": i} for i in range(3)]
+        self._send(conn, docs)
+        self.assertEqual(self._sent_frames(conn), docs)
+
+    def test_negotiate_batch_limit(self):
+        conn = self._get_conn(batch_max_bytes=1000)
+        hs = handshake.HandshakeIncomingReply(200)
+        self.assertEqual(conn._negotiate_batch_limit(hs), 0)
+        hs.message_batching = True
+        self.assertEqual(conn._negotiate_batch_limit(hs), 1000)
+        hs.message_batching = 500
+        self.assertEqual(conn._negotiate_batch_limit(hs), 500)
+        hs.message_batching = 5000
+        self.assertEqual(conn._negotiate_batch_limit(hs), 1000)
+        conn = self._get_conn(batch_max_bytes=0)
+        self.assertEqual(conn._negotiate_batch_limit(hs), 0)
+
+    def test_incoming_batch_is_split(self):
+        client = mock.Mock()
+        docs = [{"type": "ACK", "n": 1}, {"type": "REQUEST", "n": 2}]
+        m = mock.Mock()
+        m.is_binary = False
+        m.data = json.dumps(
+            {"type": message_types.MessageTypes.BATCH,
+             "messages": docs}).encode()
+        websocket._WebSocketClient.received_message(client, m)
+        calls = [args[0] for args, _ in
+                 client.manager.event_incoming_message.call_args_list]
+        self.assertEqual(calls, docs)
+
+
+class TestWebSocketCompression(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        test_utils.connect_to_debugger()
+
+    def _sent(self, ws):
+        frames = []
+        for args, kwargs in ws.send.call_args_list:
+            if kwargs.get("binary"):
+                frames.append(("binary", json.loads(zlib.decompress(args[0]))))
+            else:
+                frames.append(("text", json.loads(args[0])))
+        return frames
+
+    def test_large_frames_are_compressed(self):
+        ws = mock.Mock()
+        writer = websocket._FrameWriter(ws, 0, mock.Mock(),
+                                        compress_level=6,
+                                        compress_threshold=100)
+        small = {"type": "ACK"}
+        big = {"type": "REPLY", "payload": "x" * 1000}
+        writer._send_docs(collections.deque(
+            websocket.encode_documents([small, big])))
+        self.assertEqual(self._sent(ws),
+                         [("text", small), ("binary", big)])
+        self.assertLess(len(ws.send.call_args_list[1][0][0]), 200)
+
+    def test_batches_are_compressed(self):
+        ws = mock.Mock()
+        writer = websocket._FrameWriter(ws, 65536, mock.Mock(),
+                                        compress_level=1,
+                                        compress_threshold=0)
+        docs = [{"type": "LOG", "n": i} for i in range(5)]
+        writer._send_docs(
+            collections.deque(websocket.encode_documents(docs)))
+        frames = self._sent(ws)
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(frames[0][0], "binary")
+        self.assertEqual(frames[0][1]["messages"], docs)
+
+    def test_no_compression_without_negotiation(self):
+        ws = mock.Mock()
+        writer = websocket._FrameWriter(ws, 0, mock.Mock())
+        big = {"type": "REPLY", "payload": "x" * 10000}
+        writer._send_docs(collections.deque(
+            websocket.encode_documents([big])))
+        self.assertEqual(self._sent(ws), [("text", big)])
+
+    def test_negotiate_compression(self):
+        conn = websocket.WebSocketConnection(
+            "wss://localhost/ws", compression_level=6)
+        hs = handshake.HandshakeIncomingReply(200)
+        self.assertFalse(conn._negotiate_compression(hs))
+        hs.message_compression = handshake.COMPRESSION_ZLIB
+        self.assertTrue(conn._negotiate_compression(hs))
+        hs.message_compression = True
+        self.assertTrue(conn._negotiate_compression(hs))
+        hs.message_compression = "brotli"
+        self.assertFalse(conn._negotiate_compression(hs))
+        conn = websocket.WebSocketConnection(
+            "wss://localhost/ws", compression_level=0)
+        hs.message_compression = handshake.COMPRESSION_ZLIB
+        self.assertFalse(conn._negotiate_compression(hs))
+
+    def test_incoming_binary_is_decompressed(self):
+        client = mock.Mock()
+        doc = {"type": "REQUEST", "payload": "y" * 500}
+        m = mock.Mock()
+        m.is_binary = True
+        m.data = zlib.compress(json.dumps(doc).encode())
+        websocket._WebSocketClient.received_message(client, m)
+        client.manager.event_incoming_message.assert_called_once_with(doc)
+
+
+class TestFrameWriter(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        test_utils.connect_to_debugger()
+
+    def _get_conn(self):
+        conn = websocket.WebSocketConnection("wss://localhost/ws")
+        conn._ws = mock.Mock()
+        return conn
+
+    def test_open_poll_hands_docs_to_the_writer(self):
+        conn = self._get_conn()
+        conn._writer = mock.Mock()
+        docs = [{"type": "LOG", "n": i} for i in range(3)]
+        for d in docs:
+            conn._send_queue.put(d)
+        conn._sm_open_poll()
+        conn._writer.write.assert_called_once_with(
+            websocket.encode_documents(docs))
+        self.assertFalse(conn._ws.send.called)
+        self.assertTrue(conn._send_queue.empty())
+
+    def test_writer_sends_outside_the_poll(self):
+        conn = self._get_conn()
+        sent = threading.Event()
+        conn._ws.send.side_effect = lambda msg: sent.set()
+        conn._start_writer()
+        try:
+            conn._send_queue.put({"type": "LOG"})
+            conn._sm_open_poll()
+            self.assertTrue(sent.wait(5.0))
+            self.assertIsNot(conn._writer, None)
+        finally:
+            conn._stop_writer()
+        self.assertIs(conn._writer, None)
+        self.assertEqual(self._sent(conn), [{"type": "LOG"}])
+
+    def _sent(self, conn):
+        return [json.loads(args[0])
+                for args, _ in conn._ws.send.call_args_list]
+
+    def test_failed_write_requeues_and_throws(self):
+        conn = self._get_conn()
+        conn._ws.send.side_effect = socket.error("broken")
+        failed = threading.Event()
+
+        def _throw(ex, notify=True, attempt=None):
+            self.assertFalse(notify)
+            self.assertEqual(attempt, conn._attempt)
+            failed.set()
+
+        with mock.patch.object(conn, "_throw_error", side_effect=_throw):
+            conn._start_writer()
+            writer = conn._writer
+            docs = [{"type": "LOG", "n": i} for i in range(3)]
+            writer.write(websocket.encode_documents(docs))
+            self.assertTrue(failed.wait(5.0))
+            writer.join(5.0)
+        self.assertFalse(writer.is_alive())
+        self.assertFalse(
+            writer.write(websocket.encode_documents([{"type": "LOG"}])))
+        requeued = []
+        while not conn._send_queue.empty():
+            requeued.append(conn._send_queue.get(False))
+        self.assertEqual(requeued, docs)
+
+    def test_stop_returns_unsent_docs_to_the_queue(self):
+        conn = self._get_conn()
+        writer = websocket._FrameWriter(conn._ws, 0, mock.Mock())
+        conn._writer = writer
+        writer.write(websocket.encode_documents([{"type": "LOG"}]))
+        conn._stop_writer()
+        self.assertEqual(conn._send_queue.get(False), {"type": "LOG"})
+        self.assertFalse(conn._ws.send.called)
+
+
+class TestConnectionErrors(unittest.TestCase):
+
+    def setUp(self):
+        dcm_events.reset()
+        self.conn = websocket.WebSocketConnection("wss://localhost/ws")
+        self.conn._sm = mock.Mock()
+
+    def tearDown(self):
+        dcm_events.reset()
+
+    def test_errors_of_old_attempts_are_dropped(self):
+        self.conn._attempt = 1
+        self.conn._throw_error(Exception("old socket"), notify=False)
+        self.conn._attempt = 2
+        self.conn._throw_error(Exception("new socket"), notify=False)
+        self.conn._throw_error(Exception("new socket again"), notify=False)
+        # errors are only merged within an attempt
+        self.assertEqual(dcm_events.get_pending_count(), 2)
+        dcm_events.poll(timeblock=0.0)
+        self.conn._sm.event_occurred.assert_called_once_with(
+            websocket.WsConnEvents.ERROR)
+
+    def test_forming_thread_error_of_an_old_attempt(self):
+        self.conn._attempt = 2
+        self.conn._ws = mock.Mock()
+        self.conn._ws.connect.side_effect = socket.error("refused")
+        self.conn._forming_connection_thread(1)
+        self.assertFalse(self.conn._sm.event_occurred.called)
+        self.conn._forming_connection_thread(2)
+        self.conn._sm.event_occurred.assert_called_once_with(
+            websocket.WsConnEvents.ERROR)
+
+
+class TestConnectionStats(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        test_utils.connect_to_debugger()
+
+    def test_writer_counts_frames(self):
+        stats = conn_stats.ConnectionStats()
+        ws = mock.Mock()
+        writer = websocket._FrameWriter(ws, 0, mock.Mock(), stats=stats)
+        writer._send_docs(collections.deque(websocket.encode_documents(
+            [{"type": "LOG", "n": 1}, {"type": "LOG", "n": 2}])))
+        s = stats.get_stats()
+        self.assertEqual(s["frames_out"], 2)
+        self.assertEqual(s["bytes_out"],
+                         sum(len(args[0])
+                             for args, _ in ws.send.call_args_list))
+
+    def test_writer_pings_for_round_trip_time(self):
+        stats = conn_stats.ConnectionStats()
+        ws = mock.Mock()
+        pinged = threading.Event()
+
+        def _send(msg, binary=False):
+            if isinstance(msg, ws4py_messaging.PingControlMessage):
+                stats.pong_received(msg.data)
+                pinged.set()
+        ws.send.side_effect = _send
+        writer = websocket._FrameWriter(ws, 0, mock.Mock(), stats=stats,
+                                        ping_interval=0.01)
+        writer.start()
+        try:
+            self.assertTrue(pinged.wait(5.0))
+        finally:
+            writer.stop()
+            writer.join(5.0)
+        self.assertGreaterEqual(stats.get_stats()["rtt"]["count"], 1)
+
+    def test_state_times_and_handshake(self):
+        conn = websocket.WebSocketConnection("wss://localhost/ws")
+        conn._ws = mock.Mock()
+        conn._handshake_manager = mock.Mock()
+        conn._handshake_manager.get_send_document.return_value = {}
+        conn._handshake_manager.incoming_document.return_value = \
+            handshake.HandshakeIncomingReply(
+                handshake.HandshakeIncomingReply.REPLY_CODE_SUCCESS)
+        conn.lock()
+        try:
+            with mock.patch.object(conn, "_sm_connect", lambda: None):
+                conn._sm.event_occurred(
+                    websocket.WsConnEvents.CONNECT_TIMEOUT)
+            conn._sm.event_occurred(
+                websocket.WsConnEvents.CONNECTING_FINISHED)
+            conn._sm.event_occurred(
+                websocket.WsConnEvents.INCOMING_MESSAGE,
+                incoming_data={"return_code": 200})
+        finally:
+            conn.unlock()
+        dcm_events.reset()
+        s = conn.get_connection_stats()
+        self.assertEqual(s["state"], websocket.WsConnStates.HANDSHAKE_RECEIVED)
+        self.assertEqual(s["connects"], 1)
+        self.assertEqual(s["frames_out"], 1)
+        self.assertIsNotNone(s["last_handshake_time"])
+        for state in (websocket.WsConnStates.WAITING,
+                      websocket.WsConnStates.CONNECTING,
+                      websocket.WsConnStates.HANDSHAKING):
+            self.assertIn(state, s["state_times"])
+        self.assertEqual(s["send_queue"]["length"], 0)
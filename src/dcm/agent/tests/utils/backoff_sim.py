@@ -0,0 +1,102 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+A simulation of a fleet of agents reconnecting to an agent manager that
+restarted.
+
+Every agent has a websocket.Backoff that runs on a shared simulated clock.
+The stand-in server is down for outage_seconds and afterwards accepts at
+most capacity connections in any one second, the rest are refused and the
+agent backs off again just as a real handshake failure would make it.
+"""
+import collections
+import heapq
+import math
+import random
+
+import dcm.agent.connection.websocket as websocket
+
+
+SimulationResult = collections.namedtuple(
+    "SimulationResult",
+    ["strategy", "agents", "peak_rate", "attempts", "refused",
+     "all_connected_time"])
+
+
+class SimulatedClock(object):
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class StandInServer(object):
+    def __init__(self, outage_seconds, capacity):
+        self._outage_seconds = outage_seconds
+        self._capacity = capacity
+        self.attempts_per_second = collections.Counter()
+        self._accepted_per_second = collections.Counter()
+
+    def connect(self, now):
+        second = int(math.floor(now))
+        self.attempts_per_second[second] += 1
+        if now < self._outage_seconds:
+            return False
+        if self._accepted_per_second[second] >= self._capacity:
+            return False
+        self._accepted_per_second[second] += 1
+        return True
+
+
+def simulate(strategy, agents=1000, initial_backoff=1.0, max_backoff=300.0,
+             outage_seconds=10.0, capacity=100, seed=0):
+    """
+    :return: A SimulationResult.  peak_rate is the largest number of
+    connection attempts the server saw in a single second.
+    """
+    clock = SimulatedClock()
+    server = StandInServer(outage_seconds, capacity)
+    rng = random.Random(seed)
+    events = []
+    for i in range(agents):
+        backoff = websocket.Backoff(max_backoff,
+                                    initial_backoff_second=initial_backoff,
+                                    strategy=strategy, clock=clock, rng=rng)
+        # the manager went away while every agent was connected
+        backoff.connection_lost()
+        heapq.heappush(events, (backoff.seconds_until_ready(), i, backoff))
+
+    attempts = 0
+    refused = 0
+    while events:
+        clock.now, i, backoff = heapq.heappop(events)
+        attempts += 1
+        if server.connect(clock.now):
+            backoff.activity()
+            continue
+        refused += 1
+        backoff.error()
+        heapq.heappush(events,
+                       (clock.now + backoff.seconds_until_ready(), i, backoff))
+
+    return SimulationResult(
+        strategy=strategy,
+        agents=agents,
+        peak_rate=max(server.attempts_per_second.values()),
+        attempts=attempts,
+        refused=refused,
+        all_connected_time=clock.now)
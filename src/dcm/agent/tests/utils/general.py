@@ -26,6 +26,8 @@ import dcm.agent.utils as utils
 
 SYSTEM_CHANGING_TEST_ENV = "SYSTEM_CHANGING_TEST"
 
+PERFORMANCE_TEST_ENV = "DCM_AGENT_PERFORMANCE_TEST"
+
 S3_ACCESS_KEY_ENV = "AWS_ACCESS_KEY"
 S3_SECRET_KEY_ENV = "AWS_SECRET_KEY"
 
@@ -123,6 +125,18 @@ def aws_access_needed(func):
     return inner
 
 
+def performance_test(func):
+    def inner(*args, **kwargs):
+        if PERFORMANCE_TEST_ENV not in os.environ:
+            raise unittest.SkipTest(
+                "Test %s is a benchmark and can take a long time and a lot "
+                "of memory.  Set the environment variable %s to run it."
+                % (func.__name__, PERFORMANCE_TEST_ENV))
+        return func(*args, **kwargs)
+    inner.__name__ = func.__name__
+    return inner
+
+
 def skip_docker(func):
     def inner(*args, **kwargs):
         if os.path.exists("/.dockerinit"):
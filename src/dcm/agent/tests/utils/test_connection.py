@@ -170,6 +170,9 @@ class ReplyConnection(object):
     def set_request_side(self, request):
         self._request = request
 
+    def request_complete(self, request_id):
+        pass
+
     def close(self):
         pass
 
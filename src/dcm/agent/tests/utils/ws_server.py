@@ -0,0 +1,190 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+A small websocket server on the loopback interface that plays the agent
+manager in tests and benchmarks.  It runs an asyncio loop in its own
+thread, answers the first message of every connection as the handshake and
+records every document it receives after that.  latency seconds are added
+before the websocket upgrade is answered to stand in for a distant manager.
+"""
+import asyncio
+import base64
+import hashlib
+import os
+import shutil
+import subprocess
+import threading
+
+import ws4py.streaming as ws4py_streaming
+
+import dcm.agent.codec as codec
+import dcm.agent.connection.websocket as websocket
+
+
+_WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def openssl_available():
+    return shutil.which("openssl") is not None
+
+
+def make_self_signed_cert(directory):
+    """
+    Create a throw away certificate for localhost with the openssl command.
+    :return: The (certificate file, key file) paths.
+    """
+    cert_file = os.path.join(directory, "localhost.crt")
+    key_file = os.path.join(directory, "localhost.key")
+    subprocess.check_call(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+         "-days", "2", "-subj", "/CN=localhost",
+         "-keyout", key_file, "-out", cert_file],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return cert_file, key_file
+
+
+class LocalWsServer(object):
+
+    def __init__(self, handshake_reply=None, latency=0.0, ssl_context=None):
+        if handshake_reply is None:
+            handshake_reply = {"return_code": 200}
+        self._handshake_reply = handshake_reply
+        self.latency = latency
+        self._ssl_context = ssl_context
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever)
+        self._thread.daemon = True
+        self._server = None
+        self._writers = []
+        self._cond = threading.Condition()
+        self.received = []
+        self.handshakes = []
+        self.connections = 0
+        self.port = None
+
+    def start(self):
+        self._thread.start()
+        self._server = asyncio.run_coroutine_threadsafe(
+            asyncio.start_server(self._handle, "127.0.0.1", 0,
+                                 ssl=self._ssl_context),
+            self._loop).result()
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    def stop(self):
+        async def _close():
+            self._server.close()
+            for w in list(self._writers):
+                w.close()
+                await w.wait_closed()
+        asyncio.run_coroutine_threadsafe(_close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def get_url(self):
+        scheme = "ws"
+        if self._ssl_context is not None:
+            scheme = "wss"
+        return "%s://127.0.0.1:%d/ws" % (scheme, self.port)
+
+    def wait_for(self, count, timeout=10.0):
+        """
+        :return: A bool indicating if count documents were received before
+        the timeout.
+        """
+        self._cond.acquire()
+        try:
+            return self._cond.wait_for(
+                lambda: len(self.received) >= count, timeout)
+        finally:
+            self._cond.release()
+
+    def send(self, doc):
+        """
+        Send a document to every connected client.
+        """
+        frame = ws4py_streaming.Stream().text_message(
+            codec.dumps(doc)).single(mask=False)
+
+        def _send():
+            for w in self._writers:
+                w.write(frame)
+        self._loop.call_soon_threadsafe(_send)
+
+    def drop_clients(self):
+        def _drop():
+            for w in self._writers:
+                w.close()
+        self._loop.call_soon_threadsafe(_drop)
+
+    def _record(self, docs, handshake):
+        self._cond.acquire()
+        try:
+            if handshake:
+                self.handshakes.append(docs[0])
+                docs = docs[1:]
+            self.received.extend(docs)
+            self._cond.notify_all()
+        finally:
+            self._cond.release()
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        self._writers.append(writer)
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+            key = None
+            for line in request.decode("latin-1").split("\r\n"):
+                if line.lower().startswith("sec-websocket-key:"):
+                    key = line.split(":", 1)[1].strip()
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            accept = base64.b64encode(hashlib.sha1(
+                (key + _WS_GUID).encode()).digest()).decode()
+            writer.write(("HTTP/1.1 101 Switching Protocols\r\n"
+                          "Upgrade: websocket\r\n"
+                          "Connection: Upgrade\r\n"
+                          "Sec-WebSocket-Accept: %s\r\n\r\n"
+                          % accept).encode())
+
+            stream = ws4py_streaming.Stream(expect_masking=True)
+            size = 2
+            handshake = True
+            while True:
+                data = await reader.read(size)
+                if not data:
+                    break
+                size = stream.parser.send(data) or 2
+                if stream.closing is not None or stream.errors:
+                    break
+                for ping in stream.pings:
+                    writer.write(ws4py_streaming.Stream().pong(ping.data))
+                stream.pings = []
+                if stream.has_message:
+                    m = stream.message
+                    stream.message = None
+                    self._record(websocket.decode_frame(m.data, m.is_binary),
+                                 handshake)
+                    if handshake:
+                        handshake = False
+                        writer.write(ws4py_streaming.Stream().text_message(
+                            codec.dumps(self._handshake_reply)).single(
+                                mask=False))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._writers.remove(writer)
+            writer.close()
@@ -84,6 +84,7 @@ setup(name='dcm-agent',
                         "netifaces == 0.10.4",
                         "clint == 0.4.1",
                         "watchdog == 0.8.3"],
+      extras_require={"fastjson": ["orjson"]},
 
       package_data={"dcm.agent": ["dcm/agent/scripts/*",
                                   "dcm/agent/etc/*"],